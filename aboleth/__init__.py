@@ -1,24 +1,38 @@
 """Package init."""
 from . import likelihoods
 from . import distributions
+from . import runtime
+from . import serving
+from . import profiling
+from . import analysis
+from . import parallel
+from . import distributed
 from .version import __version__
 from .losses import elbo, max_posterior
-from .baselayers import stack
+from .baselayers import stack, posterior_mean, set_posterior_mean
 from .layers import (Activation, DropOut, MaxPool2D, Reshape, DenseVariational,
                      DenseMAP, InputLayer, EmbedVariational, RandomFourier,
-                     RandomArcCosine)
+                     RandomArcCosine, GroupedDenseVariational,
+                     MultiEmbedVariational, HashedEmbedVariational)
 from .hlayers import Concat, Sum, PerFeature
 from .impute import (MeanImpute, FixedNormalImpute, LearnedScalarImpute,
-                     LearnedNormalImpute)
+                     LearnedNormalImpute, RunningNormalImpute)
 from .kernels import RBF, Matern, RBFVariational
 from .distributions import (norm_prior, norm_posterior, gaus_posterior)
 from .util import (batch, pos, predict_expected, predict_samples,
-                   batch_prediction)
+                   predict_moments, batch_prediction, pack_mask)
 from .random import set_hyperseed
+from .export import export_net
 
 __all__ = (
     'likelihoods',
     'distributions',
+    'runtime',
+    'serving',
+    'profiling',
+    'analysis',
+    'parallel',
+    'distributed',
     '__version__',
     'elbo',
     'max_posterior',
@@ -29,6 +43,9 @@ __all__ = (
     'DenseVariational',
     'DenseMAP',
     'EmbedVariational',
+    'MultiEmbedVariational',
+    'HashedEmbedVariational',
+    'GroupedDenseVariational',
     'RandomFourier',
     'RandomArcCosine',
     'norm_prior',
@@ -38,10 +55,15 @@ __all__ = (
     'pos',
     'predict_expected',
     'predict_samples',
+    'predict_moments',
     'batch_prediction',
+    'pack_mask',
     'set_hyperseed',
+    'export_net',
     'InputLayer',
     'stack',
+    'posterior_mean',
+    'set_posterior_mean',
     'Sum',
     'Concat',
     'PerFeature',
@@ -49,6 +71,7 @@ __all__ = (
     'FixedNormalImpute',
     'LearnedScalarImpute',
     'LearnedNormalImpute',
+    'RunningNormalImpute',
     'RBF',
     'RBFVariational',
     'Matern'
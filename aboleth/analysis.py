@@ -0,0 +1,411 @@
+"""Static estimates of the memory use and FLOPs of composed nets.
+
+These estimates are computed from the layer configurations and the input
+shapes alone, without building or running a graph, so they can be used to
+check if a configuration will fit in memory before launching a job. They
+model the tensors the layers actually create, such as the tiled inputs, the
+stacked weight samples and the dense Cholesky factors of full covariance
+posteriors. They assume float32 data and training with gradients of all of
+the intermediate tensors retained, and are approximate.
+"""
+import numpy as np
+from multipledispatch import dispatch
+
+from aboleth.baselayers import (Layer, MultiLayer, LayerComposite,
+                                MultiLayerComposite)
+from aboleth.distributions import Normal
+from aboleth.hlayers import Concat, Sum, PerFeature
+from aboleth.impute import (ImputeOp, LearnedScalarImpute,
+                            LearnedNormalImpute, RunningNormalImpute)
+from aboleth.kernels import RBFVariational
+from aboleth.layers import (InputLayer, Activation, DropOut, MaxPool2D,
+                            Reshape, RandomFourier, RandomArcCosine,
+                            DenseVariational, EmbedVariational,
+                            MultiEmbedVariational, HashedEmbedVariational,
+                            GroupedDenseVariational, DenseMAP)
+
+
+FLOAT_BYTES = 4  # float32
+INT64_BYTES = 8
+
+
+def estimate(net, inputs, batch_size, n_samples=None, optimizer_slots=2):
+    r"""Estimate the parameters, memory and FLOPs of a net, per layer.
+
+    Parameters
+    ----------
+    net : Layer, MultiLayer
+        the net (e.g. a ``LayerComposite`` or ``MultiLayerComposite``) to
+        analyse. It does not need to have been built.
+    inputs : dict, tuple
+        if ``net`` is a ``MultiLayer``, a dict of the shapes of each of its
+        named inputs without the batch axis, e.g. ``{"X": (10,)}``, otherwise
+        the shape of a single input without the sample and batch axes.
+    batch_size : int
+        the number of rows (N) in a batch.
+    n_samples : int, optional
+        the number of samples of the input to a ``Layer`` net, for nets
+        starting with an ``InputLayer`` this is taken from that layer.
+    optimizer_slots : int
+        the number of copies of each parameter an optimizer keeps, e.g. 2 for
+        Adam, 1 for momentum and 0 for plain SGD.
+
+    Returns
+    -------
+    report : dict
+        with a ``"layers"`` list of dicts for each layer, with the layer
+        ``"scope"`` (named as the layer name scopes of a built net), its
+        ``"output_shape"``, the number of (trainable) ``"params"``, the bytes
+        of the tensors it creates in each step (``"activation_bytes"``) and
+        of the constants and non-trainable variables, such as running
+        statistics, in the graph (``"constant_bytes"``), and its
+        ``"forward_flops"`` and ``"backward_flops"``. The report also has the
+        totals of these, the ``"param_bytes"``, and the ``"peak_bytes"``,
+        which also counts the parameter gradients and optimizer slots.
+
+    Examples
+    --------
+    >>> net = (InputLayer(name="X", n_samples=50) >>
+    ...        RandomFourier(n_features=1500, kernel=RBFVariational()) >>
+    ...        DenseVariational(output_dim=1, full=True))
+    >>> report = estimate(net, {"X": (10,)}, batch_size=100)
+    >>> report["params"]
+    4534504
+    >>> report["layers"][-1]["output_shape"]
+    (50, 100, 1)
+
+    """
+    rows = []
+    if isinstance(net, MultiLayer):
+        _walk_multi(net, {k: (batch_size,) + tuple(v)
+                          for k, v in inputs.items()}, rows, "", {}, set())
+    else:
+        assert n_samples is not None, "n_samples is required for Layers!"
+        _walk(net, (n_samples, batch_size) + tuple(inputs), rows, "", {})
+
+    report = {"layers": rows}
+    for key in ("params", "activation_bytes", "constant_bytes",
+                "forward_flops", "backward_flops"):
+        report[key] = int(sum(r[key] for r in rows))
+    report["param_bytes"] = report["params"] * FLOAT_BYTES
+    report["peak_bytes"] = (report["param_bytes"] * (2 + optimizer_slots) +
+                            report["activation_bytes"] +
+                            report["constant_bytes"])
+    return report
+
+
+def format_estimate(report):
+    r"""Format a report from ``estimate`` as a table.
+
+    Parameters
+    ----------
+    report : dict
+        the output of ``estimate``.
+
+    Returns
+    -------
+    table : str
+        a table of the per-layer estimates, and the totals.
+
+    """
+    template = "{:<40} {:>20} {:>10} {:>12} {:>12} {:>12} {:>12}"
+    rows = [template.format("layer", "output shape", "params", "act (MB)",
+                            "const (MB)", "fwd flops", "bwd flops")]
+    for r in report["layers"] + [dict(report, scope="total",
+                                      output_shape="")]:
+        rows.append(template.format(
+            r["scope"], str(r["output_shape"]), r["params"],
+            "{:.1f}".format(r["activation_bytes"] / 2**20),
+            "{:.1f}".format(r["constant_bytes"] / 2**20),
+            "{:.3g}".format(r["forward_flops"]),
+            "{:.3g}".format(r["backward_flops"])))
+    rows.append("peak memory (MB): {:.1f}".format(
+        report["peak_bytes"] / 2**20))
+    return "\n".join(rows)
+
+
+#
+# Private module stuff
+#
+
+def _walk(layer, shape, rows, prefix, counts):
+    """Walk a Layer, appending the estimates of each layer to rows."""
+    if isinstance(layer, LayerComposite):
+        for l in layer.layers:
+            shape = _walk(l, shape, rows, prefix, counts)
+        return shape
+
+    scope = _scope(layer, prefix, counts)
+    if isinstance(layer, PerFeature):
+        *lead, D = shape
+        assert D == len(layer.layers), "Need a layer per feature!"
+        children = {}
+        outputs = [_walk(l, tuple(lead) + (1,), rows, scope + "/", children)
+                   for l in layer.layers]
+        out = tuple(lead) + (sum(o[-1] for o in outputs),)
+        cost = _costs(activations=2 * _size(out))  # slices and concat
+    else:
+        out, cost = _layer_cost(layer, shape)
+    rows.append(_row(scope, out, cost, bool(cost["params"])))
+    return out
+
+
+def _walk_multi(layer, inputs, rows, prefix, counts, shared):
+    """Walk a MultiLayer, appending the estimates of each layer to rows."""
+    if isinstance(layer, MultiLayerComposite):
+        first, *rest = layer.layers
+        shape = _walk_multi(first, inputs, rows, prefix, counts, shared)
+        for l in rest:
+            shape = _walk(l, shape, rows, prefix, counts)
+        return shape
+
+    scope = _scope(layer, prefix, counts)
+    if isinstance(layer, InputLayer):
+        shape = inputs[layer.name]
+        if layer.n_samples is None:
+            out, cost = shape, _costs()
+        else:
+            out = (layer.n_samples,) + shape
+            # Branches of Concat and Sum share their input tiling
+            key = (layer.name, layer.n_samples)
+            cost = _costs(activations=0 if key in shared else _size(out))
+            shared.add(key)
+
+    elif isinstance(layer, (Concat, Sum)):
+        children = {}
+        outputs = [_walk_multi(l, inputs, rows, scope + "/", children, shared)
+                   for l in layer.layers]
+        if isinstance(layer, Concat):
+            out = outputs[0][:-1] + (sum(o[-1] for o in outputs),)
+            cost = _costs(activations=_size(out))
+        else:
+            out = outputs[0]
+            cost = _costs(activations=_size(out),
+                          flops=(len(outputs) - 1) * _size(out))
+
+    elif isinstance(layer, ImputeOp):
+        children = {}
+        out = _walk_multi(layer.datalayer, inputs, rows, scope + "/",
+                          children, shared)
+        _walk_multi(layer.masklayer, inputs, rows, scope + "/", children,
+                    shared)
+        out, cost = _impute_cost(layer, out)
+
+    else:
+        raise ValueError("Cannot estimate layer {}!".format(layer))
+
+    rows.append(_row(scope, out, cost, bool(cost["params"])))
+    return out
+
+
+def _scope(layer, prefix, counts):
+    """Name a layer like its (unique) name scope in a built graph."""
+    name = type(layer).__name__
+    n = counts.get(name, 0)
+    counts[name] = n + 1
+    return prefix + (name if n == 0 else "{}_{}".format(name, n))
+
+
+def _row(scope, out, cost, has_params):
+    """Make the estimates of a layer, in bytes.
+
+    The backward pass is taken to cost twice the forward pass for layers with
+    parameters (gradients with respect to the inputs and the parameters),
+    otherwise the same as the forward pass.
+    """
+    row = {
+        "scope": scope,
+        "output_shape": tuple(int(d) for d in out),
+        "params": int(cost["params"]),
+        "activation_bytes": int(cost["activations"] * FLOAT_BYTES),
+        "constant_bytes": int(cost["constant_bytes"]),
+        "forward_flops": int(cost["flops"]),
+        "backward_flops": int(cost["flops"] * (2 if has_params else 1)),
+    }
+    return row
+
+
+def _costs(params=0, activations=0, constant_bytes=0, flops=0):
+    """Make a dict of the costs of a layer, in elements."""
+    return {"params": params, "activations": activations,
+            "constant_bytes": constant_bytes, "flops": flops}
+
+
+def _size(shape):
+    """Number of elements in a tensor of a shape."""
+    return int(np.prod(shape))
+
+
+@dispatch(Layer, tuple)
+def _layer_cost(layer, shape):
+    """Layers that are not supported."""
+    raise ValueError("Cannot estimate layer {}!".format(layer))
+
+
+@dispatch(Activation, tuple)  # noqa
+def _layer_cost(layer, shape):
+    """Elementwise activations."""
+    n = _size(shape)
+    return shape, _costs(activations=n, flops=n)
+
+
+@dispatch(DropOut, tuple)  # noqa
+def _layer_cost(layer, shape):
+    """Dropout makes a random mask, and the masked output."""
+    n = _size(shape)
+    return shape, _costs(activations=2 * n, flops=3 * n)
+
+
+@dispatch(Reshape, tuple)  # noqa
+def _layer_cost(layer, shape):
+    """Reshapes do not copy."""
+    return shape[:2] + tuple(layer.target_shape), _costs()
+
+
+@dispatch(MaxPool2D, tuple)  # noqa
+def _layer_cost(layer, shape):
+    """Max pooling of each sample."""
+    S, N, H, W, C = shape
+    _, kh, kw, _ = layer.ksize
+    _, sh, sw, _ = layer.strides
+    if layer.padding == "SAME":
+        Ho, Wo = -(-H // sh), -(-W // sw)
+    else:
+        Ho, Wo = (H - kh) // sh + 1, (W - kw) // sw + 1
+    out = (S, N, Ho, Wo, C)
+    return out, _costs(activations=_size(out), flops=_size(out) * kh * kw)
+
+
+@dispatch(RandomFourier, tuple)  # noqa
+def _layer_cost(layer, shape):
+    """Random features, the projection is tiled over the samples."""
+    S, N, D = shape
+    F = layer.n_features
+    variational = isinstance(layer.kernel, RBFVariational)
+    params = 2 * D * F if variational else 0
+    projection = S * D * F + S * N * F  # tiled weights, and XP
+    if isinstance(layer, RandomArcCosine):
+        out = (S, N, F)
+        activations = projection + 2 * S * N * F
+        flops = 2 * S * N * D * F + 3 * S * N * F
+    else:
+        out = (S, N, 2 * F)
+        activations = projection + 4 * S * N * F  # cos, sin, and concat
+        flops = 2 * S * N * D * F + 4 * S * N * F
+    return out, _costs(params=params, activations=activations,
+                       constant_bytes=D * F * FLOAT_BYTES, flops=flops)
+
+
+@dispatch(DenseVariational, tuple)  # noqa
+def _layer_cost(layer, shape):
+    """Variational dense layers, with one weight sample per sample."""
+    S, N, I = shape
+    O = layer.output_dim
+    cost = _weight_cost(layer, (I, O), S)
+    out = (S, N, O)
+    cost["activations"] += _size(out)
+    cost["flops"] += 2 * S * N * I * O
+    return out, _add_bias(layer, cost, out)
+
+
+@dispatch(GroupedDenseVariational, tuple)  # noqa
+def _layer_cost(layer, shape):
+    """Independent dense layers on each group of the inputs."""
+    S, N, I = shape
+    G, O = layer.n_groups, layer.output_dim
+    cost = _weight_cost(layer, (I, O), S, full=False)
+    out = (S, N, G * O)
+    cost["activations"] += 3 * S * N * I + _size(out)  # group transposes
+    cost["flops"] += 2 * S * N * I * O
+    return out, _add_bias(layer, cost, out)
+
+
+@dispatch(EmbedVariational, tuple)  # noqa
+def _layer_cost(layer, shape):
+    """Embeddings, only the rows in the batch are sampled (if diagonal)."""
+    S, N, C = shape
+    if isinstance(layer, MultiEmbedVariational):
+        n_index, out = N * C, (S, N, C * layer.output_dim)
+    elif isinstance(layer, HashedEmbedVariational):
+        n_index, out = N * layer.n_hashes, (S, N, layer.output_dim)
+    else:
+        n_index, out = N, (S, N, layer.output_dim)
+    return out, _embed_cost(layer, n_index, S, out)
+
+
+@dispatch(DenseMAP, tuple)  # noqa
+def _layer_cost(layer, shape):
+    """MAP dense layers, the weights are shared by all of the samples."""
+    S, N, *I = shape
+    I, O = _size(I), layer.output_dim
+    out = (S, N, O)
+    params = I * O + (O if layer.use_bias else 0)
+    return out, _costs(params=params, activations=2 * _size(out),
+                       flops=2 * S * N * I * O + 3 * I * O)
+
+
+def _weight_cost(layer, dim, S, full=None):
+    """The costs of the weight prior, posterior, samples and KL."""
+    I, O = dim
+    full = layer.full if full is None else full
+    if layer.qW is not None and not isinstance(layer.qW, Normal):
+        full = True
+    if full:
+        n_tril = I * (I + 1) // 2
+        return _costs(
+            params=I * O + O * n_tril + 1,
+            # dense Cholesky factors, and transformed samples
+            activations=O * I * I + 5 * S * I * O,
+            # initial Cholesky values (float64) and scatter indices
+            constant_bytes=(O + 1) * n_tril * INT64_BYTES,
+            # sampling, and the trace and log determinant of the KL
+            flops=2 * S * O * I * I + 3 * O * I * I)
+    return _costs(
+        params=2 * I * O + 1,
+        activations=2 * I * O + 4 * S * I * O,  # sigma, samples, and stack
+        flops=3 * S * I * O + 10 * I * O)
+
+
+def _add_bias(layer, cost, out):
+    """Add the costs of the bias of a variational layer."""
+    if layer.use_bias is True or layer.pb or layer.qb:
+        S, N, O = out
+        cost["params"] += 2 * O + 1
+        cost["activations"] += 4 * S * O + _size(out)
+        cost["flops"] += 3 * S * O + 10 * O + _size(out)
+    return cost
+
+
+def _embed_cost(layer, n_index, S, out):
+    """The costs of an embedding, where n_index indices are looked up."""
+    K, O = layer.n_categories, layer.output_dim
+    full = layer.full or (layer.qW is not None and
+                          not isinstance(layer.qW, Normal))
+    if full:
+        cost = _weight_cost(layer, (K, O), S, full=True)
+    else:
+        R = min(n_index, K)  # the unique rows in the batch
+        n_kl = R if layer.sparse_kl else K
+        cost = _costs(params=2 * K * O + 1,
+                      activations=2 * R * O + 3 * S * R * O,
+                      flops=3 * S * R * O + 10 * n_kl * O)
+    cost["activations"] += S * n_index * O + _size(out)
+    return cost
+
+
+def _impute_cost(layer, shape):
+    """Imputation ops, the masks are converted to float."""
+    S, N, D = shape
+    if isinstance(layer, LearnedScalarImpute):
+        params = D
+    elif isinstance(layer, LearnedNormalImpute):
+        params = 2 * D
+    else:
+        params = 0
+    # Running statistics are non-trainable, so they are not parameters
+    running = isinstance(layer, RunningNormalImpute) or \
+        getattr(layer, "running", False)
+    state_bytes = 3 * D * FLOAT_BYTES if running else 0
+    cost = _costs(params=params, activations=2 * N * D + 4 * S * N * D,
+                  constant_bytes=state_bytes, flops=4 * S * N * D)
+    return shape, cost
@@ -1,15 +1,115 @@
 """Base Classes for Layers."""
 
+from contextlib import contextmanager
 from functools import reduce
 
 import tensorflow as tf
 
 
+class BuildMode:
+    r"""Global state that controls how layers construct their subgraphs.
+
+    Attributes
+    ----------
+    posterior_mean : bool
+        if True, variational layers use the mean of their posterior
+        distributions instead of drawing random samples, and do not construct
+        their KL divergence terms.
+    cache : dict, None
+        if not None, the outputs of layers that have already been built with
+        the same inputs are reused from this cache, see ``share_builds``.
+
+    """
+
+    def __init__(self):
+        """Construct a BuildMode object."""
+        self.posterior_mean = False
+        self.cache = None
+
+
+# Like the random seed generator, this is a global
+buildmode = BuildMode()
+
+# The graph collection of the name scopes of all of the layer builds
+LAYER_SCOPES = "aboleth_layer_scopes"
+
+# The name scopes outside of the layer scopes being built, see _layer_scope
+_outer_scopes = []
+
+
+def set_posterior_mean(flag=True):
+    r"""Globally set (or unset) the posterior mean build mode.
+
+    When set, all layers built afterwards will be deterministic; variational
+    layers will use the mean of their weight posteriors, dropout becomes the
+    identity, and ``InputLayer`` only creates a single sample. KL terms are
+    not built (they are 0.0).
+
+    Parameters
+    ----------
+    flag : bool
+        True to build in posterior mean mode, False to build in the usual
+        sampling mode.
+
+    """
+    buildmode.posterior_mean = flag
+
+
+@contextmanager
+def posterior_mean():
+    r"""Context manager for building layers in posterior mean mode.
+
+    Layers retain their parameters between calls, so a net that has already
+    been built for training can be called again within this context to build a
+    fast, deterministic prediction graph that shares the same parameters. The
+    outputs are still of rank 3, but with a sample axis of size 1 (when
+    ``InputLayer`` is used), e.g.::
+
+        Net, KL = net(X=X_)  # training graph
+        with ab.posterior_mean():
+            Net_mean, _ = net(X=X_)  # prediction graph
+
+    """
+    previous = buildmode.posterior_mean
+    buildmode.posterior_mean = True
+    try:
+        yield
+    finally:
+        buildmode.posterior_mean = previous
+
+
+@contextmanager
+def share_builds():
+    r"""Context manager for sharing the outputs of identical layer builds.
+
+    Within this context, calling the same layer object with the same inputs
+    (or an ``InputLayer`` with the same name and number of samples on the
+    same input) more than once returns the tensors that were built the first
+    time, and a KL of 0.0 so its regularizer is only counted once. This
+    deduplicates input tiling and any shared sub-stacks between the branches
+    of ``hlayers.Concat`` and ``hlayers.Sum``, which build within this
+    context. These contexts can be nested, and share the outermost cache.
+    For example, ``X`` is only tiled once here::
+
+        inputs = ab.InputLayer(name="X", n_samples=10)
+        net = ab.Concat(inputs >> layer1, inputs >> layer2)
+
+    """
+    previous = buildmode.cache
+    if previous is None:
+        buildmode.cache = {}
+    try:
+        yield
+    finally:
+        buildmode.cache = previous
+
+
 class Layer:
     """Layer base class.
 
     This is an identity layer, and is primarily meant to be subclassed to
-    construct more intersting layers.
+    construct more intersting layers. Layers build their ops within a name
+    scope of their type, see ``profiling.profile``.
     """
 
     def __call__(self, X):
@@ -29,13 +129,50 @@ class Layer:
             layer.
 
         """
-        Net, KL = self._build(X)
+        def build():
+            with _layer_scope(self):
+                return self._build(X)
+
+        Net, KL = _cached_build((id(self), id(X)), (self, X), build)
         return Net, KL
 
     def _build(self, X):
         """Implement graph construction. Should be over-ridden."""
         return X, 0.0
 
+    def moments(self, M, V):
+        r"""Construct the moment propagation subgraph for this layer.
+
+        This is a deterministic alternative to sampling; it propagates the
+        (element-wise, independent) means and variances of the input through
+        this layer, where the weight posteriors and any random operations are
+        integrated out analytically, or with a Gaussian approximation. There
+        is no sample axis.
+
+        Parameters
+        ----------
+        M : Tensor
+            the mean of the input to this layer, shape (N, D)
+        V : Tensor
+            the variance of the input to this layer, shape (N, D)
+
+        Returns
+        -------
+        M : Tensor
+            the mean of the output of this layer
+        V : Tensor
+            the variance of the output of this layer
+
+        """
+        with _layer_scope(self):
+            M, V = self._build_moments(M, V)
+        return M, V
+
+    def _build_moments(self, M, V):
+        """Implement moment propagation. Should be over-ridden."""
+        raise NotImplementedError("Moment propagation is not implemented for"
+                                  " {}!".format(type(self).__name__))
+
     def __rshift__(self, other):
         """Implement layer composition, other(self(x))."""
         return LayerComposite(self, other)
@@ -66,13 +203,50 @@ class MultiLayer:
             layer.
 
         """
-        Net, KL = self._build(**kwargs)
+        def build():
+            with _layer_scope(self):
+                return self._build(**kwargs)
+
+        Net, KL = _cached_build(self._cache_key(**kwargs), (self, kwargs),
+                                build)
         return Net, KL
 
     def _build(self, **kwargs):
         """Implement graph construction. Should be over-ridden."""
         raise NotImplementedError("Base class for MultiLayers only!")
 
+    def _cache_key(self, **kwargs):
+        """Identify a build of this layer with these inputs."""
+        inputs = tuple(sorted((k, id(v)) for k, v in kwargs.items()))
+        return id(self), inputs
+
+    def moments(self, **kwargs):
+        r"""Construct the moment propagation subgraph for this layer.
+
+        See ``Layer.moments``.
+
+        Parameters
+        ----------
+        **kwargs :
+            the inputs to this layer (Tensors)
+
+        Returns
+        -------
+        M : Tensor
+            the mean of the output of this layer
+        V : Tensor
+            the variance of the output of this layer
+
+        """
+        with _layer_scope(self):
+            M, V = self._build_moments(**kwargs)
+        return M, V
+
+    def _build_moments(self, **kwargs):
+        """Implement moment propagation. Should be over-ridden."""
+        raise NotImplementedError("Moment propagation is not implemented for"
+                                  " {}!".format(type(self).__name__))
+
     def __rshift__(self, other):
         """Implement multi-layer composition, other(self(x))."""
         return MultiLayerComposite(self, other)
@@ -91,6 +265,7 @@ class MultiLayerComposite(MultiLayer):
 
     def __init__(self, *layers):
         """Construct a new object."""
+        self.layers = layers
         self.stack = reduce(_stack2, layers)  # foldl
 
     def _build(self, **kwargs):
@@ -98,6 +273,14 @@ class MultiLayerComposite(MultiLayer):
         Net, KL = self.stack(**kwargs)
         return Net, KL
 
+    def _build_moments(self, **kwargs):
+        """Propagate the moments through the layers in turn."""
+        first, *rest = self.layers
+        M, V = _moments(first)(**kwargs)
+        for layer in rest:
+            M, V = _moments(layer)(M, V)
+        return M, V
+
 
 class LayerComposite(Layer):
     """Composition of Layers.
@@ -111,6 +294,7 @@ class LayerComposite(Layer):
 
     def __init__(self, *layers):
         """Construct a new object."""
+        self.layers = layers
         self.stack = reduce(_stack2, layers)  # foldl
 
     def _build(self, X):
@@ -118,6 +302,12 @@ class LayerComposite(Layer):
         Net, KL = self.stack(X)
         return Net, KL
 
+    def _build_moments(self, M, V):
+        """Propagate the moments through the layers in turn."""
+        for layer in self.layers:
+            M, V = _moments(layer)(M, V)
+        return M, V
+
 
 def stack(l, *layers):
     """Stack multiple Layers.
@@ -161,3 +351,69 @@ def _stack2(layer1, layer2):
         loss = tf.add(loss1, loss2)
         return result, loss
     return stackfunc
+
+
+def _cached_build(key, inputs, build):
+    """Build a layer, or reuse a previous build if sharing builds."""
+    cache = buildmode.cache
+    if cache is None:
+        return build()
+
+    if key in cache:
+        (Net, _), _ = cache[key]
+        return Net, 0.0
+
+    Net, KL = build()
+    cache[key] = ((Net, KL), inputs)  # keep the inputs so ids stay unique
+    return Net, KL
+
+
+@contextmanager
+def _layer_scope(layer):
+    """Build a layer within a name scope of its type, e.g. "DenseVariational".
+
+    Compositions of layers are transparent, so the scopes are only nested by
+    layers that contain other layers, e.g. ``hlayers.Concat``. TensorFlow
+    makes the scopes unique, so they are stable for a given composition. The
+    scopes are recorded in the ``LAYER_SCOPES`` graph collection. Variables
+    are made outside of these scopes, see ``_unscoped_variable``.
+    """
+    if isinstance(layer, (LayerComposite, MultiLayerComposite)):
+        yield
+        return
+
+    if _outer_scopes:
+        outer = _outer_scopes[-1]
+    else:
+        outer = tf.get_default_graph().get_name_scope()
+        outer = outer + "/" if outer else ""
+
+    with tf.name_scope(type(layer).__name__) as scope:
+        tf.add_to_collection(LAYER_SCOPES, scope)
+        _outer_scopes.append(outer)
+        try:
+            yield
+        finally:
+            _outer_scopes.pop()
+
+
+def _unscoped_variable(initial_value, **kwargs):
+    """Make a tf.Variable outside of the name scopes of the layers.
+
+    Only the ops of a layer are in its name scope, so variable names, and so
+    checkpoints, are the same as when layers were built without name scopes.
+    """
+    outer = _outer_scopes[-1] if _outer_scopes else None
+    if outer is None:
+        return tf.Variable(initial_value, **kwargs)
+    with tf.name_scope(outer):
+        return tf.Variable(initial_value, **kwargs)
+
+
+def _moments(layer):
+    """Get the moment propagation method of a layer, if it has one."""
+    if not hasattr(layer, "moments"):
+        raise NotImplementedError("Moment propagation requires Layer or"
+                                  " MultiLayer objects, not {}!"
+                                  .format(layer))
+    return layer.moments
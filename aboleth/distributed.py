@@ -0,0 +1,189 @@
+"""Multi-process distributed training with parameter servers."""
+import socket
+
+import tensorflow as tf
+
+from aboleth.util import batch
+
+
+def local_cluster(n_workers, n_ps=1, host="localhost"):
+    r"""Make a cluster of processes on this host, for testing and development.
+
+    This finds a free port for each task. In a real deployment the cluster
+    would instead be made from the addresses of the hosts of the tasks.
+
+    Parameters
+    ----------
+    n_workers : int
+        the number of worker tasks, that compute gradients.
+    n_ps : int
+        the number of parameter server tasks, that hold the variables.
+    host : str
+        the host name of the tasks.
+
+    Returns
+    -------
+    cluster : tf.train.ClusterSpec
+        the cluster, with ``"ps"`` and ``"worker"`` jobs.
+
+    """
+    ports = _free_ports(n_workers + n_ps)
+    addresses = ["{}:{}".format(host, p) for p in ports]
+    cluster = tf.train.ClusterSpec({
+        "ps": addresses[:n_ps],
+        "worker": addresses[n_ps:],
+    })
+    return cluster
+
+
+def worker_device(cluster, task_index):
+    r"""Get a device function to build the graph of a worker with.
+
+    Variables are placed on the parameter servers (round robin), and all other
+    ops on the worker. Use this as ``with tf.device(worker_device(...)):``
+    when building the net, loss and optimizer of a worker.
+
+    Parameters
+    ----------
+    cluster : tf.train.ClusterSpec
+        the cluster, see ``local_cluster``.
+    task_index : int
+        the index of this worker task.
+
+    Returns
+    -------
+    device : callable
+        the device function.
+
+    """
+    return tf.train.replica_device_setter(
+        worker_device="/job:worker/task:{}".format(task_index),
+        cluster=cluster)
+
+
+def replica_optimizer(optimizer, n_workers, sync=True):
+    r"""Make an optimizer for a worker's replica of a model.
+
+    With synchronous training, the gradients of each step of all of the
+    workers are averaged before they are applied to the variables on the
+    parameter servers. The optimizer's ``make_session_run_hook(is_chief)``
+    must then be given to the ``MonitoredTrainingSession`` of each worker,
+    and a global step *must* be given to its ``minimize`` (or
+    ``apply_gradients``) method, e.g. from ``tf.train.create_global_step()``,
+    so it can check for stale gradients. With asynchronous training, each
+    worker applies its gradients as soon as they are computed, and the
+    optimizer is returned as is.
+
+    Parameters
+    ----------
+    optimizer : tf.train.Optimizer
+        the optimizer to use for the gradients of the workers.
+    n_workers : int
+        the number of workers in the cluster.
+    sync : bool
+        use synchronous, rather than asynchronous, updates.
+
+    Returns
+    -------
+    optimizer : tf.train.Optimizer
+        the optimizer to use in each worker.
+
+    """
+    if not sync:
+        return optimizer
+    optimizer = tf.train.SyncReplicasOptimizer(
+        optimizer, replicas_to_aggregate=n_workers,
+        total_num_replicas=n_workers)
+    return optimizer
+
+
+def shard_data(feed_dict, task_index, n_workers):
+    r"""Get the shard of a dataset that belongs to a worker.
+
+    The shards of the workers are disjoint, and together they are all of the
+    data. Every ``n_workers``-th row belongs to the same worker, so each shard
+    has the same distribution as the data if it is ordered, e.g. by time.
+
+    Parameters
+    ----------
+    feed_dict : dict of ndarrays
+        The data with ``{tf.placeholder: data}`` entries. This assumes all
+        items have the *same* length!
+    task_index : int
+        the index of the worker task.
+    n_workers : int
+        the number of workers in the cluster.
+
+    Returns
+    -------
+    dict:
+        the rows of each array of the data that belong to the worker.
+
+    Examples
+    --------
+    >>> shard_data({'X': list(range(7))}, task_index=1, n_workers=3)
+    {'X': [1, 4]}
+
+    """
+    assert 0 <= task_index < n_workers, "Invalid task index!"
+    return {k: v[task_index::n_workers] for k, v in feed_dict.items()}
+
+
+def shard_batch(feed_dict, batch_size, task_index, n_workers, n_iter=10000,
+                N_=None):
+    r"""Create random batches for stochastic gradients from a worker's shard.
+
+    This is like ``batch``, but each worker only draws from its own disjoint
+    shard of the data, see ``shard_data``. The minibatches of every worker are
+    then samples of the whole dataset, so the size of the *whole* dataset
+    (not of the shard) is fed to ``N_`` for the ELBO.
+
+    Parameters
+    ----------
+    feed_dict : dict of ndarrays
+        The data with ``{tf.placeholder: data}`` entries. This assumes all
+        items have the *same* length!
+    batch_size : int
+        number of data points in each batch.
+    task_index : int
+        the index of the worker task.
+    n_workers : int
+        the number of workers in the cluster.
+    n_iter : int, optional
+        The number of iterations
+    N_ : tf.placeholder (int), optional
+        Place holder for the size of the whole dataset. This will be fed to an
+        algorithm.
+
+    Yields
+    ------
+    dict:
+        with each element an array length ``batch_size``, i.e. a subset of
+        the worker's shard of the data, and an element for ``N_``.
+
+    """
+    N = len(next(iter(feed_dict.values())))
+    shard = shard_data(feed_dict, task_index, n_workers)
+    for batch_dict in batch(shard, batch_size, n_iter):
+        if N_ is not None:
+            batch_dict[N_] = N
+        yield batch_dict
+
+
+#
+# Private module stuff
+#
+
+def _free_ports(n):
+    """Find free ports on this host."""
+    sockets = []
+    try:
+        for _ in range(n):
+            s = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+            s.bind(("", 0))
+            sockets.append(s)
+        ports = [s.getsockname()[1] for s in sockets]
+    finally:
+        for s in sockets:
+            s.close()
+    return ports
@@ -4,6 +4,7 @@ import tensorflow as tf
 from multipledispatch import dispatch
 
 from aboleth.util import pos
+from aboleth.baselayers import _unscoped_variable
 from aboleth.random import seedgen
 
 
@@ -42,6 +43,7 @@ class Normal(ParameterDistribution):
         self.var = var
         self.sigma = tf.sqrt(var)
         self.d = mu.shape
+        self._var_variable = None  # unconstrained variance variable, if any
 
     def sample(self, e=None):
         """Draw a random sample from this object.
@@ -66,6 +68,33 @@ class Normal(ParameterDistribution):
 
         return x
 
+    def gather(self, ind):
+        """Get the distribution of some of the rows of this object.
+
+        If this distribution was made with ``norm_posterior``, the rows are
+        gathered directly from its variables, so only these rows are computed
+        and the gradients with respect to the variables are sparse.
+
+        Parameters
+        ----------
+        ind : Tensor
+            a vector of the (first axis) indices of the rows to gather.
+
+        Returns
+        -------
+        rows : Normal
+            the distribution of the rows, of shape (len(ind), d_out).
+
+        """
+        mu = tf.gather(self.mu, ind)
+        if self._var_variable is not None:
+            var = pos(tf.gather(self._var_variable, ind))
+        elif tf.convert_to_tensor(self.var).shape.ndims == 0:
+            var = self.var
+        else:
+            var = tf.gather(self.var, ind)
+        return Normal(mu, var)
+
 
 class Gaussian(ParameterDistribution):
     """
@@ -155,7 +184,7 @@ def norm_prior(dim, var):
 
     """
     mu = tf.zeros(dim)
-    var = pos(tf.Variable(var, name="W_mu_p"))
+    var = pos(_unscoped_variable(var, name="W_mu_p"))
     P = Normal(mu, var)
     return P
 
@@ -184,12 +213,13 @@ def norm_posterior(dim, var0):
 
     """
     mu_0 = tf.random_normal(dim, stddev=tf.sqrt(var0), seed=next(seedgen))
-    mu = tf.Variable(mu_0, name="W_mu_q")
+    mu = _unscoped_variable(mu_0, name="W_mu_q")
 
     var_0 = tf.random_gamma(alpha=var0, shape=dim, seed=next(seedgen))
-    var = pos(tf.Variable(var_0, name="W_var_q"))
+    var_variable = _unscoped_variable(var_0, name="W_var_q")
 
-    Q = Normal(mu, var)
+    Q = Normal(mu, pos(var_variable))
+    Q._var_variable = var_variable
     return Q
 
 
@@ -228,12 +258,12 @@ def gaus_posterior(dim, var0):
     indices = (u * I + v)[:, np.newaxis]
     l0 = np.tile(np.eye(I), [O, 1, 1])[:, u, v].T
     l0 = l0 * tf.random_gamma(alpha=var0, shape=l0.shape, seed=next(seedgen))
-    l = tf.Variable(l0, name="W_cov_q")
+    l = _unscoped_variable(l0, name="W_cov_q")
     Lt = tf.transpose(tf.scatter_nd(indices, l, shape=(I * I, O)))
     L = tf.reshape(Lt, (O, I, I))
 
     mu_0 = tf.random_normal((I, O), stddev=sig0, seed=next(seedgen))
-    mu = tf.Variable(mu_0, name="W_mu_q")
+    mu = _unscoped_variable(mu_0, name="W_mu_q")
     Q = Gaussian(mu, L)
     return Q
 
@@ -260,9 +290,7 @@ def kl_qp(q, p):
         the result of KL[q||p].
 
     """
-    KL = 0.5 * (tf.log(p.var) - tf.log(q.var) + q.var / p.var - 1. +
-                (q.mu - p.mu)**2 / p.var)
-    KL = tf.reduce_sum(KL)
+    KL = tf.reduce_sum(_normal_kl(q, p))
     return KL
 
 
@@ -322,6 +350,13 @@ def kl_qp(q, p):
 # Private module stuff
 #
 
+def _normal_kl(q, p):
+    """Get the element-wise Normal-Normal KL divergences (not summed)."""
+    KL = 0.5 * (tf.log(p.var) - tf.log(q.var) + q.var / p.var - 1. +
+                (q.mu - p.mu)**2 / p.var)
+    return KL
+
+
 def _chollogdet(L):
     """Log det of a cholesky, where L is (..., D, D)."""
     l = tf.maximum(tf.matrix_diag_part(L), 1e-15)  # Make sure we don't go to 0
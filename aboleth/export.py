@@ -0,0 +1,155 @@
+"""Export trained nets for prediction without TensorFlow."""
+import json
+
+import numpy as np
+import tensorflow as tf
+
+from aboleth.baselayers import LayerComposite, MultiLayerComposite
+from aboleth.distributions import Normal, Gaussian
+from aboleth.layers import (InputLayer, Activation, DropOut, Reshape,
+                            RandomFourier, RandomArcCosine, DenseVariational,
+                            EmbedVariational, MultiEmbedVariational,
+                            HashedEmbedVariational, GroupedDenseVariational,
+                            DenseMAP)
+from aboleth.runtime import SPEC_VERSION
+
+
+def export_net(net, path, session=None):
+    r"""Export a built net to a compact file for the ``runtime`` module.
+
+    This extracts the posterior parameters and fixed random projections of a
+    net into a single NumPy ``.npz`` file. This can be loaded with
+    ``runtime.load``, which only requires NumPy, to make sample-based and
+    posterior mean predictions.
+
+    Parameters
+    ----------
+    net : LayerComposite, MultiLayerComposite, Layer
+        the net to export. This must already have been built (called), and
+        must be a sequential stack of layers (optionally starting with an
+        ``InputLayer``). Only ``InputLayer``, ``Activation``, ``DropOut``,
+        ``Reshape``, ``RandomFourier``, ``RandomArcCosine``,
+        ``DenseVariational``, ``EmbedVariational``, ``MultiEmbedVariational``,
+        ``GroupedDenseVariational`` and ``DenseMAP`` layers are supported.
+    path : str
+        the file to write to.
+    session : Session, optional
+        the session with which to evaluate the net parameters, by default the
+        current session is used.
+
+    """
+    session = tf.get_default_session() if session is None else session
+    spec, tensors = [], {}
+    for i, layer in enumerate(_flatten(net)):
+        layer_spec, layer_tensors = _export_layer(layer)
+        spec.append(layer_spec)
+        tensors.update({"{}/{}".format(i, k): v
+                        for k, v in layer_tensors.items()})
+
+    # Only evaluate the parameters that are not already arrays
+    fetches = {k: v for k, v in tensors.items()
+               if isinstance(v, (tf.Tensor, tf.Variable))}
+    arrays = dict(tensors, **session.run(fetches))
+    arrays = {k: np.asarray(v, dtype=np.float32) for k, v in arrays.items()}
+    arrays["__spec__"] = np.array(json.dumps({"version": SPEC_VERSION,
+                                              "layers": spec}))
+    np.savez(path, **arrays)
+
+
+#
+# Private module stuff
+#
+
+_activation_names = {
+    tf.identity: "identity",
+    tf.nn.relu: "relu",
+    tf.nn.sigmoid: "sigmoid",
+    tf.sigmoid: "sigmoid",
+    tf.nn.tanh: "tanh",
+    tf.tanh: "tanh",
+    tf.nn.softmax: "softmax",
+}
+
+
+def _flatten(net):
+    """Flatten a (possibly nested) composition of layers into a list."""
+    if isinstance(net, (LayerComposite, MultiLayerComposite)):
+        return [l for layer in net.layers for l in _flatten(layer)]
+    return [net]
+
+
+def _export_layer(layer):
+    """Get the specification and parameter tensors of a layer."""
+    if isinstance(layer, InputLayer):
+        return {"type": "input", "n_samples": layer.n_samples}, {}
+
+    if isinstance(layer, Activation):
+        if layer.h not in _activation_names:
+            raise ValueError("Cannot export activation {}!".format(layer.h))
+        return {"type": "activation", "h": _activation_names[layer.h]}, {}
+
+    if isinstance(layer, DropOut):
+        return {"type": "dropout"}, {"keep_prob": layer.keep_prob}
+
+    if isinstance(layer, Reshape):
+        return {"type": "reshape",
+                "target_shape": list(layer.target_shape)}, {}
+
+    if isinstance(layer, RandomFourier):
+        _check_built(layer, layer.weights)
+        spec = {"type": "random_fourier", "n_features": layer.n_features}
+        if isinstance(layer, RandomArcCosine):
+            spec.update(type="random_arccosine", p=layer.p)
+        return spec, {"P": layer.weights[0]}
+
+    if isinstance(layer, HashedEmbedVariational):
+        raise ValueError("Cannot export layer {}, the runtime does not "
+                         "implement its hash functions!".format(layer))
+
+    if isinstance(layer, EmbedVariational):
+        _check_built(layer, layer.qW)
+        spec = {"type": "embed_variational"}
+        if isinstance(layer, MultiEmbedVariational):
+            spec = {"type": "multi_embed_variational",
+                    "offsets": layer.offsets.tolist()}
+        return _export_posterior(spec, layer.qW, "W")
+
+    if isinstance(layer, DenseVariational):
+        _check_built(layer, layer.qW)
+        spec = {"type": "dense_variational"}
+        if isinstance(layer, GroupedDenseVariational):
+            spec = {"type": "grouped_dense_variational"}
+        spec, tensors = _export_posterior(spec, layer.qW, "W")
+        if layer.qb is not None:
+            spec, btensors = _export_posterior(spec, layer.qb, "b")
+            tensors.update(btensors)
+        return spec, tensors
+
+    if isinstance(layer, DenseMAP):
+        _check_built(layer, layer.W)
+        tensors = {"W": layer.W}
+        if layer.b is not None:
+            tensors["b"] = layer.b
+        return {"type": "dense_map"}, tensors
+
+    raise ValueError("Cannot export layer {}!".format(layer))
+
+
+def _export_posterior(spec, dist, name):
+    """Get the specification and tensors of a posterior distribution."""
+    if isinstance(dist, Gaussian):
+        spec = dict(spec, **{name + "_posterior": "gaussian"})
+        tensors = {name + "_mu": dist.mu, name + "_L": dist.L}
+    elif isinstance(dist, Normal):
+        spec = dict(spec, **{name + "_posterior": "normal"})
+        tensors = {name + "_mu": dist.mu, name + "_var": dist.var}
+    else:
+        raise ValueError("Cannot export distribution {}!".format(dist))
+    return spec, tensors
+
+
+def _check_built(layer, param):
+    """Make sure a layer has been built before it is exported."""
+    if param is None:
+        raise ValueError("Layer {} needs to be built before it can be "
+                         "exported!".format(layer))
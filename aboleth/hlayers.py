@@ -1,12 +1,15 @@
 """Higher-order neural network layers (made from other layers)."""
 import tensorflow as tf
 
-from aboleth.baselayers import Layer, MultiLayer
+from aboleth.baselayers import Layer, MultiLayer, share_builds
 
 
 class Concat(MultiLayer):
     r"""Concatenates the output of multiple layers.
 
+    Any layers shared by the branches (with the same inputs) are only built
+    once, see ``baselayers.share_builds``.
+
     Parameters
     ----------
     layers : [MultiLayer]
@@ -20,15 +23,27 @@ class Concat(MultiLayer):
 
     def _build(self, **kwargs):
         """Build the concatenation."""
-        tensors, losses = zip(*map(lambda l: l(**kwargs), self.layers))
+        with share_builds():
+            tensors, losses = zip(*map(lambda l: l(**kwargs), self.layers))
         result = tf.concat(tensors, axis=-1)
         loss = tf.add_n(losses)
         return result, loss
 
+    def _build_moments(self, **kwargs):
+        """Build the concatenation of the moments."""
+        means, variances = zip(*map(lambda l: l.moments(**kwargs),
+                                    self.layers))
+        M = tf.concat(means, axis=-1)
+        V = tf.concat(variances, axis=-1)
+        return M, V
+
 
 class Sum(MultiLayer):
     r"""Sums multiple layers by adding their outputs.
 
+    Any layers shared by the branches (with the same inputs) are only built
+    once, see ``baselayers.share_builds``.
+
     Parameters
     ----------
     layers : [MultiLayer]
@@ -42,11 +57,20 @@ class Sum(MultiLayer):
 
     def _build(self, **kwargs):
         """Build the summation layer."""
-        tensors, losses = zip(*map(lambda l: l(**kwargs), self.layers))
+        with share_builds():
+            tensors, losses = zip(*map(lambda l: l(**kwargs), self.layers))
         result = tf.add_n(tensors)
         loss = tf.add_n(losses)
         return result, loss
 
+    def _build_moments(self, **kwargs):
+        """Build the summation of the moments, assuming independent inputs."""
+        means, variances = zip(*map(lambda l: l.moments(**kwargs),
+                                    self.layers))
+        M = tf.add_n(means)
+        V = tf.add_n(variances)
+        return M, V
+
 
 class PerFeature(Layer):
     r"""Concatenate multiple layers with sliced inputs.
@@ -60,6 +84,11 @@ class PerFeature(Layer):
 
     This function assumes the tensor being provided is 3D.
 
+    This builds a separate graph for each slice. If the same (dense)
+    architecture is applied to every feature, stacks of
+    ``layers.GroupedDenseVariational`` are much faster for many features, as
+    they compute all of the features at once.
+
     Parameters
     ----------
     layers : [Layer]
@@ -1,10 +1,11 @@
 """Layers that impute missing data."""
+import numpy as np
 import tensorflow as tf
 
-from aboleth.baselayers import MultiLayer
+from aboleth.baselayers import MultiLayer, buildmode, _unscoped_variable
 from aboleth.distributions import Normal
 from aboleth.random import seedgen
-from aboleth.util import pos
+from aboleth.util import pos, unpack_mask
 
 
 class ImputeOp(MultiLayer):
@@ -19,7 +20,9 @@ class ImputeOp(MultiLayer):
         A layer that returns a data tensor. Must be of form ``f(**kwargs)``.
     masklayer : callable
         A layer that returns a boolean mask tensor where True values are
-        masked. Must be of form ``f(**kwargs)``.
+        masked. Must be of form ``f(**kwargs)``. This can also return a
+        bit-packed uint8 mask, see ``util.pack_mask``, to save memory and
+        feed bandwidth.
 
     """
 
@@ -34,49 +37,59 @@ class ImputeOp(MultiLayer):
         M, loss2 = self.masklayer(**kwargs)
 
         self._check_rank(X_ND)
-        self._set_mask(M)
+        self._set_mask(M, X_ND)
 
         # Extra build/initialisation here
         self._initialise_variables(X_ND)
 
-        # Map over the samples layer
-        Net = tf.map_fn(self._impute2D, X_ND)
+        # Select the imputed values where missing, broadcasting the mask and
+        # impute values over the samples
+        impute = self._impute_columns(X_ND)
+        Net = X_ND * self.real_val_mask + impute * self.missing_val_mask
 
         loss = tf.add(loss1, loss2)
         return Net, loss
 
-    def _impute2D(self, X_2D):
-        r"""Impute a rank 2 tensor.
+    def _impute_columns(self, X_NSD):
+        r"""Generate the values to impute for each column and sample.
 
-        This function is mapped over the rank 3 data tensors, additionally it
-        has access to two properties:
-        - ``self.missing_ind`` a row and column index of the missing data
+        These are selected into the rank 3 data tensor wherever it is missing
+        data. This has access to two properties:
         - ``self.real_val_mask`` a tf.float32 mask of the non missing values
+        - ``self.missing_val_mask`` a tf.float32 mask of the missing values
 
         Parameters
         ----------
-        X_2D : Tensor
-            a rank 2 Tensor with missing data
+        X_NSD : Tensor
+            a rank 3 Tensor, (n_samples, N, D), with missing data
 
         Returns
         -------
-        X_imputed : Tensor
-            a rank 2 Tensor with imputed data
+        impute : Tensor
+            a Tensor of impute values of shape (n_samples, 1, D), or that can
+            be broadcast to this shape
 
         """
         raise NotImplementedError("Abstract base class for imputation ops!")
-        X_imputed = None  # You imputation implementation
-        return X_imputed
+        impute = None  # You imputation implementation
+        return impute
 
     def _check_rank(self, X):
         """Check the rank of the input tensors."""
         rank = len(X.shape)
         assert rank == 3
 
-    def _set_mask(self, M):
-        """Create Tensor Masks."""
-        # Identify indices of the missing datapoints
-        self.missing_ind = tf.where(M)
+    def _set_mask(self, M, X):
+        """Create Tensor Masks.
+
+        The mask can also be bit-packed (uint8, see ``util.pack_mask``), in
+        which case it is unpacked to the number of columns of the data, ``X``.
+        """
+        M = tf.convert_to_tensor(M)
+        if M.dtype == tf.uint8:
+            D = X.shape[2].value
+            M = unpack_mask(M, tf.shape(X)[2] if D is None else D)
+        self.missing_val_mask = tf.cast(M, tf.float32)
         self.real_val_mask = tf.cast(tf.logical_not(M), tf.float32)
 
     def _initialise_variables(self, X):
@@ -91,6 +104,15 @@ class MeanImpute(ImputeOp):
     mask layer. Returns a layer that returns a tensor in which the masked
     values have been imputed as the column means calculated from the batch.
 
+    Optionally, running (dataset-level) column means can be used instead of
+    the batch means. These are kept in non-trainable variables that are
+    updated with the real values of each batch by the ``update_op`` of this
+    layer. This op is also added to the ``tf.GraphKeys.UPDATE_OPS``
+    collection, so it can be run with each training step, or just run over
+    the batches of a data source in one streaming pass before training. The
+    op is made once, from the inputs of the first build (call) of the layer,
+    so later builds (e.g. for prediction) do not update the statistics again.
+
     Parameters
     ----------
     datalayer : callable
@@ -99,16 +121,35 @@ class MeanImpute(ImputeOp):
     masklayer : callable
         A layer that returns a boolean mask tensor where True values are
         masked. Must be of form ``f(**kwargs)``.
+    running : bool
+        if True, impute the running column means, rather than the column
+        means of each batch.
 
     """
 
-    def _impute2D(self, X_2D):
-        r"""Mean impute a rank 2 tensor."""
-        # Fill zeros in for missing data initially
-        data_zeroed_missing_tf = X_2D * self.real_val_mask
+    def __init__(self, datalayer, masklayer, running=False):
+        """Construct and instance of a MeanImpute operation."""
+        super().__init__(datalayer, masklayer)
+        self.running = running
+        self.stats = None
+        self.update_op = None
+
+    def _initialise_variables(self, X):
+        """Initialise the running statistics, and their update."""
+        if not self.running:
+            return
+        # Only update the statistics once, from the inputs of the first build
+        if self.stats is None:
+            self.stats = _RunningStats(int(X.shape[2]))
+            self.update_op = self.stats.update(X, self.real_val_mask)
+
+    def _impute_columns(self, X_NSD):
+        r"""Calculate the column means of the real values of each sample."""
+        if self.running:
+            return self.stats.mean
 
         # Sum the real values in each column
-        col_tot = tf.reduce_sum(data_zeroed_missing_tf, 0)
+        col_tot = tf.reduce_sum(X_NSD * self.real_val_mask, axis=1)
 
         # Divide column totals by the number of non-nan values
         num_values_col = tf.reduce_sum(self.real_val_mask, 0)
@@ -116,16 +157,7 @@ class MeanImpute(ImputeOp):
                                     tf.ones(tf.shape(num_values_col)))
         col_nan_means = tf.div(col_tot, num_values_col)
 
-        # Make an vector of the impute values for each missing point
-        imputed_vals = tf.gather(col_nan_means, self.missing_ind[:, 1])
-
-        # Fill the imputed values into the data tensor of zeros
-        shape = tf.cast(tf.shape(data_zeroed_missing_tf), dtype=tf.int64)
-        missing_imputed = tf.scatter_nd(self.missing_ind, imputed_vals, shape)
-
-        X_with_impute = data_zeroed_missing_tf + missing_imputed
-
-        return X_with_impute
+        return tf.expand_dims(col_nan_means, 1)
 
 
 class FixedNormalImpute(ImputeOp):
@@ -152,25 +184,18 @@ class FixedNormalImpute(ImputeOp):
     def __init__(self, datalayer, masklayer, mu_array, var_array):
         """Construct and instance of a RandomGaussImpute operation."""
         super().__init__(datalayer, masklayer)
-        self.normal_array = [Normal(m, v) for m, v in zip(mu_array, var_array)]
-
-    def _impute2D(self, X_2D):
-        r"""Randomly impute a rank 2 tensor."""
-        # Fill zeros in for missing data initially
-        data_zeroed_missing_tf = X_2D * self.real_val_mask
+        self.normal = Normal(np.asarray(mu_array, dtype=np.float32),
+                             np.asarray(var_array, dtype=np.float32))
 
-        # Divide column totals by the number of non-nan values
-        col_draws = [n.sample() for n in self.normal_array]
-        # Make an vector of the impute values for each missing point
-        imputed_vals = tf.gather(col_draws, self.missing_ind[:, 1])
+    def _impute_columns(self, X_NSD):
+        r"""Draw a value for each column and sample, or use the means."""
+        if buildmode.posterior_mean:
+            return self.normal.mu
 
-        # Fill the imputed values into the data tensor of zeros
-        shape = tf.cast(tf.shape(data_zeroed_missing_tf), dtype=tf.int64)
-        missing_imputed = tf.scatter_nd(self.missing_ind, imputed_vals, shape)
-
-        X_with_impute = data_zeroed_missing_tf + missing_imputed
-
-        return X_with_impute
+        n_samples, D = tf.shape(X_NSD)[0], len(self.normal.mu)
+        e = tf.random_normal((n_samples, 1, D), seed=next(seedgen))
+        col_draws = self.normal.sample(e)
+        return col_draws
 
 
 class LearnedScalarImpute(ImputeOp):
@@ -193,45 +218,21 @@ class LearnedScalarImpute(ImputeOp):
     def __init__(self, datalayer, masklayer):
         r"""Construct and instance of a VarScalarImpute operation."""
         super().__init__(datalayer, masklayer)
+        self.impute_scalars = None
 
     def _initialise_variables(self, X):
         """Initialise the impute variables."""
+        if self.impute_scalars is not None:
+            return
         datadim = int(X.shape[2])
-        self.impute_scalars = tf.Variable(
+        self.impute_scalars = _unscoped_variable(
             tf.random_normal(shape=(1, datadim), seed=next(seedgen)),
             name="impute_scalars"
         )
 
-    def _impute2D(self, X_2D):
-        r"""Randomly impute a rank 2 tensor.
-
-        Parameters
-        ----------
-        X_2D : Tensor
-            a rank 2 Tensor with missing data
-        scalars : Tensor 1 x D
-            these values are filled into the missing elements (per column)
-
-        Returns
-        -------
-        X_imputed : Tensor
-            a rank 2 Tensor with imputed data
-
-        """
-        # Fill zeros in for missing data initially
-        data_zeroed_missing = X_2D * self.real_val_mask
-
-        # Make an vector of the impute values for each missing point
-        imputed_vals = tf.gather(self.impute_scalars[0, :],
-                                 self.missing_ind[:, 1])
-
-        # Fill the imputed values into the data tensor of zeros
-        shape = tf.cast(tf.shape(data_zeroed_missing), dtype=tf.int64)
-        missing_imputed = tf.scatter_nd(self.missing_ind, imputed_vals, shape)
-
-        X_with_impute = data_zeroed_missing + missing_imputed
-
-        return X_with_impute
+    def _impute_columns(self, X_NSD):
+        r"""Use the learned scalar impute values for each column."""
+        return self.impute_scalars
 
 
 class LearnedNormalImpute(ImputeOp):
@@ -254,46 +255,130 @@ class LearnedNormalImpute(ImputeOp):
     def __init__(self, datalayer, masklayer):
         r"""Construct and instance of a VarScalarImpute operation."""
         super().__init__(datalayer, masklayer)
+        self.normal = None
 
     def _initialise_variables(self, X):
         """Initialise the impute variables."""
+        if self.normal is not None:
+            return
         datadim = int(X.shape[2])
-        impute_means = tf.Variable(
+        impute_means = _unscoped_variable(
             tf.random_normal(shape=(1, datadim), seed=next(seedgen)),
             name="impute_scalars"
         )
-        impute_variances = tf.Variable(
+        impute_variances = _unscoped_variable(
             tf.random_normal(shape=(1, datadim), seed=next(seedgen)),
             name="impute_scalars"
         )
         self.normal = Normal(impute_means, pos(impute_variances))
 
-    def _impute2D(self, X_2D):
-        r"""Impute a rank 2 tensor with draws from normal distributions.
+    def _impute_columns(self, X_NSD):
+        r"""Draw a value for each column and sample, or use the means."""
+        if buildmode.posterior_mean:
+            return self.normal.mu
 
-        Parameters
-        ----------
-        X_2D : Tensor
-            a rank 2 Tensor with missing data
+        datadim = int(self.normal.mu.shape[1])
+        n_samples = tf.shape(X_NSD)[0]
+        e = tf.random_normal((n_samples, 1, datadim), seed=next(seedgen))
+        col_draws = self.normal.sample(e)
+        return col_draws
 
-        Returns
-        -------
-        X_imputed : Tensor
-            a rank 2 Tensor with imputed data
 
-        """
-        # Fill zeros in for missing data initially
-        data_zeroed_missing = X_2D * self.real_val_mask
+class RunningNormalImpute(ImputeOp):
+    r"""Impute the missing values with draws from running column Gaussians.
 
-        # Divide column totals by the number of non-nan values
-        col_draws = tf.transpose(self.normal.sample())
-        # Make an vector of the impute values for each missing point
-        imputed_vals = tf.gather(col_draws, self.missing_ind[:, 1])[:, 0]
+    Takes two layers, one the returns a data tensor and the other returns a
+    mask layer. This creates a layer that keeps running (dataset-level)
+    column means and variances in non-trainable variables, and infills
+    missing values using draws from these marginal Gaussians. In posterior
+    mean mode the running means are imputed.
+
+    The running statistics are updated with the real values of each batch by
+    the ``update_op`` of this layer. This op is also added to the
+    ``tf.GraphKeys.UPDATE_OPS`` collection, so it can be run with each
+    training step, or just run over the batches of a data source in one
+    streaming pass before training. The op is made once, from the inputs of
+    the first build (call) of the layer, so later builds (e.g. for prediction)
+    do not update the statistics again.
 
-        # Fill the imputed values into the data tensor of zeros
-        shape = tf.cast(tf.shape(data_zeroed_missing), dtype=tf.int64)
-        missing_imputed = tf.scatter_nd(self.missing_ind, imputed_vals, shape)
+    Parameters
+    ----------
+    datalayer : callable
+        A layer that returns a data tensor. Must be of form ``f(**kwargs)``.
+    masklayer : callable
+        A layer that returns a boolean mask tensor where True values are
+        masked. Must be of form ``f(**kwargs)``.
 
-        X_with_impute = data_zeroed_missing + missing_imputed
+    """
 
-        return X_with_impute
+    def __init__(self, datalayer, masklayer):
+        """Construct and instance of a RunningNormalImpute operation."""
+        super().__init__(datalayer, masklayer)
+        self.stats = None
+        self.update_op = None
+
+    def _initialise_variables(self, X):
+        """Initialise the running statistics, and their update."""
+        # Only update the statistics once, from the inputs of the first build
+        if self.stats is None:
+            self.stats = _RunningStats(int(X.shape[2]))
+            self.update_op = self.stats.update(X, self.real_val_mask)
+
+    def _impute_columns(self, X_NSD):
+        r"""Draw a value for each column and sample, or use the means."""
+        normal = Normal(self.stats.mean, self.stats.variance())
+        if buildmode.posterior_mean:
+            return normal.mu
+
+        n_samples = tf.shape(X_NSD)[0]
+        e = tf.random_normal((n_samples, 1, self.stats.D), seed=next(seedgen))
+        col_draws = normal.sample(e)
+        return col_draws
+
+
+#
+# Private module stuff
+#
+
+class _RunningStats:
+    """Non-trainable running column counts, means and squared deviations."""
+
+    def __init__(self, D):
+        """Create the running statistic variables."""
+        self.D = D
+        self.count = _unscoped_variable(tf.zeros(D), trainable=False,
+                                        name="impute_count")
+        self.mean = _unscoped_variable(tf.zeros(D), trainable=False,
+                                       name="impute_mean")
+        self.m2 = _unscoped_variable(tf.zeros(D), trainable=False,
+                                     name="impute_m2")
+
+    def variance(self):
+        """Get the running column variances."""
+        var = self.m2 / tf.maximum(self.count - 1., 1.)
+        return var
+
+    def update(self, X, real_mask):
+        """Merge the real values of a batch into the running statistics.
+
+        This uses the first sample of X, and the parallel variance algorithm
+        of Chan et al. to merge the batch statistics.
+        """
+        X = X[0]
+        n_b = tf.reduce_sum(real_mask, axis=0)
+        mean_b = tf.reduce_sum(X * real_mask, axis=0) / tf.maximum(n_b, 1.)
+        m2_b = tf.reduce_sum(((X - mean_b) * real_mask)**2, axis=0)
+
+        # Snapshot the state, so no assignment can change what is merged
+        count, mean, m2 = (self.count.read_value(), self.mean.read_value(),
+                           self.m2.read_value())
+        n = count + n_b
+        delta = mean_b - mean
+        mean = mean + delta * n_b / tf.maximum(n, 1.)
+        m2 = m2 + m2_b + delta**2 * count * n_b / tf.maximum(n, 1.)
+
+        with tf.control_dependencies([n, mean, m2]):
+            update_op = tf.group(self.count.assign(n), self.mean.assign(mean),
+                                 self.m2.assign(m2))
+        tf.add_to_collection(tf.GraphKeys.UPDATE_OPS, update_op)
+        return update_op
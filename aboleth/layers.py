@@ -5,8 +5,10 @@ import tensorflow as tf
 from aboleth.kernels import RBF, RBFVariational
 from aboleth.random import seedgen
 from aboleth.distributions import (norm_prior, norm_posterior, gaus_posterior,
-                                   kl_qp)
-from aboleth.baselayers import Layer, MultiLayer
+                                   kl_qp, Normal, Gaussian, _normal_kl)
+from aboleth.util import pos
+from aboleth.baselayers import (Layer, MultiLayer, buildmode,
+                                _unscoped_variable)
 
 
 #
@@ -20,7 +22,13 @@ class InputLayer(MultiLayer):
     inputs to a complex set of layers. It takes a 2D tensor of shape (N, D).
     If n_samples is specified, the input is tiled along a new first axis
     creating a (n_samples, N, D) tensor for propogating samples through a
-    variational deep net.
+    variational deep net. In posterior mean mode (see
+    ``baselayers.posterior_mean``) only a single sample is created.
+
+    The input can also be a (N, D) ``tf.SparseTensor``, e.g. from
+    ``tf.sparse_placeholder``, in which case it is not tiled, but wrapped in
+    a ``SparseSamples`` object that the ``RandomFourier``, ``RandomArcCosine``
+    and ``DenseVariational`` layers accept as their input.
 
     Parameters
     ----------
@@ -39,13 +47,69 @@ class InputLayer(MultiLayer):
     def _build(self, **kwargs):
         """Build the tiling input layer."""
         X = kwargs[self.name]
-        if self.n_samples is not None:
+        if isinstance(X, (tf.SparseTensor, tf.SparseTensorValue)):
+            # Sparse inputs are shared by all of the samples, not tiled
+            n_samples = 1 if self.n_samples is None or \
+                buildmode.posterior_mean else self.n_samples
+            Xs = SparseSamples(X, n_samples)
+        elif self.n_samples is not None and buildmode.posterior_mean:
+            # (1, N, D)
+            Xs = tf.expand_dims(X, 0)
+        elif self.n_samples is not None:
             # (n_samples, N, D)
             Xs = tf.tile(tf.expand_dims(X, 0), [self.n_samples, 1, 1])
         else:
             Xs = tf.convert_to_tensor(X)
         return Xs, 0.0
 
+    def _cache_key(self, **kwargs):
+        """Identify the build by the input name, samples and data."""
+        return (InputLayer, self.name, self.n_samples,
+                id(kwargs[self.name]))
+
+    def _build_moments(self, **kwargs):
+        """Build the input moments, the input is known exactly (no tiling)."""
+        X = kwargs[self.name]
+        if isinstance(X, (tf.SparseTensor, tf.SparseTensorValue)):
+            raise ValueError("Moment propagation does not support sparse "
+                             "inputs, use a dense input for {}!"
+                             .format(self.name))
+        M = tf.convert_to_tensor(X)
+        V = tf.zeros_like(M)
+        return M, V
+
+
+class SparseSamples:
+    r"""A sparse input that is shared by all of the samples of a net.
+
+    This represents a (n_samples, N, D) input where every sample is the same
+    (N, D) ``tf.SparseTensor``, without copying it. It is made by
+    ``InputLayer`` from a sparse input, and layers that accept it apply their
+    (sampled) weights to the single sparse matrix with a sparse-dense matrix
+    multiply. The number of columns, D, must be statically known.
+
+    Parameters
+    ----------
+    X : tf.SparseTensor
+        the sparse (N, D) input.
+    n_samples : int
+        the number of samples this input represents.
+
+    Attributes
+    ----------
+    shape : tf.TensorShape
+        the shape, (n_samples, N, D), this input represents.
+
+    """
+
+    def __init__(self, X, n_samples):
+        """Construct an instance of SparseSamples."""
+        if isinstance(X, tf.SparseTensorValue):
+            X = tf.SparseTensor.from_value(X)
+        self.X = X
+        self.n_samples = n_samples
+        self.shape = tf.TensorShape([n_samples]).concatenate(X.get_shape())
+
 
 class SampleLayer(Layer):
     r"""Sample Layer base class.
@@ -74,7 +138,7 @@ class SampleLayer(Layer):
         """
         rank = len(X.shape)
         assert rank > 2
-        Net, KL = self._build(X)
+        Net, KL = super(SampleLayer, self).__call__(X)
         return Net, KL
 
     @staticmethod
@@ -123,6 +187,9 @@ class SampleLayer3(SampleLayer):
 class Activation(Layer):
     """Activation function layer.
 
+    Moment propagation (see ``Layer.moments``) is only implemented for the
+    identity, ``tf.nn.relu`` and ``tf.sigmoid`` activations.
+
     Parameters
     ----------
     h : callable
@@ -130,7 +197,7 @@ class Activation(Layer):
 
     """
 
-    def __init__(self, h=lambda X: X):
+    def __init__(self, h=tf.identity):
         """Create an instance of an Activation layer."""
         self.h = h
 
@@ -140,12 +207,21 @@ class Activation(Layer):
         KL = 0.
         return Net, KL
 
+    def _build_moments(self, M, V):
+        """Build the moment propagation graph of this layer."""
+        if self.h not in _activation_moments:
+            raise NotImplementedError("No moment propagation for activation "
+                                      "{}!".format(self.h))
+        M, V = _activation_moments[self.h](M, V)
+        return M, V
+
 
 class DropOut(Layer):
     r"""Dropout layer, Bernoulli probability of not setting an input to zero.
 
     This is just a thin wrapper around `tf.dropout
-    <https://www.tensorflow.org/api_docs/python/tf/nn/dropout>`_
+    <https://www.tensorflow.org/api_docs/python/tf/nn/dropout>`_. In posterior
+    mean mode this layer is the identity (its expected value).
 
     Parameters
     ----------
@@ -161,11 +237,20 @@ class DropOut(Layer):
 
     def _build(self, X):
         """Build the graph of this layer."""
+        if buildmode.posterior_mean:
+            return X, 0.
+
         noise_shape = None  # equivalent to different samples from posterior
         Net = tf.nn.dropout(X, self.keep_prob, noise_shape, seed=next(seedgen))
         KL = 0.
         return Net, KL
 
+    def _build_moments(self, M, V):
+        """Build the moment propagation graph of this layer."""
+        # tf.nn.dropout scales the kept inputs by 1 / keep_prob
+        V = (M**2 + V) / self.keep_prob - M**2
+        return M, V
+
 
 class MaxPool2D(Layer):
     r"""Max pooling layer for 2D inputs (e.g. images).
@@ -223,6 +308,12 @@ class Reshape(Layer):
         KL = 0.
         return Net, KL
 
+    def _build_moments(self, M, V):
+        """Build the moment propagation graph of this layer."""
+        new_shape = [-1] + list(self.target_shape)
+        M, V = tf.reshape(M, new_shape), tf.reshape(V, new_shape)
+        return M, V
+
 
 #
 # Kernel Approximation Layers
@@ -250,12 +341,24 @@ class RandomFourier(SampleLayer3):
         """Construct and instance of a RandomFourier object."""
         self.n_features = n_features
         self.kernel = kernel
+        self.weights = None
 
     def _build(self, X):
         """Build the graph of this layer."""
-        # Random weights
+        # Random weights, these are kept for subsequent calls to this layer
         n_samples, input_dim = self._get_X_dims(X)
-        P, KL = self.kernel.weights(input_dim, self.n_features)
+        if self.weights is None:
+            self.weights = self.kernel.weights(input_dim, self.n_features)
+        P, KL = self.weights
+        if buildmode.posterior_mean:
+            KL = 0.
+
+        # The projection is the same for all samples of a sparse input
+        if isinstance(X, SparseSamples):
+            XP = tf.sparse_tensor_dense_matmul(X.X, P)
+            Net = self._transformation(XP)
+            return tf.tile(tf.expand_dims(Net, 0), [n_samples, 1, 1]), KL
+
         Ps = tf.tile(tf.expand_dims(P, 0), [n_samples, 1, 1])
 
         # Random features
@@ -270,6 +373,34 @@ class RandomFourier(SampleLayer3):
         Net = tf.concat([real, imag], axis=-1) / np.sqrt(self.n_features)
         return Net
 
+    def _build_moments(self, M, V):
+        """Build the moment propagation graph of this layer.
+
+        The random features are not correlated in this approximation.
+        """
+        input_dim = int(M.shape[1])
+        if self.weights is None:
+            self.weights = self.kernel.weights(input_dim, self.n_features)
+        P, _ = self.weights
+
+        # Moments of the (Gaussian) projection of the input
+        MP = tf.matmul(M, P)
+        VP = tf.matmul(V, P**2)
+        M, V = self._transformation_moments(MP, VP)
+        return M, V
+
+    def _transformation_moments(self, MP, VP):
+        """Build the moments of the kernel feature space transformation."""
+        # Gaussian expectations of cos and sin
+        decay = tf.exp(-0.5 * VP)
+        decay2 = tf.exp(-2. * VP) * tf.cos(2. * MP)
+        Mr, Mi = tf.cos(MP) * decay, tf.sin(MP) * decay
+        Vr = 0.5 * (1. + decay2) - Mr**2
+        Vi = 0.5 * (1. - decay2) - Mi**2
+        M = tf.concat([Mr, Mi], axis=-1) / np.sqrt(self.n_features)
+        V = tf.concat([Vr, Vi], axis=-1) / self.n_features
+        return M, V
+
 
 class RandomArcCosine(RandomFourier):
     r"""Random arc-cosine kernel layer.
@@ -323,6 +454,7 @@ class RandomArcCosine(RandomFourier):
 
         # Kernel order
         assert isinstance(p, int) and p >= 0
+        self.p = p
         if p == 0:
             self.pfunc = tf.sign
         elif p == 1:
@@ -335,6 +467,19 @@ class RandomArcCosine(RandomFourier):
         Net = np.sqrt(2. / self.n_features) * tf.nn.relu(self.pfunc(XP))
         return Net
 
+    def _transformation_moments(self, MP, VP):
+        """Build the moments of the kernel feature space transformation."""
+        if self.p == 0:
+            M, V = _step_moments(MP, VP)
+        elif self.p == 1:
+            M, V = _relu_moments(MP, VP)
+        else:
+            raise NotImplementedError("Moment propagation is only implemented"
+                                      " for p = 0 or 1!")
+        M *= np.sqrt(2. / self.n_features)
+        V *= 2. / self.n_features
+        return M, V
+
 
 #
 # Weight layers
@@ -343,6 +488,9 @@ class RandomArcCosine(RandomFourier):
 class DenseVariational(SampleLayer3):
     r"""Dense (fully connected) linear layer, with variational inference.
 
+    In posterior mean mode (see ``baselayers.posterior_mean``) this layer uses
+    the posterior means of the weights, and returns a KL of 0.0.
+
     Parameters
     ----------
     output_dim : int
@@ -399,11 +547,18 @@ class DenseVariational(SampleLayer3):
         self.qW = self._make_posterior(self.qW, W_shape)
 
         # Regularizers
-        KL = kl_qp(self.qW, self.pW)
+        KL = self._kl(self.qW, self.pW)
 
         # Linear layer
         Wsamples = self._sample_W(self.qW, n_samples)
-        Net = tf.matmul(X, Wsamples)
+        if isinstance(X, SparseSamples):
+            Net = _sparse_matmul(X.X, Wsamples)
+        elif buildmode.posterior_mean:
+            # One posterior mean is shared by all of the input samples
+            Net = tf.tensordot(X, Wsamples[0], axes=1)
+            Net.set_shape(X.shape[:2].concatenate([self.output_dim]))
+        else:
+            Net = tf.matmul(X, Wsamples)
 
         # Optional bias
         if self.use_bias is True or self.prior_b or self.post_b:
@@ -412,7 +567,7 @@ class DenseVariational(SampleLayer3):
             self.qb = self._make_posterior(self.qb, b_shape)
 
             # Regularizers
-            KL += kl_qp(self.qb, self.pb)
+            KL += self._kl(self.qb, self.pb)
 
             # Linear layer
             bsamples = tf.expand_dims(self._sample_W(self.qb, n_samples), 1)
@@ -420,6 +575,57 @@ class DenseVariational(SampleLayer3):
 
         return Net, KL
 
+    def _build_moments(self, M, V):
+        """Build the moment propagation graph of this layer."""
+        input_dim = int(M.shape[1])
+        W_shape, b_shape = self._weight_shapes(input_dim)
+        self.pW = self._make_prior(self.pW, W_shape)
+        self.qW = self._make_posterior(self.qW, W_shape)
+
+        # Independent inputs and weights, E[x^T w] and Var[x^T w]
+        M, V = (tf.matmul(M, self.qW.mu),
+                tf.matmul(V, self.qW.mu**2 + _marginal_var(self.qW)) +
+                _quadratic_var(M, self.qW))
+
+        if self.use_bias is True or self.pb or self.qb:
+            self.pb = self._make_prior(self.pb, b_shape)
+            self.qb = self._make_posterior(self.qb, b_shape)
+            M += self.qb.mu
+            V += _marginal_var(self.qb)
+
+        return M, V
+
+    def sample_columns(self, ind, n_samples):
+        r"""Sample only some of the output columns of the layer weights.
+
+        This is useful when only a small subset of the outputs of a very wide
+        layer are needed, for example with the
+        ``likelihoods.SampledCategorical`` likelihood. The layer has to be
+        built (called) first so its posterior exists.
+
+        Parameters
+        ----------
+        ind : Tensor
+            a vector of (C,) output column indices to sample.
+        n_samples : int
+            the number of samples to draw.
+
+        Returns
+        -------
+        Wsamples : Tensor
+            weight samples of shape (n_samples, input_dim, C).
+        bsamples : Tensor, None
+            bias samples of shape (n_samples, C) if this layer has a bias,
+            otherwise None.
+
+        """
+        if self.qW is None:
+            raise ValueError("Build this layer before sampling columns!")
+        Wsamples = _sample_columns(self.qW, ind, n_samples)
+        bsamples = None if self.qb is None \
+            else _sample_columns(self.qb, ind, n_samples)
+        return Wsamples, bsamples
+
     def _make_prior(self, prior_W, weight_shape):
         """Check/make prior."""
         if prior_W is None:
@@ -453,15 +659,29 @@ class DenseVariational(SampleLayer3):
 
     @staticmethod
     def _sample_W(dist, n_samples):
-        samples = tf.stack([dist.sample() for _ in range(n_samples)])
+        """Sample the weights, or use one copy of their posterior mean."""
+        if buildmode.posterior_mean:
+            samples = tf.expand_dims(dist.mu, 0)  # broadcast over samples
+        else:
+            samples = tf.stack([dist.sample() for _ in range(n_samples)])
         return samples
 
+    @staticmethod
+    def _kl(q, p):
+        """Build the KL regularizer, unless in posterior mean mode."""
+        KL = 0. if buildmode.posterior_mean else kl_qp(q, p)
+        return KL
+
 
 class EmbedVariational(DenseVariational):
     r"""Dense (fully connected) embedding layer, with variational inference.
 
     This layer works directly on shape (N, 1) inputs of category *indices*
-    rather than one-hot representations, for efficiency.
+    rather than one-hot representations, for efficiency. With a (diagonal)
+    Normal posterior, only the rows of the embedding table used in a batch are
+    sampled, so the gradients of the expected log likelihood with respect to
+    the posterior variables are sparse. The KL divergence of the whole table
+    still has dense gradients, unless ``sparse_kl`` is used.
 
     Parameters
     ----------
@@ -486,11 +706,25 @@ class EmbedVariational(DenseVariational):
         It must have parameters compatible with (input_dim, output_dim) shaped
         weights. This ignores the ``full`` parameter. See also
         ``distributions.gaus_posterior``.
+    sparse_kl : bool
+        If true, only compute the KL divergence of the rows of the embedding
+        table used in a batch, so all of the gradients of the posterior
+        variables are sparse for very large tables. The KL of each of these
+        rows is divided by the probability the row is in a batch (a
+        Horvitz-Thompson estimate), which is unbiased for the full KL when the
+        rows of a batch are drawn independently with the category
+        ``frequencies``. This only applies to (diagonal) Normal posteriors.
+    frequencies : ndarray, optional
+        the (positive) frequencies, or counts, of each of the
+        ``n_categories`` categories in the training data, for ``sparse_kl``.
+        By default the categories are assumed to be equally frequent, which
+        biases the KL estimate if they are not.
 
     """
 
     def __init__(self, output_dim, n_categories, var=1., full=False,
-                 prior_W=None, post_W=None):
+                 prior_W=None, post_W=None, sparse_kl=False,
+                 frequencies=None):
         """Create and instance of a variational dense embedding layer."""
         assert n_categories >= 2, "Need 2 or more categories for embedding!"
         self.output_dim = output_dim
@@ -499,6 +733,8 @@ class EmbedVariational(DenseVariational):
         self.full = full
         self.pW = prior_W
         self.qW = post_W
+        self.sparse_kl = sparse_kl
+        self.row_probs = _category_probs(frequencies, n_categories)
 
     def _build(self, X):
         """Build the graph of this layer."""
@@ -512,14 +748,428 @@ class EmbedVariational(DenseVariational):
         self.qW = self._make_posterior(self.qW, W_shape)
 
         # Index into the relevant weights rather than using sparse matmul
+        Net, KL = self._embed(X[0, :, 0], n_samples)
+
+        return Net, KL
+
+    def _build_moments(self, M, V):
+        """Build the moment propagation graph of this layer."""
+        W_shape, _ = self._weight_shapes(self.n_categories)
+        self.pW = self._make_prior(self.pW, W_shape)
+        self.qW = self._make_posterior(self.qW, W_shape)
+
+        # The indices are known, so only the weights are uncertain
+        M, V = (tf.gather(self.qW.mu, M[:, 0]),
+                tf.gather(_marginal_var(self.qW), M[:, 0]))
+        return M, V
+
+    def _embed(self, ind, n_samples):
+        """Sample the embeddings of ``ind``, with shape (n_samples,) + ind."""
+        if isinstance(self.qW, Gaussian):
+            # The rows are correlated, so sample the whole table
+            Wsamples = self._sample_W(self.qW, n_samples)
+            Net = tf.gather(Wsamples, ind, axis=1)
+            if buildmode.posterior_mean:
+                Net = _tile_samples(Net, n_samples)
+            KL = self._kl(self.qW, self.pW)
+            return Net, KL
+
+        # Only sample the rows (categories) in this batch
+        rows, row_ind = tf.unique(tf.reshape(ind, [-1]))
+        qrows = self.qW.gather(rows)
+        if buildmode.posterior_mean:
+            Wrows = _tile_samples(tf.expand_dims(qrows.mu, 0), n_samples)
+        else:
+            shape = tf.concat([[n_samples], tf.shape(qrows.mu)], axis=0)
+            e = tf.random_normal(shape, seed=next(seedgen))
+            Wrows = qrows.mu + e * qrows.sigma
+            Wrows.set_shape([n_samples, None, self.output_dim])
+        Net = tf.gather(Wrows, tf.reshape(row_ind, tf.shape(ind)), axis=1)
+
+        if self.sparse_kl:
+            KL = self._sparse_kl(qrows, rows, self._n_draws(ind))
+        else:
+            KL = self._kl(self.qW, self.pW)
+        return Net, KL
+
+    def _sparse_kl(self, qrows, rows, n_draws):
+        """Estimate the KL of the table from the rows in a batch."""
+        if buildmode.posterior_mean:
+            return 0.
+
+        # The probability each row is in a batch of n_draws independent draws
+        p = tf.gather(tf.constant(self.row_probs, dtype=tf.float32), rows)
+        inclusion = - tf.expm1(tf.to_float(n_draws) * tf.log1p(-p))
+
+        KL_rows = tf.reduce_sum(_normal_kl(qrows, self.pW.gather(rows)),
+                                axis=1)
+        KL = tf.reduce_sum(KL_rows / inclusion)
+        return KL
+
+    @staticmethod
+    def _n_draws(ind):
+        """Get the number of draws from the table for the batch ``ind``."""
+        return tf.size(ind)
+
+
+class MultiEmbedVariational(EmbedVariational):
+    r"""Embedding of multiple categorical columns, with variational inference.
+
+    This embeds each column of an (N, n_columns) input of category *indices*
+    with its own embedding table, and concatenates the embeddings. It is
+    equivalent to concatenating an ``EmbedVariational`` layer per column, but
+    all of the tables are packed into one weight variable, so there is only
+    one sample, one gather and one KL for all of the columns.
+
+    Parameters
+    ----------
+    output_dim : int
+        the dimension of the embedding of *each* column, the total output
+        dimension is ``n_columns * output_dim``.
+    n_categories : [int]
+        the number of categories in each input column.
+    var : float
+        the initial value of the weight prior variance, which defaults to
+        :math:`\mathbf{W} \sim \mathcal{N}(\mathbf{0}, \text{var}
+        \mathbf{I})`, this is optimized (a la maximum likelihood type II).
+    full : bool
+        If true, use a full covariance Gaussian posterior for *each* of the
+        output weight columns, otherwise use an independent (diagonal) Normal
+        posterior.
+    prior_W : distributions.Normal, distributions.Gaussian, optional
+        This is the prior distribution object to use on the layer weights. It
+        must have parameters compatible with (sum(n_categories), output_dim)
+        shaped weights. This ignores the ``var`` parameter.
+    post_W : distributions.Normal, distributions.Gaussian, optional
+        This is the posterior distribution object to use on the layer weights.
+        It must have parameters compatible with (sum(n_categories),
+        output_dim) shaped weights. This ignores the ``full`` parameter.
+    sparse_kl : bool
+        If true, only compute the KL divergence of the rows of the tables
+        used in a batch, see ``EmbedVariational``.
+    frequencies : [ndarray], optional
+        the frequencies of the categories of each input column, for
+        ``sparse_kl``, see ``EmbedVariational``.
+
+    """
+
+    def __init__(self, output_dim, n_categories, var=1., full=False,
+                 prior_W=None, post_W=None, sparse_kl=False,
+                 frequencies=None):
+        """Create and instance of a variational multi-column embedding."""
+        assert all(k >= 2 for k in n_categories), \
+            "Need 2 or more categories for embedding!"
+        super().__init__(output_dim=output_dim,
+                         n_categories=int(np.sum(n_categories)), var=var,
+                         full=full, prior_W=prior_W, post_W=post_W,
+                         sparse_kl=sparse_kl)
+        if frequencies is None:
+            frequencies = [None] * len(n_categories)
+        self.row_probs = np.concatenate([
+            _category_probs(f, k) for f, k in zip(frequencies, n_categories)])
+        self.column_categories = list(n_categories)
+        self.offsets = np.cumsum([0] + self.column_categories[:-1],
+                                 dtype=np.int32)
+
+    def _build(self, X):
+        """Build the graph of this layer."""
+        n_samples, input_dim = self._get_X_dims(X)
+        W_shape, _ = self._weight_shapes(self.n_categories)
+
+        assert input_dim == len(self.column_categories), \
+            "X must have a column of indices for each table!"
+
+        # Layer weights
+        self.pW = self._make_prior(self.pW, W_shape)
+        self.qW = self._make_posterior(self.qW, W_shape)
+
+        # Index into all of the packed tables at once, N x n_columns x O
+        Net, KL = self._embed(self._packed_index(X[0]), n_samples)
+        Net = tf.reshape(Net, (tf.shape(Net)[0], -1,
+                               input_dim * self.output_dim))
+        Net.set_shape([n_samples, None, input_dim * self.output_dim])
+
+        return Net, KL
+
+    def _build_moments(self, M, V):
+        """Build the moment propagation graph of this layer."""
+        W_shape, _ = self._weight_shapes(self.n_categories)
+        self.pW = self._make_prior(self.pW, W_shape)
+        self.qW = self._make_posterior(self.qW, W_shape)
+
+        # The indices are known, so only the weights are uncertain
+        ind, width = self._packed_index(M), int(M.shape[1]) * self.output_dim
+        M, V = (tf.reshape(tf.gather(self.qW.mu, ind), (-1, width)),
+                tf.reshape(tf.gather(_marginal_var(self.qW), ind),
+                           (-1, width)))
+        return M, V
+
+    def _packed_index(self, X):
+        """Offset the (N, n_columns) indices into the packed tables."""
+        return X + self.offsets.astype(X.dtype.as_numpy_dtype)
+
+    @staticmethod
+    def _n_draws(ind):
+        """Get the number of draws from each table, one per row of ``ind``."""
+        return tf.shape(ind)[0]
+
+
+class HashedEmbedVariational(EmbedVariational):
+    r"""Variational embedding of raw IDs, using the hashing trick.
+
+    This embeds an (N, 1) input of raw, unbounded cardinality integer (e.g.
+    int64) or string IDs. The IDs are hashed into a fixed number of buckets
+    within the graph, so no mapping of IDs to category indices is required,
+    and the size of the embedding table is bounded. If ``n_hashes > 1``, each
+    ID is hashed into a bucket with each of ``n_hashes`` different hash
+    functions, and the embeddings of these buckets are summed to reduce the
+    impact of hash collisions.
+
+    Parameters
+    ----------
+    output_dim : int
+        the dimension of the embedding.
+    n_buckets : int
+        the number of hash buckets, i.e. the number of rows in the embedding
+        table.
+    n_hashes : int
+        the number of hash functions to use per ID.
+    var : float
+        the initial value of the weight prior variance, which defaults to
+        :math:`\mathbf{W} \sim \mathcal{N}(\mathbf{0}, \text{var}
+        \mathbf{I})`, this is optimized (a la maximum likelihood type II).
+    full : bool
+        If true, use a full covariance Gaussian posterior for *each* of the
+        output weight columns, otherwise use an independent (diagonal) Normal
+        posterior.
+    prior_W : distributions.Normal, distributions.Gaussian, optional
+        This is the prior distribution object to use on the layer weights. It
+        must have parameters compatible with (n_buckets, output_dim) shaped
+        weights. This ignores the ``var`` parameter.
+    post_W : distributions.Normal, distributions.Gaussian, optional
+        This is the posterior distribution object to use on the layer weights.
+        It must have parameters compatible with (n_buckets, output_dim) shaped
+        weights. This ignores the ``full`` parameter.
+    sparse_kl : bool
+        If true, only compute the KL divergence of the rows of the table used
+        in a batch, see ``EmbedVariational``. The hashes are assumed to be
+        spread uniformly over the buckets.
+
+    """
+
+    def __init__(self, output_dim, n_buckets, n_hashes=1, var=1., full=False,
+                 prior_W=None, post_W=None, sparse_kl=False):
+        """Create and instance of a hashed variational embedding layer."""
+        assert n_hashes >= 1, "Need 1 or more hash functions!"
+        super().__init__(output_dim=output_dim, n_categories=n_buckets,
+                         var=var, full=full, prior_W=prior_W, post_W=post_W,
+                         sparse_kl=sparse_kl)
+        self.n_hashes = n_hashes
+        self.hash_keys = [[k, k] for k in range(n_hashes)]
+
+    def _build(self, X):
+        """Build the graph of this layer."""
+        n_samples, input_dim = self._get_X_dims(X)
+        W_shape, _ = self._weight_shapes(self.n_categories)
+
+        assert input_dim == 1, "Only one column of IDs can be embedded!"
+
+        # Layer weights
+        self.pW = self._make_prior(self.pW, W_shape)
+        self.qW = self._make_posterior(self.qW, W_shape)
+
+        # Sum the embeddings of each of the hash buckets, N x n_hashes x O
+        Net, KL = self._embed(self._hash_index(X[0, :, 0]), n_samples)
+        Net = tf.reduce_sum(Net, axis=2)
+
+        return Net, KL
+
+    def _build_moments(self, M, V):
+        """Build the moment propagation graph of this layer."""
+        W_shape, _ = self._weight_shapes(self.n_categories)
+        self.pW = self._make_prior(self.pW, W_shape)
+        self.qW = self._make_posterior(self.qW, W_shape)
+
+        # A bucket that is hit c times by an ID has c^2 times the variance
+        ind = self._hash_index(M[:, 0])
+        counts = tf.reduce_sum(tf.to_float(tf.equal(
+            tf.expand_dims(ind, 2), tf.expand_dims(ind, 1))), axis=2)
+        M = tf.reduce_sum(tf.gather(self.qW.mu, ind), axis=1)
+        V = tf.reduce_sum(tf.expand_dims(counts, 2) *
+                          tf.gather(_marginal_var(self.qW), ind), axis=1)
+        return M, V
+
+    def _hash_index(self, ids):
+        """Hash a vector of N IDs to (N, n_hashes) bucket indices."""
+        if ids.dtype != tf.string:
+            ids = tf.as_string(ids)
+        ind = [tf.string_to_hash_bucket_strong(ids, self.n_categories, key)
+               for key in self.hash_keys]
+        return tf.stack(ind, axis=1)
+
+
+class GroupedDenseVariational(DenseVariational):
+    r"""Independent dense layers on groups of features, with VI.
+
+    This applies ``n_groups`` independent dense (variational) layers to equal
+    sized groups of the columns of the input, and concatenates their outputs.
+    The weights are a block-diagonal tensor of shape (n_groups, input_dim /
+    n_groups, output_dim), and all of the groups are computed in a single
+    batched matrix multiply. Stacking these layers (with elementwise
+    activations in between) applies independent sub-networks of the same
+    architecture to each group, e.g. each feature, which is much faster than
+    ``hlayers.PerFeature`` for many features.
+
+    In posterior mean mode (see ``baselayers.posterior_mean``) this layer uses
+    the posterior means of the weights, and returns a KL of 0.0.
+
+    Parameters
+    ----------
+    output_dim : int
+        the dimension of the output of *each group* of this layer, the total
+        output dimension is ``n_groups * output_dim``.
+    n_groups : int
+        the number of groups to split the input columns into. This must evenly
+        divide the input dimension.
+    var : float
+        the initial value of the weight prior variance, which defaults to
+        :math:`\mathbf{W} \sim \mathcal{N}(\mathbf{0}, \text{var}
+        \mathbf{I})`, this is optimized (a la maximum likelihood type II).
+    use_bias : bool
+        If true, also learn a bias weight for each group.
+    prior_W : distributions.Normal, optional
+        This is the prior distribution object to use on the layer weights. It
+        must have parameters compatible with (n_groups, input_dim / n_groups,
+        output_dim) shaped weights. This ignores the ``var`` parameter.
+    prior_b : distributions.Normal, optional
+        This is the prior distribution object to use on the layer intercept. It
+        must have parameters compatible with (n_groups, output_dim) shaped
+        weights. This ignores the ``var`` and ``use_bias`` parameters.
+    post_W : distributions.Normal, optional
+        It must have parameters compatible with (n_groups, input_dim /
+        n_groups, output_dim) shaped weights.
+    post_b : distributions.Normal, optional
+        This is the posterior distribution object to use on the layer
+        intercept. It must have parameters compatible with (n_groups,
+        output_dim) shaped weights. This ignores the ``use_bias`` parameters.
+
+    """
+
+    def __init__(self, output_dim, n_groups, var=1., use_bias=True,
+                 prior_W=None, prior_b=None, post_W=None, post_b=None):
+        """Create and instance of a grouped variational dense layer."""
+        super().__init__(output_dim=output_dim, var=var, full=False,
+                         use_bias=use_bias, prior_W=prior_W, prior_b=prior_b,
+                         post_W=post_W, post_b=post_b)
+        self.n_groups = n_groups
+
+    def _build(self, X):
+        """Build the graph of this layer."""
+        n_samples, input_dim = self._get_X_dims(X)
+        W_shape, b_shape = self._weight_shapes(input_dim)
+
+        # Layer weights
+        self.pW = self._make_prior(self.pW, W_shape)
+        self.qW = self._make_posterior(self.qW, W_shape)
+
+        # Regularizers, this sums over groups
+        KL = self._kl(self.qW, self.pW)
+
+        # Grouped linear layer
         Wsamples = self._sample_W(self.qW, n_samples)
-        Net = tf.gather(Wsamples, X[0, :, 0], axis=1)
+        if buildmode.posterior_mean:
+            Wsamples = tf.tile(Wsamples, [n_samples, 1, 1, 1])
+        Net = _grouped_matmul(X, Wsamples)
 
-        # Regularizers
-        KL = kl_qp(self.qW, self.pW)
+        # Optional bias
+        if self.use_bias is True or self.pb or self.qb:
+            self.pb = self._make_prior(self.pb, b_shape)
+            self.qb = self._make_posterior(self.qb, b_shape)
+            KL += self._kl(self.qb, self.pb)
+            bsamples = self._sample_W(self.qb, n_samples)
+            Net += tf.reshape(bsamples,
+                              (-1, 1, self.n_groups * self.output_dim))
 
         return Net, KL
 
+    def _build_moments(self, M, V):
+        """Build the moment propagation graph of this layer."""
+        input_dim = int(M.shape[1])
+        W_shape, b_shape = self._weight_shapes(input_dim)
+        self.pW = self._make_prior(self.pW, W_shape)
+        self.qW = self._make_posterior(self.qW, W_shape)
+
+        # Independent inputs and weights, E[x^T w] and Var[x^T w]
+        M, V, mu, var = [tf.expand_dims(t, 0) for t in
+                         (M, V, self.qW.mu, self.qW.var)]
+        M, V = (_grouped_matmul(M, mu)[0],
+                _grouped_matmul(V, mu**2 + var)[0] +
+                _grouped_matmul(M**2, var)[0])
+
+        if self.use_bias is True or self.pb or self.qb:
+            self.pb = self._make_prior(self.pb, b_shape)
+            self.qb = self._make_posterior(self.qb, b_shape)
+            M += tf.reshape(self.qb.mu, (-1,))
+            V += tf.reshape(self.qb.var, (-1,))
+
+        return M, V
+
+    def sample_columns(self, ind, n_samples):
+        r"""Sample only some of the output columns of the layer weights.
+
+        The output columns are ordered by group, so column ``c`` is column
+        ``c % output_dim`` of group ``c // output_dim``. The sampled weights
+        are returned as the equivalent (block sparse) weights of a dense
+        layer, with zeros for the inputs of the other groups, see
+        ``DenseVariational.sample_columns``.
+
+        Parameters
+        ----------
+        ind : Tensor
+            a vector of (C,) output column indices to sample.
+        n_samples : int
+            the number of samples to draw.
+
+        Returns
+        -------
+        Wsamples : Tensor
+            weight samples of shape (n_samples, input_dim, C).
+        bsamples : Tensor, None
+            bias samples of shape (n_samples, C) if this layer has a bias,
+            otherwise None.
+
+        """
+        if self.qW is None:
+            raise ValueError("Build this layer before sampling columns!")
+        G, I, O = self.qW.mu.shape.as_list()
+
+        # Sample the columns of the (I, G * O) weights of all of the groups
+        mu, var = [tf.reshape(tf.transpose(w, [1, 0, 2]), (I, G * O))
+                   for w in (self.qW.mu, self.qW.var)]
+        Wcols = _sample_columns(Normal(mu, var), ind, n_samples)
+
+        # Only the inputs of the group of each column have weights
+        mask = tf.transpose(tf.one_hot(ind // O, G))  # G x C
+        Wsamples = tf.expand_dims(Wcols, 1) * tf.expand_dims(mask, 1)
+        Wsamples = tf.reshape(Wsamples, (n_samples, G * I, -1))
+
+        bsamples = None
+        if self.qb is not None:
+            qb = Normal(tf.reshape(self.qb.mu, (-1,)),
+                        tf.reshape(self.qb.var, (-1,)))
+            bsamples = _sample_columns(qb, ind, n_samples)
+        return Wsamples, bsamples
+
+    def _weight_shapes(self, input_dim):
+        """Generate weight and bias weight shape tuples."""
+        assert input_dim % self.n_groups == 0, \
+            "Input dimension must be divisible by the number of groups!"
+        weight_shape = (self.n_groups, input_dim // self.n_groups,
+                        self.output_dim)
+        bias_shape = (self.n_groups, self.output_dim)
+
+        return weight_shape, bias_shape
+
 
 class DenseMAP(SampleLayer):
     r"""Dense (fully connected) linear layer, with MAP inference.
@@ -545,6 +1195,8 @@ class DenseMAP(SampleLayer):
         self.l1 = l1_reg
         self.l2 = l2_reg
         self.use_bias = use_bias
+        self.W = None
+        self.b = None
 
     def _build(self, X):
         """Build the graph of this layer."""
@@ -552,8 +1204,11 @@ class DenseMAP(SampleLayer):
 
         Wdim = tuple(input_shape) + (self.output_dim,)
 
-        W = tf.Variable(tf.random_normal(shape=Wdim, seed=next(seedgen)),
-                        name="W_map")
+        # Weights are kept for subsequent calls to this layer
+        if self.W is None:
+            W0 = tf.random_normal(shape=Wdim, seed=next(seedgen))
+            self.W = _unscoped_variable(W0, name="W_map")
+        W = self.W
 
         # We don't want to copy tf.Variable W so map over X
         Net = tf.map_fn(lambda x: tf.matmul(x, W), X)
@@ -563,13 +1218,25 @@ class DenseMAP(SampleLayer):
 
         # Optional Bias
         if self.use_bias is True:
-            b = tf.Variable(tf.random_normal(shape=(1, self.output_dim),
-                                             seed=next(seedgen)), name="b_map")
+            if self.b is None:
+                b0 = tf.random_normal(shape=(1, self.output_dim),
+                                      seed=next(seedgen))
+                self.b = _unscoped_variable(b0, name="b_map")
+            b = self.b
             Net += b
             penalty += self.l2 * tf.nn.l2_loss(b) + self.l1 * _l1_loss(b)
 
         return Net, penalty
 
+    def _build_moments(self, M, V):
+        """Build the moment propagation graph of this layer."""
+        if self.W is None:
+            raise ValueError("Build this layer before propagating moments!")
+        M, V = tf.matmul(M, self.W), tf.matmul(V, self.W**2)
+        if self.use_bias is True:
+            M += self.b
+        return M, V
+
 
 #
 # Private module stuff
@@ -581,6 +1248,144 @@ def _l1_loss(X):
     return l1
 
 
+def _category_probs(frequencies, n_categories):
+    """Normalise category frequencies, or make uniform probabilities."""
+    if frequencies is None:
+        return np.full(n_categories, 1. / n_categories)
+    frequencies = np.asarray(frequencies, dtype=float)
+    assert frequencies.shape == (n_categories,), \
+        "Need a frequency for each category!"
+    assert np.all(frequencies > 0), "Frequencies must be positive!"
+    return frequencies / frequencies.sum()
+
+
+def _sample_columns(dist, ind, n_samples):
+    """Sample only columns ``ind`` of the last axis of a weight posterior."""
+    axis = len(dist.mu.shape) - 1
+    mu = tf.gather(dist.mu, ind, axis=axis)
+    if buildmode.posterior_mean:
+        return tf.stack([mu for _ in range(n_samples)])
+
+    shape = tf.concat([[n_samples], tf.shape(mu)], axis=0)
+    e = tf.random_normal(shape, seed=next(seedgen))
+    if isinstance(dist, Gaussian):
+        # Only the Cholesky factors of the columns, C x I x I
+        L = tf.gather(dist.L, ind)
+        Le = tf.matmul(L, tf.transpose(e, [2, 1, 0]))  # C x I x n_samples
+        samples = mu + tf.transpose(Le, [2, 1, 0])
+    else:
+        samples = mu + e * tf.gather(dist.sigma, ind, axis=axis)
+    return samples
+
+
+def _sparse_matmul(X, W):
+    """Multiply a sparse (N, D) X by each of the (S, D, O) W samples."""
+    S, D, O = W.shape.as_list()
+    WD = tf.reshape(tf.transpose(W, [1, 0, 2]), [D, S * O])
+    XW = tf.reshape(tf.sparse_tensor_dense_matmul(X, WD), [-1, S, O])
+    return tf.transpose(XW, [1, 0, 2])
+
+
+def _tile_samples(X, n_samples):
+    """Tile the single (posterior mean) sample of X to n_samples samples."""
+    X = tf.tile(X, [n_samples] + [1] * (X.shape.ndims - 1))
+    return X
+
+
+def _grouped_matmul(X, W):
+    """Multiply groups of the columns of X by their own weight matrices.
+
+    X is (n_samples, N, G * I) and W is (n_samples, G, I, O), and the result
+    is (n_samples, N, G * O), all computed in one batched matmul.
+    """
+    G, I, O = W.shape.as_list()[1:]
+    n_samples, N = tf.shape(X)[0], tf.shape(X)[1]
+    XG = tf.transpose(tf.reshape(X, (n_samples, N, G, I)), [0, 2, 1, 3])
+    Net = tf.matmul(tf.reshape(XG, (-1, N, I)), tf.reshape(W, (-1, I, O)))
+    Net = tf.transpose(tf.reshape(Net, (n_samples, G, N, O)), [0, 2, 1, 3])
+    Net = tf.reshape(Net, (n_samples, N, G * O))
+    Net.set_shape(X.shape[:2].concatenate([G * O]))
+    return Net
+
+
+def _marginal_var(dist):
+    r"""Get the marginal variance of the weights in a distribution."""
+    if isinstance(dist, Gaussian):
+        # diag(L L^T) for each output, (d_out, d_in) -> (d_in, d_out)
+        var = tf.transpose(tf.reduce_sum(dist.L**2, axis=-1))
+    else:
+        var = dist.var
+    return var
+
+
+def _quadratic_var(M, dist):
+    r"""Get the variance of ``M W`` from the weights, :math:`m^T C m`."""
+    if isinstance(dist, Gaussian):
+        # (N, d_in) x (d_out, d_in, d_in) -> (N, d_out, d_in)
+        LtM = tf.tensordot(M, dist.L, axes=[[1], [1]])
+        var = tf.reduce_sum(LtM**2, axis=-1)
+    else:
+        var = tf.matmul(M**2, dist.var)
+    return var
+
+
+def _norm_cdf(X):
+    r"""Standard normal cumulative distribution function."""
+    cdf = 0.5 * (1. + tf.erf(X / np.sqrt(2.)))
+    return cdf
+
+
+def _norm_pdf(X):
+    r"""Standard normal probability density function."""
+    pdf = tf.exp(-0.5 * X**2) / np.sqrt(2. * np.pi)
+    return pdf
+
+
+def _relu_moments(M, V):
+    r"""Moments of :math:`\max(0, x)`, :math:`x \sim N(M, V)`."""
+    S = tf.sqrt(pos(V))
+    A = M / S
+    cdf, pdf = _norm_cdf(A), _norm_pdf(A)
+    Mr = M * cdf + S * pdf
+    Vr = tf.nn.relu((M**2 + V) * cdf + M * S * pdf - Mr**2)
+    return Mr, Vr
+
+
+def _step_moments(M, V):
+    r"""Moments of :math:`\max(0, \text{sign}(x))`, :math:`x \sim N(M, V)`."""
+    Ms = _norm_cdf(M / tf.sqrt(pos(V)))
+    Vs = Ms * (1. - Ms)
+    return Ms, Vs
+
+
+def _sigmoid_moments(M, V):
+    r"""Moments of :math:`\sigma(x)`, :math:`x \sim N(M, V)`.
+
+    These are computed with Gauss-Hermite quadrature, which is accurate for
+    all but very large variances.
+    """
+    X = tf.expand_dims(M, -1) + \
+        tf.expand_dims(tf.sqrt(2. * V), -1) * _hermite_points
+    S = tf.sigmoid(X)
+    Ms = tf.reduce_sum(_hermite_weights * S, axis=-1)
+    Vs = tf.nn.relu(tf.reduce_sum(_hermite_weights * S**2, axis=-1) - Ms**2)
+    return Ms, Vs
+
+
+# Gauss-Hermite quadrature for standard Normal expectations
+_hermite_points, _hermite_weights = [
+    a.astype(np.float32) for a in np.polynomial.hermite.hermgauss(20)]
+_hermite_weights /= np.sqrt(np.pi)
+
+
+_activation_moments = {
+    tf.identity: lambda M, V: (M, V),
+    tf.nn.relu: _relu_moments,
+    tf.nn.sigmoid: _sigmoid_moments,
+    tf.sigmoid: _sigmoid_moments,
+}
+
+
 def _is_dim(X, dims):
     r"""Check if ``X``'s dimension is the same as the tuple ``dims``."""
     shape = tuple([int(d) for d in X.get_shape()])
@@ -3,6 +3,7 @@ import numpy as np
 import tensorflow as tf
 
 from aboleth.util import pos
+from aboleth.random import seedgen
 
 
 class Likelihood:
@@ -11,10 +12,13 @@ class Likelihood:
     def __call__(self, y, f):
         """Build the log likelihood.
 
-        See: _loglike.
+        See: _loglike and _offset.
 
         """
         ll = self._loglike(y, f)
+        offset = self._offset(y)
+        if offset is not None:
+            ll += offset
         return ll
 
     def _loglike(self, y, f):
@@ -30,6 +34,28 @@ class Likelihood:
         """
         raise NotImplementedError('Abstract base class only.')
 
+    def _offset(self, y):
+        """Build the terms of the log likelihood that do not depend on f.
+
+        These terms are only computed once per batch of targets, rather than
+        for every sample of the network output, and can be dropped from the
+        objective (see ``losses.elbo``). They are not included in
+        ``_loglike``.
+
+        Parameters
+        ----------
+        y : Tensor
+            the target variable of shape (N, tasks)
+
+        Returns
+        -------
+        offset : Tensor, None
+            the log likelihood offset of shape (N, tasks), or None if there
+            are no such terms.
+
+        """
+        return None
+
 
 class Normal(Likelihood):
     """Normal log-likelihood.
@@ -57,10 +83,27 @@ class Normal(Likelihood):
             the latent function output from the network of shape (N, tasks)
 
         """
-        ll = -0.5 * (tf.log(2 * self.variance * np.pi) +
-                     (y - f)**2 / self.variance)
+        ll = -0.5 * (y - f)**2 / self.variance
         return ll
 
+    def _offset(self, y):
+        """Build the normalising term of the log likelihood.
+
+        Parameters
+        ----------
+        y : Tensor
+            the target variable of shape (N, tasks)
+
+        Note
+        ----
+        This depends on the variance, so it should only be dropped from the
+        objective if the variance is not being learned.
+
+        """
+        ones = tf.ones(tf.shape(y))
+        offset = -0.5 * tf.log(2 * self.variance * np.pi) * ones
+        return offset
+
 
 class Bernoulli(Likelihood):
     """Bernoulli log-likelihood."""
@@ -80,8 +123,17 @@ class Bernoulli(Likelihood):
         return ll
 
 
-class Categorical(Likelihood):
-    """Categorical, or Generalized Bernoulli log-likelihood."""
+class BernoulliLogit(Likelihood):
+    """Bernoulli log-likelihood, parameterised by logits.
+
+    This is the same as ``Bernoulli``, but it takes the logits of the
+    probabilities (the output of the net *without* a sigmoid activation). The
+    log-likelihood is computed as ``y * f - softplus(f)``, which is
+    numerically stable, and saves the separate sigmoid and log passes over the
+    net outputs. This broadcasts ``y`` over any leading (sample) axes of
+    ``f``.
+
+    """
 
     def _loglike(self, y, f):
         """Build the log likelihood.
@@ -90,15 +142,198 @@ class Categorical(Likelihood):
         ----------
         y : Tensor
             the target variable of shape (N, tasks)
+        f : Tensor
+            the latent function output (logits) from the network of shape
+            (N, tasks)
+
+        """
+        ll = y * f - tf.nn.softplus(f)
+        return ll
+
+
+class Categorical(Likelihood):
+    """Categorical, or Generalized Bernoulli log-likelihood.
+
+    Parameters
+    ----------
+    sparse : bool
+        if True, the targets are integer class labels of shape (N,) or
+        (N, 1), rather than one-hot encoded arrays of shape (N, tasks). Only
+        the probability of the target class is gathered from the network
+        output, which avoids feeding and broadcasting one-hot targets for
+        large numbers of classes.
+
+    """
+
+    def __init__(self, sparse=False):
+        """Construct an instance of a Categorical likelihood."""
+        self.sparse = sparse
+
+    def _loglike(self, y, f):
+        """Build the log likelihood.
+
+        Parameters
+        ----------
+        y : Tensor
+            the target variable of shape (N, tasks), or integer labels of
+            shape (N,) or (N, 1) if ``sparse``.
         f : Tensor
             the latent function output from the network of shape (N, tasks)
 
         """
+        if self.sparse:
+            return tf.log(pos(_gather_labels(f, y)))
+
         # sum along last axis, which is assumed to be the `tasks` axis
         ll = tf.reduce_sum(y * tf.log(pos(f)), axis=-1)
         return ll
 
 
+class CategoricalLogit(Likelihood):
+    """Categorical, or Generalized Bernoulli log-likelihood, using logits.
+
+    This is the same as ``Categorical``, but it takes the unnormalised log
+    probabilities (the output of the net *without* a softmax activation).
+    The log-likelihood is computed with a fused log-softmax, which is more
+    accurate than taking the log of a softmax, especially for many classes.
+
+    Parameters
+    ----------
+    sparse : bool
+        if True, the targets are integer class labels of shape (N,) or
+        (N, 1), rather than one-hot encoded arrays of shape (N, tasks).
+
+    """
+
+    def __init__(self, sparse=False):
+        """Construct an instance of a CategoricalLogit likelihood."""
+        self.sparse = sparse
+
+    def _loglike(self, y, f):
+        """Build the log likelihood.
+
+        Parameters
+        ----------
+        y : Tensor
+            the target variable of shape (N, tasks), or integer labels of
+            shape (N,) or (N, 1) if ``sparse``.
+        f : Tensor
+            the latent function output (logits) from the network of shape
+            (N, tasks)
+
+        """
+        if self.sparse:
+            ll = _gather_labels(f, y) - tf.reduce_logsumexp(f, axis=-1)
+            return ll
+
+        # sum along last axis, which is assumed to be the `tasks` axis
+        ll = tf.reduce_sum(y * tf.nn.log_softmax(f), axis=-1)
+        return ll
+
+
+class SampledCategorical(Likelihood):
+    r"""Sampled-softmax approximation to the Categorical log-likelihood.
+
+    For very many classes, computing the full softmax over the outputs of the
+    last (``DenseVariational``) layer of a net is expensive. This likelihood
+    instead takes the *inputs* to that layer, and only samples the weight
+    columns of the true class, and of a small set of sampled candidate
+    classes. The candidate classes are shared across the batch, and the
+    logits are corrected for the candidate sampling distribution.
+
+    This is used in place of applying the last layer in the training graph,
+    e.g.::
+
+        H, kl = hidden_layers(X=X_)
+        logits, kl_out = output_layer(H)  # for prediction
+        lkhood = SampledCategorical(output_layer, n_sampled=100)
+        loss = ab.elbo(H, Y_, N, kl + kl_out, lkhood)
+
+    Parameters
+    ----------
+    layer : DenseVariational
+        the (built) output layer of the net, with ``output_dim`` classes.
+    n_sampled : int
+        the number of candidate classes to sample per batch.
+    sampler : callable
+        the candidate sampler to use, ``tf.nn.log_uniform_candidate_sampler``
+        suits classes sorted by decreasing frequency, otherwise see
+        ``tf.nn.uniform_candidate_sampler`` and related samplers.
+    subtract_log_q : bool
+        subtract the log of the expected candidate counts from the logits.
+        This corrects for the candidate sampling distribution.
+    remove_accidental_hits : bool
+        remove any sampled candidates that are the same as the true class.
+
+    Note
+    ----
+    The targets, ``y``, are integer class labels of shape (N,) or (N, 1).
+
+    """
+
+    def __init__(self, layer, n_sampled,
+                 sampler=tf.nn.log_uniform_candidate_sampler,
+                 subtract_log_q=True, remove_accidental_hits=True):
+        """Construct an instance of a SampledCategorical likelihood."""
+        self.layer = layer
+        self.n_sampled = n_sampled
+        self.sampler = sampler
+        self.subtract_log_q = subtract_log_q
+        self.remove_accidental_hits = remove_accidental_hits
+
+    def _loglike(self, y, f):
+        """Build the log likelihood.
+
+        Parameters
+        ----------
+        y : Tensor
+            the integer target labels of shape (N,) or (N, 1).
+        f : Tensor
+            the inputs to the output layer from the network of shape
+            (n_samples, N, input_dim).
+
+        """
+        labels = tf.reshape(tf.to_int64(y), [-1, 1])
+        sampled, true_count, sampled_count = self.sampler(
+            true_classes=labels,
+            num_true=1,
+            num_sampled=self.n_sampled,
+            unique=True,
+            range_max=self.layer.output_dim,
+            seed=next(seedgen)
+        )
+
+        # Only sample the weight columns of the true and candidate classes
+        N = tf.shape(labels)[0]
+        ind = tf.concat([labels[:, 0], sampled], axis=0)
+        W, b = self.layer.sample_columns(ind, int(f.shape[0]))
+
+        # The true logit uses a different weight column for each observation
+        true_logits = tf.reduce_sum(f * tf.transpose(W[:, :, :N], [0, 2, 1]),
+                                    axis=-1)
+        sampled_logits = tf.matmul(f, W[:, :, N:])
+        if b is not None:
+            true_logits += b[:, :N]
+            sampled_logits += tf.expand_dims(b[:, N:], 1)
+
+        if self.subtract_log_q:
+            true_logits -= tf.log(true_count[:, 0])
+            sampled_logits -= tf.log(sampled_count)
+
+        if self.remove_accidental_hits:
+            hit_rows, hit_ids, hit_weights = tf.nn.compute_accidental_hits(
+                labels, sampled, num_true=1)
+            hits = tf.scatter_nd(
+                tf.stack([hit_rows, tf.to_int32(hit_ids)], axis=1),
+                hit_weights, shape=[N, self.n_sampled])
+            sampled_logits += hits
+
+        logits = tf.concat([tf.expand_dims(true_logits, -1), sampled_logits],
+                           axis=-1)
+        ll = true_logits - tf.reduce_logsumexp(logits, axis=-1)
+        return ll
+
+
 class Binomial(Likelihood):
     """Binomial log-likelihood.
 
@@ -123,8 +358,44 @@ class Binomial(Likelihood):
         f : Tensor
             the latent function output from the network of shape (N, tasks)
 
+        """
+        ll = y * tf.log(pos(f)) + (self.n - y) * tf.log(pos(1 - f))
+        return ll
+
+    def _offset(self, y):
+        """Build the binomial coefficient term of the log likelihood.
+
+        Parameters
+        ----------
+        y : Tensor
+            the target variable of shape (N, tasks)
+
         """
         bincoef = tf.lgamma(self.n + 1) - tf.lgamma(y + 1) \
             - tf.lgamma(self.n - y + 1)
-        ll = bincoef + y * tf.log(pos(f)) + (self.n - y) * tf.log(pos(1 - f))
-        return ll
+        return bincoef
+
+
+#
+# Private module utilities
+#
+
+def _gather_labels(f, y):
+    """Gather f[..., n, y[n]] from f of shape (..., N, tasks).
+
+    This returns a Tensor of shape (..., N), i.e. the same shape as reducing
+    over the last axis of f.
+    """
+    y = tf.reshape(tf.to_int32(y), [-1])
+    shape = tf.shape(f, out_type=tf.int64)
+    N, K = shape[-2], shape[-1]
+
+    # Index (row, label) pairs of the (... x N) rows of classes, rather than
+    # flat indices into f, which can overflow for large numbers of classes
+    f_rows = tf.reshape(f, tf.stack([-1, K]))
+    n_rows = tf.shape(f_rows, out_type=tf.int64)[0]
+    # Some TensorFlow versions have no int64 tile kernel, so tile as int32
+    labels = tf.tile(y, tf.expand_dims(tf.to_int32(n_rows // N), 0))
+    ind = tf.stack([tf.range(n_rows), tf.to_int64(labels)], axis=1)
+    fy = tf.reshape(tf.gather_nd(f_rows, ind), shape[:-1])
+    return fy
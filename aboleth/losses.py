@@ -2,7 +2,7 @@
 import tensorflow as tf
 
 
-def elbo(Net, Y, N, KL, likelihood, like_weights=None):
+def elbo(Net, Y, N, KL, likelihood, like_weights=None, drop_offset=False):
     """Build the evidence lower bound loss for a neural net.
 
     Parameters
@@ -20,6 +20,12 @@ def elbo(Net, Y, N, KL, likelihood, like_weights=None):
         weights to apply to each observation in the expected log likelihood.
         This should be an array of shape (N, 1) or can be called as
         ``like_weights(Y)`` and should return a (N, 1) array.
+    drop_offset : bool
+        drop the terms of the log likelihood that do not depend on ``Net``
+        (e.g. the binomial coefficients of the ``Binomial`` likelihood) from
+        the loss. Otherwise these terms are computed once per batch, rather
+        than for every sample of ``Net``. This changes the value, but not the
+        gradients, of the loss if these terms have no learned parameters.
 
     Returns
     -------
@@ -34,7 +40,8 @@ def elbo(Net, Y, N, KL, likelihood, like_weights=None):
     n_samples = tf.to_float(Net.shape[0])  # averaging over samples
 
     # Just mean over samps for expected log-likelihood
-    ELL = _sum_likelihood(Y, Net, likelihood, like_weights) / n_samples
+    ELL = _sum_likelihood(Y, Net, likelihood, like_weights, n_samples,
+                          drop_offset) / n_samples
 
     # negative ELBO is batch weighted ELL and KL
     nELBO = - B * ELL + KL
@@ -43,7 +50,7 @@ def elbo(Net, Y, N, KL, likelihood, like_weights=None):
 
 
 def max_posterior(Net, Y, regulariser, likelihood, like_weights=None,
-                  first_axis_is_obs=True):
+                  first_axis_is_obs=True, drop_offset=False):
     """Build maximum a-posteriori (MAP) loss for a neural net.
 
     Parameters
@@ -63,6 +70,12 @@ def max_posterior(Net, Y, regulariser, likelihood, like_weights=None,
         indicates if the first axis indexes the observations/data or not. This
         will be True if ``Net`` is of shape (N, tasks) or False if ``Net`` is
         of shape (n_samples, N, tasks).
+    drop_offset : bool
+        drop the terms of the log likelihood that do not depend on ``Net``
+        (e.g. the binomial coefficients of the ``Binomial`` likelihood) from
+        the loss. Otherwise these terms are computed once per batch, rather
+        than for every sample of ``Net``. This changes the value, but not the
+        gradients, of the loss if these terms have no learned parameters.
 
     Returns
     -------
@@ -73,8 +86,12 @@ def max_posterior(Net, Y, regulariser, likelihood, like_weights=None,
     # Get the batch size to average the likelihood over
     M = tf.to_float(tf.shape(Net)[0 if first_axis_is_obs else 1])
 
+    # Samples of the likelihood to sum over
+    n_samples = 1. if first_axis_is_obs else tf.to_float(tf.shape(Net)[0])
+
     # Average likelihood for batch
-    AVLL = _sum_likelihood(Y, Net, likelihood, like_weights) / M
+    AVLL = _sum_likelihood(Y, Net, likelihood, like_weights, n_samples,
+                           drop_offset) / M
 
     # MAP objective
     MAP = - AVLL + regulariser
@@ -86,14 +103,25 @@ def max_posterior(Net, Y, regulariser, likelihood, like_weights=None,
 # Private module utilities
 #
 
-def _sum_likelihood(Y, Net, likelihood, like_weights):
-    """Sum the log-likelihood of the Y's under the model."""
-    like = likelihood(Y, Net)
+def _sum_likelihood(Y, Net, likelihood, like_weights, n_samples=1.,
+                    drop_offset=False):
+    """Sum the log-likelihood of the Y's under the model.
+
+    The likelihood offset (the terms that do not depend on Net) is computed
+    once and multiplied by the number of samples in Net, unless dropped.
+    """
     if callable(like_weights):
-        like *= like_weights(Y)
-    elif like_weights is not None:
-        like *= like_weights
+        like_weights = like_weights(Y)
 
+    like = likelihood._loglike(Y, Net)
+    if like_weights is not None:
+        like *= like_weights
     sumlike = tf.reduce_sum(like)
 
+    offset = None if drop_offset else likelihood._offset(Y)
+    if offset is not None:
+        if like_weights is not None:
+            offset *= like_weights
+        sumlike += n_samples * tf.reduce_sum(offset)
+
     return sumlike
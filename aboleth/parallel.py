@@ -0,0 +1,130 @@
+"""Data-parallel training with replicas (towers) of a net."""
+import tensorflow as tf
+
+from aboleth.losses import _sum_likelihood
+
+
+def tower_elbo(net, Y, N, likelihood, n_towers, like_weights=None,
+               drop_offset=False, devices=None, **inputs):
+    r"""Build the ELBO loss of a net, split over data-parallel towers.
+
+    The rows of each minibatch are split into ``n_towers`` shards, and a
+    replica (tower) of ``net`` is built on each shard. The towers share all of
+    the net's variables, since layers reuse their variables every time they
+    are built. The expected log likelihood of every shard is scaled with
+    respect to ``N`` and the *whole* minibatch, and the KL divergence is
+    counted once, so this is the same objective as ``losses.elbo``, but each
+    tower draws its own weight samples. Summing the towers' losses means the
+    gradients of the towers are summed to make the minibatch gradient.
+
+    The towers are independent subgraphs, so TensorFlow can run them
+    concurrently. This is useful when a single graph cannot use all of the
+    cores of a host, e.g. because its matrix multiplies are small, see
+    ``tower_config``. When minimizing this loss, use
+    ``colocate_gradients_with_ops=True`` so the gradients of each tower are
+    computed on its device.
+
+    Parameters
+    ----------
+    net : MultiLayer
+        the net to replicate, e.g. a stack of layers starting with an
+        ``InputLayer``.
+    Y : ndarray, Tensor
+        the targets of shape (N, tasks).
+    N : int, Tensor
+        the total size of the dataset (i.e. number of observations).
+    likelihood : Tensor
+        the likelihood model to use on the output of the last layer of the
+        neural net, see the :ref:`likelihoods` module.
+    n_towers : int
+        the number of towers to split each minibatch over.
+    like_weights : callable, ndarray, Tensor
+        weights to apply to each observation in the expected log likelihood,
+        see ``losses.elbo``.
+    drop_offset : bool
+        drop the terms of the log likelihood that do not depend on the net,
+        see ``losses.elbo``.
+    devices : list of str, optional
+        the device to build each tower on, by default they are placed with
+        the rest of the graph.
+    **inputs :
+        the inputs to ``net``, of shape (N, ...), by name.
+
+    Returns
+    -------
+    nelbo : Tensor
+        the loss function of the Bayesian neural net (negative ELBO).
+
+    """
+    assert n_towers >= 1, "Need at least one tower!"
+    assert devices is None or len(devices) == n_towers, \
+        "Need a device for each tower!"
+
+    partitions = tf.range(tf.shape(Y)[0]) % n_towers
+    shard = _sharder(partitions, n_towers)
+    shard_inputs = {k: shard(v) for k, v in inputs.items()}
+    shard_Y = shard(Y)
+    if like_weights is None or callable(like_weights):
+        shard_weights = [like_weights] * n_towers
+    else:
+        shard_weights = shard(like_weights)
+
+    sumlikes = []
+    for k in range(n_towers):
+        device = None if devices is None else devices[k]
+        with tf.device(device), tf.name_scope("tower_{}".format(k)):
+            Net, KL_k = net(**{n: v[k] for n, v in shard_inputs.items()})
+            n_samples = tf.to_float(Net.shape[0])
+            sumlikes.append(_sum_likelihood(shard_Y[k], Net, likelihood,
+                                            shard_weights[k], n_samples,
+                                            drop_offset)
+                            / n_samples)
+        if k == 0:
+            KL = KL_k  # The KL is the same for all of the towers
+
+    # Batch amplification of the expected log likelihood of all the shards
+    B = N / tf.to_float(tf.shape(Y)[0])
+    nELBO = - B * tf.add_n(sumlikes) + KL
+    return nELBO
+
+
+def tower_config(n_towers, n_cores=None, **kwargs):
+    r"""Make a session configuration for running towers on CPU cores.
+
+    This gives each tower its own inter-op thread, and divides the cores
+    between the towers for their intra-op (e.g. matrix multiply) threads.
+
+    Parameters
+    ----------
+    n_towers : int
+        the number of towers, see ``tower_elbo``.
+    n_cores : int, optional
+        the number of cores to use, by default all of them.
+    **kwargs :
+        any other arguments to ``tf.ConfigProto``.
+
+    Returns
+    -------
+    config : tf.ConfigProto
+        the session configuration.
+
+    """
+    if n_cores is None:
+        import multiprocessing
+        n_cores = multiprocessing.cpu_count()
+    config = tf.ConfigProto(
+        inter_op_parallelism_threads=max(n_towers, 2),
+        intra_op_parallelism_threads=max(n_cores // n_towers, 1),
+        **kwargs)
+    return config
+
+
+#
+# Private module stuff
+#
+
+def _sharder(partitions, n_towers):
+    """Make a function that splits the rows of a tensor into shards."""
+    def shard(X):
+        return tf.dynamic_partition(X, partitions, n_towers)
+    return shard
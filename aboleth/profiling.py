@@ -0,0 +1,193 @@
+"""Per-layer profiling of the compute time, memory and FLOPs of a net."""
+import re
+from collections import defaultdict
+
+import tensorflow as tf
+from tensorflow.python.client import timeline
+
+from aboleth.baselayers import LAYER_SCOPES
+
+
+OTHER = "(other)"  # The scope of ops that are not part of any layer
+
+
+def profile(fetches, feed_dict=None, session=None, n_steps=5,
+            trace_path=None):
+    r"""Profile the ops of each layer of a net.
+
+    This runs ``fetches`` (e.g. a training op) for ``n_steps`` with full trace
+    metadata, and attributes the compute time, output memory and floating
+    point operations of each op to the layer that built it. Layers build their
+    ops in a name scope of their type (e.g. ``"DenseVariational_1"``), nested
+    within the scopes of layers that contain them (e.g. ``"Concat/"``). The
+    ops of the gradients of a layer are attributed to it separately as its
+    backward time. Ops outside of any layer, like the likelihood or the
+    optimizer, are attributed to ``"(other)"``.
+
+    Parameters
+    ----------
+    fetches : Tensor, Operation, list
+        what to run, as for ``session.run``.
+    feed_dict : dict, optional
+        the data to feed to the graph.
+    session : Session, optional
+        the session to use, by default the current default session.
+    n_steps : int
+        the number of steps to profile. The first step is not timed, as it
+        includes one-off costs, so this must be two or more.
+    trace_path : str, optional
+        if given, write a Chrome trace (see ``chrome://tracing``) of the last
+        step to this file.
+
+    Returns
+    -------
+    report : list of dict
+        the layers, ordered by descending total time. Each has the layer
+        ``"scope"``, the mean forward and backward compute time per step in
+        milliseconds (``"forward_ms"`` and ``"backward_ms"``), its share of
+        the total time (``"time_share"``), the bytes of the outputs of its ops
+        per step (``"output_bytes"``), and its floating point operations per
+        step (``"flops"``) and share of the total (``"flop_share"``), if
+        these are known.
+
+    """
+    assert n_steps >= 2, "Need at least two steps to profile!"
+    session = tf.get_default_session() if session is None else session
+    scopes = _layer_scopes(session.graph)
+
+    options = tf.RunOptions(trace_level=tf.RunOptions.FULL_TRACE)
+    stats = defaultdict(lambda: defaultdict(float))
+    for step in range(n_steps):
+        run_metadata = tf.RunMetadata()
+        session.run(fetches, feed_dict=feed_dict, options=options,
+                    run_metadata=run_metadata)
+        if step > 0:
+            _add_step_stats(stats, run_metadata.step_stats, scopes)
+
+    flops = _flops(session.graph, run_metadata, scopes)
+    if trace_path is not None:
+        trace = timeline.Timeline(run_metadata.step_stats)
+        with open(trace_path, "w") as f:
+            f.write(trace.generate_chrome_trace_format(show_memory=True))
+
+    n_timed = n_steps - 1
+    total_ms = sum(s["forward_ms"] + s["backward_ms"]
+                   for s in stats.values())
+    total_flops = sum(flops.values())
+    report = []
+    for scope in set(stats) | set(flops):
+        layer = {
+            "scope": scope,
+            "forward_ms": stats[scope]["forward_ms"] / n_timed,
+            "backward_ms": stats[scope]["backward_ms"] / n_timed,
+            "output_bytes": int(stats[scope]["output_bytes"] / n_timed),
+            "flops": flops.get(scope, 0),
+        }
+        layer["time_share"] = (stats[scope]["forward_ms"] +
+                               stats[scope]["backward_ms"]) / total_ms \
+            if total_ms > 0 else 0.
+        layer["flop_share"] = layer["flops"] / total_flops \
+            if total_flops > 0 else 0.
+        report.append(layer)
+
+    report.sort(key=lambda l: l["forward_ms"] + l["backward_ms"],
+                reverse=True)
+    return report
+
+
+def format_report(report):
+    r"""Format a profiling report as a table.
+
+    Parameters
+    ----------
+    report : list of dict
+        the output of ``profile``.
+
+    Returns
+    -------
+    table : str
+        a table of the per-layer statistics.
+
+    """
+    rows = ["{:<40} {:>10} {:>10} {:>7} {:>12} {:>12} {:>7}".format(
+        "layer", "fwd (ms)", "bwd (ms)", "time", "out (bytes)", "flops",
+        "flops")]
+    for l in report:
+        rows.append(
+            "{scope:<40} {forward_ms:>10.3f} {backward_ms:>10.3f} "
+            "{time_share:>7.1%} {output_bytes:>12d} {flops:>12d} "
+            "{flop_share:>7.1%}".format(**l))
+    return "\n".join(rows)
+
+
+#
+# Private module stuff
+#
+
+# Gradient ops are in a "gradients" scope (within any outer scopes)
+_gradient_prefix = re.compile(r"^(?:[^/]+/)*?gradients(?:_\d+)?/")
+
+
+def _layer_scopes(graph):
+    """Get the layer name scopes, longest (innermost) first."""
+    scopes = set(graph.get_collection(LAYER_SCOPES))
+    return sorted(scopes, key=len, reverse=True)
+
+
+def _scope_of(name, scopes):
+    """Get the layer scope of an op name, and if it is a gradient op."""
+    name = name.split(":")[0]  # GPU stream entries may be "name:kernel"
+    forward = _gradient_prefix.sub("", name)
+    for scope in scopes:
+        if forward.startswith(scope):
+            return scope.rstrip("/"), forward != name
+    return OTHER, forward != name
+
+
+def _timed_devices(step_stats):
+    """Get the device stats, without counting GPU ops twice."""
+    devices = step_stats.dev_stats
+    has_streams = any(d.device.endswith("/stream:all") for d in devices)
+    timed = []
+    for d in devices:
+        name = d.device.lower()
+        if "/stream:" in name or "memcpy" in name:
+            if name.endswith("/stream:all"):
+                timed.append(d)
+        elif not (has_streams and "gpu" in name):
+            timed.append(d)
+    return timed
+
+
+def _add_step_stats(stats, step_stats, scopes):
+    """Add the time and output memory of a step to the per-layer stats."""
+    for device in _timed_devices(step_stats):
+        for node in device.node_stats:
+            scope, backward = _scope_of(node.node_name, scopes)
+            ms = node.all_end_rel_micros / 1000.
+            stats[scope]["backward_ms" if backward else "forward_ms"] += ms
+            stats[scope]["output_bytes"] += sum(
+                o.tensor_description.allocation_description.allocated_bytes
+                for o in node.output)
+
+
+def _flops(graph, run_metadata, scopes):
+    """Get the floating point operations of each layer in a step."""
+    options = tf.profiler.ProfileOptionBuilder(
+        tf.profiler.ProfileOptionBuilder.float_operation()) \
+        .with_empty_output().build()
+    try:
+        tree = tf.profiler.profile(graph, run_meta=run_metadata, cmd="scope",
+                                   options=options)
+    except Exception:
+        return {}  # The profiler can fail on ops without registered FLOPs
+
+    flops = defaultdict(int)
+    nodes = list(tree.children)
+    while nodes:
+        node = nodes.pop()
+        nodes.extend(node.children)
+        if node.float_ops > 0:
+            scope, _ = _scope_of(node.name, scopes)
+            flops[scope] += node.float_ops
+    return flops
@@ -0,0 +1,278 @@
+"""Light-weight NumPy prediction runtime for exported nets.
+
+This module only depends on NumPy, and does not import TensorFlow or any other
+part of Aboleth. So for fast start up on prediction servers, it can be copied
+and used on its own. Nets can be exported for use with this module using
+``export.export_net``.
+"""
+import json
+
+import numpy as np
+
+
+SPEC_VERSION = 1
+
+
+def load(path):
+    r"""Load an exported net.
+
+    Parameters
+    ----------
+    path : str
+        the file written by ``export.export_net``.
+
+    Returns
+    -------
+    net : Net
+        the net, ready for making predictions.
+
+    """
+    with np.load(path) as data:
+        spec = json.loads(str(data["__spec__"]))
+        arrays = {k: data[k] for k in data.files if k != "__spec__"}
+
+    if spec["version"] != SPEC_VERSION:
+        raise ValueError("Unsupported export version {}!"
+                         .format(spec["version"]))
+
+    layers = []
+    for i, layer_spec in enumerate(spec["layers"]):
+        prefix = "{}/".format(i)
+        params = {k[len(prefix):]: v for k, v in arrays.items()
+                  if k.startswith(prefix)}
+        layers.append((layer_spec, params))
+
+    net = Net(layers)
+    return net
+
+
+class Net:
+    r"""An exported net, for making predictions with NumPy.
+
+    All computation is vectorised over the rows of the input, and the samples
+    from the net.
+
+    Parameters
+    ----------
+    layers : list
+        a list of ``(spec, params)`` tuples for each layer, where ``spec`` is a
+        dict specifying the layer, and ``params`` is a dict of its parameter
+        arrays. Use ``load`` to create this object.
+
+    """
+
+    def __init__(self, layers):
+        """Construct an instance of a Net."""
+        self.layers = layers
+        first = layers[0][0] if layers else {}
+        self.n_samples = first.get("n_samples") \
+            if first.get("type") == "input" else None
+
+    def predict_samples(self, X, n_samples=None, random_state=None):
+        r"""Draw samples from the predictive distribution of the net.
+
+        Parameters
+        ----------
+        X : ndarray
+            the query inputs, of shape (N, D).
+        n_samples : int, optional
+            the number of samples to draw, this defaults to the ``n_samples``
+            of the net's ``InputLayer``.
+        random_state : None, int, RandomState
+            the random state for drawing samples.
+
+        Returns
+        -------
+        pred : ndarray
+            prediction samples of shape (n_samples, N, tasks).
+
+        """
+        n_samples = self.n_samples if n_samples is None else n_samples
+        if n_samples is None:
+            raise ValueError("n_samples has to be specified!")
+        if not isinstance(random_state, np.random.RandomState):
+            random_state = np.random.RandomState(random_state)
+        pred = self._forward(X, n_samples, random_state)
+        return pred
+
+    def predict_expected(self, X, n_samples=None, random_state=None):
+        r"""Get the expected value of the predictive distribution of the net.
+
+        Parameters
+        ----------
+        X : ndarray
+            the query inputs, of shape (N, D).
+        n_samples : int, optional
+            the number of samples to use, this defaults to the ``n_samples``
+            of the net's ``InputLayer``.
+        random_state : None, int, RandomState
+            the random state for drawing samples.
+
+        Returns
+        -------
+        pred : ndarray
+            expected value of the prediction with shape (N, tasks).
+
+        """
+        pred = self.predict_samples(X, n_samples, random_state).mean(axis=0)
+        return pred
+
+    def predict_mean(self, X):
+        r"""Get the prediction of the net using the posterior mean weights.
+
+        This is the same as building the net with ``posterior_mean``.
+
+        Parameters
+        ----------
+        X : ndarray
+            the query inputs, of shape (N, D).
+
+        Returns
+        -------
+        pred : ndarray
+            prediction of shape (N, tasks).
+
+        """
+        pred = self._forward(X, 1, None)[0]
+        return pred
+
+    def _forward(self, X, n_samples, random_state):
+        """Propagate X through the net, no random state is posterior mean."""
+        X = np.asarray(X)
+        if not np.issubdtype(X.dtype, np.integer):
+            X = X.astype(np.float32)
+        Net = np.broadcast_to(X, (n_samples,) + X.shape)
+        for spec, params in self.layers:
+            forward = _layer_forward[spec["type"]]
+            Net = forward(Net, spec, params, random_state)
+        return Net
+
+
+#
+# Private module stuff
+#
+
+def _input(X, spec, params, random_state):
+    return X
+
+
+def _activation(X, spec, params, random_state):
+    return _activations[spec["h"]](X)
+
+
+def _dropout(X, spec, params, random_state):
+    if random_state is None:
+        return X
+    keep_prob = params["keep_prob"]
+    keep = random_state.rand(*X.shape) < keep_prob
+    return X * keep / keep_prob
+
+
+def _reshape(X, spec, params, random_state):
+    return X.reshape(X.shape[:2] + tuple(spec["target_shape"]))
+
+
+def _random_fourier(X, spec, params, random_state):
+    XP = np.matmul(X, params["P"])
+    Net = np.concatenate((np.cos(XP), np.sin(XP)), axis=-1)
+    return Net / np.sqrt(spec["n_features"])
+
+
+def _random_arccosine(X, spec, params, random_state):
+    XP = np.matmul(X, params["P"])
+    if spec["p"] == 0:
+        XP = np.sign(XP)
+    elif spec["p"] > 1:
+        XP = XP**spec["p"]
+    return np.sqrt(2. / spec["n_features"]) * np.maximum(XP, 0.)
+
+
+def _dense_variational(X, spec, params, random_state):
+    n_samples = X.shape[0]
+    W = _sample_posterior(spec, params, "W", n_samples, random_state)
+    Net = np.matmul(X, W)
+    if "b_mu" in params:
+        b = _sample_posterior(spec, params, "b", n_samples, random_state)
+        Net += b[:, np.newaxis, :]
+    return Net
+
+
+def _grouped_dense_variational(X, spec, params, random_state):
+    n_samples, N, _ = X.shape
+    W = _sample_posterior(spec, params, "W", n_samples, random_state)
+    G, I, O = W.shape[1:]
+    XG = X.reshape(n_samples, N, G, I).transpose(0, 2, 1, 3)
+    Net = np.matmul(XG, W).transpose(0, 2, 1, 3).reshape(n_samples, N, G * O)
+    if "b_mu" in params:
+        b = _sample_posterior(spec, params, "b", n_samples, random_state)
+        Net += b.reshape(n_samples, 1, G * O)
+    return Net
+
+
+def _embed_variational(X, spec, params, random_state):
+    n_samples = X.shape[0]
+    W = _sample_posterior(spec, params, "W", n_samples, random_state)
+    Net = W[:, X[0, :, 0]]
+    return Net
+
+
+def _multi_embed_variational(X, spec, params, random_state):
+    n_samples, N, n_columns = X.shape
+    W = _sample_posterior(spec, params, "W", n_samples, random_state)
+    Net = W[:, X[0] + np.array(spec["offsets"])]
+    return Net.reshape(n_samples, N, -1)
+
+
+def _dense_map(X, spec, params, random_state):
+    Net = np.matmul(X, params["W"])
+    if "b" in params:
+        Net += params["b"]
+    return Net
+
+
+def _sample_posterior(spec, params, name, n_samples, random_state):
+    """Draw samples of shape (n_samples, ...) from a posterior."""
+    mu = params[name + "_mu"]
+    if random_state is None:
+        return np.broadcast_to(mu, (n_samples,) + mu.shape)
+
+    if spec[name + "_posterior"] == "gaussian":
+        L = params[name + "_L"]  # O x I x I
+        e = random_state.randn(n_samples, *L.shape[:2]).astype(np.float32)
+        samples = mu + np.einsum("oij,soj->sio", L, e)
+    else:
+        e = random_state.randn(n_samples, *mu.shape).astype(np.float32)
+        samples = mu + e * np.sqrt(params[name + "_var"])
+    return samples
+
+
+def _sigmoid(X):
+    return 1. / (1. + np.exp(-X))
+
+
+def _softmax(X):
+    eX = np.exp(X - X.max(axis=-1, keepdims=True))
+    return eX / eX.sum(axis=-1, keepdims=True)
+
+
+_activations = {
+    "identity": lambda X: X,
+    "relu": lambda X: np.maximum(X, 0.),
+    "sigmoid": _sigmoid,
+    "tanh": np.tanh,
+    "softmax": _softmax,
+}
+
+_layer_forward = {
+    "input": _input,
+    "activation": _activation,
+    "dropout": _dropout,
+    "reshape": _reshape,
+    "random_fourier": _random_fourier,
+    "random_arccosine": _random_arccosine,
+    "dense_variational": _dense_variational,
+    "grouped_dense_variational": _grouped_dense_variational,
+    "embed_variational": _embed_variational,
+    "multi_embed_variational": _multi_embed_variational,
+    "dense_map": _dense_map,
+}
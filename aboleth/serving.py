@@ -0,0 +1,242 @@
+"""In-process prediction serving with request coalescing."""
+import asyncio
+import queue
+import threading
+import time
+from concurrent.futures import Future
+
+import numpy as np
+import tensorflow as tf
+
+
+class BatchPredictor:
+    r"""Coalesce concurrent prediction requests into batched evaluations.
+
+    Requests (arrays of query rows) are queued, and a worker thread
+    concatenates as many of them as it can into one call of ``predict_fn``.
+    It waits at most ``max_latency`` seconds after the first request before
+    evaluating a batch, and will not exceed ``max_batch_size`` rows unless a
+    single request is larger. The predictions are then split back out to the
+    individual requests.
+
+    This object can be used as a context manager, which starts and stops the
+    worker thread.
+
+    Parameters
+    ----------
+    predict_fn : callable
+        a function that takes an array of shape (N, ...) and returns an array
+        of predictions with the ``N`` rows along its first axis, see
+        ``session_predictor``.
+    max_batch_size : int
+        the maximum number of rows to coalesce into a batch.
+    max_latency : float
+        the maximum time (seconds) to wait for more requests to coalesce once
+        a request has been received.
+
+    """
+
+    def __init__(self, predict_fn, max_batch_size=1024, max_latency=0.005):
+        """Construct an instance of a BatchPredictor."""
+        self.predict_fn = predict_fn
+        self.max_batch_size = max_batch_size
+        self.max_latency = max_latency
+        self._requests = queue.Queue()
+        self._stop = threading.Event()
+        self._worker = None
+        self._lock = threading.Lock()
+        self.reset_stats()
+
+    def start(self):
+        """Start the worker thread."""
+        if self._worker is not None:
+            return
+        self._stop.clear()
+        self._worker = threading.Thread(target=self._run, daemon=True)
+        self._worker.start()
+
+    def stop(self):
+        """Stop the worker thread, after it finishes any queued requests."""
+        if self._worker is None:
+            return
+        self._stop.set()
+        self._worker.join()
+        self._worker = None
+
+    def __enter__(self):
+        """Start the worker thread."""
+        self.start()
+        return self
+
+    def __exit__(self, *args):
+        """Stop the worker thread."""
+        self.stop()
+
+    def submit(self, X):
+        r"""Submit a prediction request.
+
+        Parameters
+        ----------
+        X : ndarray
+            the query rows, of shape (N, ...).
+
+        Returns
+        -------
+        future : concurrent.futures.Future
+            a future that will hold the predictions for ``X``.
+
+        """
+        future = Future()
+        self._requests.put((np.asarray(X), future, time.perf_counter()))
+        return future
+
+    async def predict(self, X):
+        r"""Make a prediction, for use within an asyncio event loop.
+
+        Parameters
+        ----------
+        X : ndarray
+            the query rows, of shape (N, ...).
+
+        Returns
+        -------
+        pred : ndarray
+            the predictions for ``X``.
+
+        """
+        pred = await asyncio.wrap_future(self.submit(X))
+        return pred
+
+    def reset_stats(self):
+        """Reset the request latency and throughput statistics."""
+        with self._lock:
+            self._latencies = []
+            self._batch_sizes = []
+            self._start_time = time.perf_counter()
+
+    def stats(self):
+        r"""Get request latency and throughput statistics.
+
+        Returns
+        -------
+        stats : dict
+            with the number of requests, rows and batches, the mean batch size
+            (rows), the throughput (requests and rows per second), and the
+            50th, 90th and 99th percentile request latencies (seconds) since
+            this object was created or ``reset_stats`` was called.
+
+        """
+        with self._lock:
+            latencies = np.array(self._latencies)
+            batch_sizes = np.array(self._batch_sizes)
+            elapsed = time.perf_counter() - self._start_time
+
+        n_requests, n_rows = len(latencies), batch_sizes.sum()
+        stats = {
+            "requests": n_requests,
+            "rows": int(n_rows),
+            "batches": len(batch_sizes),
+            "mean_batch_size": float(batch_sizes.mean()) if n_requests else 0.,
+            "requests_per_sec": n_requests / elapsed,
+            "rows_per_sec": float(n_rows) / elapsed,
+        }
+        for p in (50, 90, 99):
+            latency = np.percentile(latencies, p) if n_requests else np.nan
+            stats["latency_p{}".format(p)] = float(latency)
+        return stats
+
+    def _run(self):
+        """Coalesce and evaluate requests until stopped."""
+        carry = None  # a request that did not fit in the last batch
+        while carry is not None or not (self._stop.is_set() and
+                                        self._requests.empty()):
+            if carry is not None:
+                first, carry = carry, None
+            else:
+                try:
+                    first = self._requests.get(timeout=0.05)
+                except queue.Empty:
+                    continue
+
+            batch, n_rows = [first], len(first[0])
+            deadline = time.perf_counter() + self.max_latency
+            while n_rows < self.max_batch_size:
+                remaining = deadline - time.perf_counter()
+                try:
+                    request = self._requests.get(timeout=max(remaining, 0.))
+                except queue.Empty:
+                    break
+                if n_rows + len(request[0]) > self.max_batch_size:
+                    carry = request  # leave for the next batch
+                    break
+                batch.append(request)
+                n_rows += len(request[0])
+
+            self._evaluate(batch)
+
+    def _evaluate(self, batch):
+        """Evaluate a batch of requests and fulfill their futures."""
+        # Skip requests that were cancelled (e.g. their client went away)
+        batch = [r for r in batch if r[1].set_running_or_notify_cancel()]
+        if not batch:
+            return
+
+        Xs, futures, starts = zip(*batch)
+        n_rows = sum(len(X) for X in Xs)
+        try:
+            pred = self.predict_fn(np.concatenate(Xs, axis=0))
+            splits = np.cumsum([len(X) for X in Xs])[:-1]
+            results = np.split(pred, splits, axis=0)
+        except Exception as e:
+            for f in futures:
+                f.set_exception(e)
+            return
+
+        end = time.perf_counter()
+        for f, r in zip(futures, results):
+            f.set_result(r)
+
+        with self._lock:
+            self._latencies.extend(end - s for s in starts)
+            self._batch_sizes.append(n_rows)
+
+
+def session_predictor(predictor, X_, session, expected=True, feed_dict=None):
+    r"""Make a prediction function for a ``BatchPredictor`` from a graph.
+
+    Parameters
+    ----------
+    predictor : Tensor
+        a tensor that outputs a shape (n_samples, N, tasks), e.g. the output
+        of ``Net``.
+    X_ : Tensor
+        the placeholder (of shape (N, ...)) the query data is fed to.
+    session : Session
+        the session to be used to evaluate the predictor.
+    expected : bool
+        if True, the prediction function returns the expected value (over
+        the samples) of the predictor, of shape (N, tasks). Otherwise it
+        returns the samples with the query axis first, (N, n_samples, tasks).
+    feed_dict : dict, optional
+        any extra data to feed to the graph with each prediction.
+
+    Returns
+    -------
+    predict_fn : callable
+        a function, ``predict_fn(X)``, that evaluates ``predictor`` with one
+        call to ``session.run``.
+
+    """
+    feed_dict = {} if feed_dict is None else feed_dict
+    if expected:
+        output = tf.reduce_mean(predictor, axis=0)
+    else:
+        rank = len(predictor.shape)
+        output = tf.transpose(predictor, [1, 0] + list(range(2, rank)))
+
+    def predict_fn(X):
+        fd = dict(feed_dict)
+        fd[X_] = X
+        return session.run(output, feed_dict=fd)
+
+    return predict_fn
@@ -1,4 +1,6 @@
 """Package helper utilities."""
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+
 import tensorflow as tf
 import numpy as np
 
@@ -194,6 +196,140 @@ def predict_expected(predictor, feed_dict=None, n_groups=1, session=None):
     return pred
 
 
+def predict_moments(predictor, feed_dict=None, n_groups=1, n_threads=1,
+                    session=None):
+    r"""Help to get the mean and variance of the samples from a predictor.
+
+    The ``n_groups`` evaluations of the ``predictor`` are run concurrently in
+    a pool of ``n_threads`` threads, which share the session (``session.run``
+    releases the GIL, so these run in parallel). The samples of each group are
+    merged into a running mean and variance as soon as they are ready, so at
+    most ``n_threads`` groups of samples are held in memory at once, no matter
+    how many samples in total are drawn.
+
+    Parameters
+    ----------
+    predictor : Tensor
+        a tensor that outputs a shape (n_samples, N, tasks) where
+        ``n_samples`` are the random samples from the predictor (e.g. the
+        output of ``Net``), ``N`` is the size of the query dataset, and
+        ``tasks`` the number of prediction tasks.
+    feed_dict : dict, optional
+        The data with ``{tf.placeholder: data}`` entries.
+    n_groups : int
+        The number of times to evaluate the ``predictor``.
+    n_threads : int
+        The number of evaluations of the ``predictor`` to run at once.
+    session : Session
+        the session to be used to evaluate the predictor.
+
+    Returns
+    -------
+    mean : ndarray
+        the mean of the prediction samples with shape (N, tasks).
+    variance : ndarray
+        the variance of the prediction samples with shape (N, tasks).
+        ``n_samples * n_groups`` samples go into evaluating these.
+
+    Note
+    ----
+    This has to be called in an *active* tensorflow session, or be given one!
+
+    """
+    assert n_groups >= 1, "Need at least one group of samples!"
+    assert n_threads >= 1, "Need at least one thread!"
+
+    # The default session is thread local, so get it in this thread
+    session = tf.get_default_session() if session is None else session
+
+    def group_moments():
+        pred = session.run(predictor, feed_dict=feed_dict)
+        mean = pred.mean(axis=0, dtype=np.float64)
+        return len(pred), mean, ((pred - mean)**2).sum(axis=0)
+
+    moments = (0, 0., 0.)
+    with ThreadPoolExecutor(max_workers=n_threads) as pool:
+        n_running = min(n_threads, n_groups)
+        running = {pool.submit(group_moments) for _ in range(n_running)}
+        n_submitted = n_running
+        while running:
+            done, running = wait(running, return_when=FIRST_COMPLETED)
+            for future in done:
+                moments = _merge_moments(moments, future.result())
+                if n_submitted < n_groups:
+                    running.add(pool.submit(group_moments))
+                    n_submitted += 1
+
+    # The moments are accumulated in float64, return the predictor's dtype
+    count, mean, sumsq = moments
+    dtype = predictor.dtype.as_numpy_dtype
+    return mean.astype(dtype), (sumsq / count).astype(dtype)
+
+
+def pack_mask(mask):
+    r"""Bit-pack a boolean missing data mask for feeding to a graph.
+
+    This packs each row of the mask into bytes, so it takes an eighth of the
+    memory (and feed bandwidth) of a boolean mask. The impute layers (see
+    :ref:`impute`) accept these packed masks, and unpack them in the graph.
+
+    Parameters
+    ----------
+    mask : ndarray
+        a boolean mask of shape (N, D).
+
+    Returns
+    -------
+    packed : ndarray
+        a uint8 array of shape (N, ceil(D / 8)).
+
+    Examples
+    --------
+    >>> mask = np.array([[True, False, False, False, False, False, False,
+    ...                   False, True]])
+    >>> pack_mask(mask)
+    array([[128, 128]], dtype=uint8)
+
+    """
+    packed = np.packbits(np.asarray(mask, dtype=bool), axis=1)
+    return packed
+
+
+def unpack_mask(packed, D):
+    r"""Unpack a bit-packed mask (from ``pack_mask``) in a graph.
+
+    Parameters
+    ----------
+    packed : Tensor
+        a uint8 Tensor of shape (N, ceil(D / 8)).
+    D : int, Tensor
+        the number of columns of the original mask.
+
+    Returns
+    -------
+    mask : Tensor
+        a boolean Tensor of shape (N, D).
+
+    """
+    packed = tf.expand_dims(tf.to_int32(packed), 2)
+    shifts = tf.constant([2**(7 - i) for i in range(8)], dtype=tf.int32)
+    bits = tf.floormod(tf.floordiv(packed, shifts), 2)  # N x B x 8
+    bits = tf.reshape(bits, (tf.shape(bits)[0], -1))[:, :D]
+    mask = tf.cast(bits, tf.bool)
+    return mask
+
+
+def _merge_moments(a, b):
+    """Merge the count, mean and sum of squared deviations of two groups."""
+    count_a, mean_a, sumsq_a = a
+    count_b, mean_b, sumsq_b = b
+    count = count_a + count_b
+    delta = mean_b - mean_a
+    mean = mean_a + delta * count_b / count
+    sumsq = sumsq_a + sumsq_b + delta**2 * count_a * count_b / count
+    return count, mean, sumsq
+
+
 def __data_len(feed_dict):
     N = feed_dict[list(feed_dict.keys())[0]].shape[0]
     return N
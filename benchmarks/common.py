@@ -0,0 +1,72 @@
+"""Shared utilities for the benchmark scripts."""
+import argparse
+import datetime
+import itertools
+import json
+import platform
+import sys
+
+import numpy as np
+import tensorflow as tf
+
+import aboleth as ab
+
+
+def argument_parser(description):
+    """Make an argument parser with the options common to all benchmarks."""
+    parser = argparse.ArgumentParser(description=description)
+    parser.add_argument("--nets", nargs="+", default=None,
+                        help="the nets to benchmark, default all.")
+    parser.add_argument("--grid", action="store_true",
+                        help="benchmark the full grid of configurations, "
+                        "rather than sweeping one setting at a time.")
+    parser.add_argument("--repeats", type=int, default=3,
+                        help="number of repeats, the fastest is reported.")
+    parser.add_argument("--output", default=None,
+                        help="JSON file to write the results to, default "
+                        "stdout.")
+    return parser
+
+
+def configurations(base, sweeps, grid=False):
+    """Get the configurations to benchmark.
+
+    By default each setting in ``sweeps`` is swept on its own, with the others
+    fixed to their ``base`` values. Otherwise every combination is used.
+    """
+    if grid:
+        keys = sorted(sweeps)
+        return [dict(zip(keys, values)) for values in
+                itertools.product(*(sweeps[k] for k in keys))]
+
+    configs = [dict(base)]
+    for key, values in sorted(sweeps.items()):
+        configs += [dict(base, **{key: v}) for v in values
+                    if v != base[key]]
+    return configs
+
+
+def environment():
+    """Get the versions of the software and hardware used for a benchmark."""
+    env = {
+        "aboleth": ab.__version__,
+        "tensorflow": tf.__version__,
+        "numpy": np.__version__,
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "processor": platform.processor(),
+        "date": datetime.datetime.utcnow().isoformat(),
+    }
+    return env
+
+
+def write_results(benchmark, results, path=None):
+    """Write benchmark results, and the environment, as JSON."""
+    report = {"benchmark": benchmark, "environment": environment(),
+              "results": results}
+    if path is None:
+        json.dump(report, sys.stdout, indent=2)
+        sys.stdout.write("\n")
+    else:
+        with open(path, "w") as f:
+            json.dump(report, f, indent=2)
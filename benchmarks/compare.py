@@ -0,0 +1,62 @@
+#! /usr/bin/env python3
+"""Compare two result files from the same benchmark, e.g. across releases.
+
+The results are matched on their configuration (the net and its settings,
+see ``CONFIG_KEYS``), and the relative change of every measurement is printed.
+Changes larger than the threshold are flagged.
+"""
+import argparse
+import json
+
+
+CONFIG_KEYS = ("net", "n_samples", "width", "depth", "batch_size", "threads",
+               "n_towers", "n_workers")
+
+
+def main():
+    """Run the comparison."""
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("baseline", help="the baseline results JSON file.")
+    parser.add_argument("candidate", help="the new results JSON file.")
+    parser.add_argument("--threshold", type=float, default=0.1,
+                        help="relative change to flag, default 0.1 (10%%).")
+    args = parser.parse_args()
+
+    baseline, candidate = load(args.baseline), load(args.candidate)
+    n_flagged = 0
+    for key in sorted(set(baseline) & set(candidate), key=str):
+        old, new = baseline[key], candidate[key]
+        for measure in sorted(set(old) & set(new)):
+            if old[measure] == 0:
+                continue
+            change = (new[measure] - old[measure]) / abs(old[measure])
+            flag = "  <--" if abs(change) > args.threshold else ""
+            n_flagged += bool(flag)
+            print("{} {}: {:.4g} -> {:.4g} ({:+.1%}){}".format(
+                format_key(key), measure, old[measure], new[measure], change,
+                flag))
+    print("{} measurements changed by more than {:.0%}".format(
+        n_flagged, args.threshold))
+
+
+def load(path):
+    """Load results, keyed on their configuration."""
+    with open(path) as f:
+        results = json.load(f)["results"]
+    keyed = {}
+    for r in results:
+        key = tuple((k, tuple(r[k]) if isinstance(r[k], list) else r[k])
+                    for k in CONFIG_KEYS if k in r)
+        keyed[key] = {k: v for k, v in r.items() if k not in CONFIG_KEYS and
+                      isinstance(v, (int, float)) and
+                      not isinstance(v, bool)}
+    return keyed
+
+
+def format_key(key):
+    """Format a configuration key for printing."""
+    return ", ".join("{}={}".format(k, v) for k, v in key)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,77 @@
+#! /usr/bin/env python3
+"""Benchmark graph construction time and graph size of representative nets.
+
+For each net and (n_samples, width, depth) configuration this records, in a
+fresh graph,
+
+- the time to build the net and its loss,
+- the time to build the gradients and the training op,
+- the number of ops in the final graph,
+- the size of the serialized GraphDef.
+"""
+import sys
+import time
+
+import tensorflow as tf
+
+import aboleth as ab
+from common import argument_parser, configurations, write_results
+from nets import NETS
+
+
+RSEED = 666
+
+BASE_CONFIG = {"n_samples": 5, "width": 100, "depth": 1}
+SWEEPS = {
+    "n_samples": [1, 5, 10, 20, 50],
+    "width": [10, 100, 500, 1000],
+    "depth": [1, 2, 4],
+}
+
+
+def main():
+    """Run the benchmark."""
+    args = argument_parser(__doc__.splitlines()[0]).parse_args()
+    nets = sorted(NETS) if args.nets is None else args.nets
+
+    results = []
+    for name in nets:
+        for config in configurations(BASE_CONFIG, SWEEPS, args.grid):
+            runs = [build_graph(NETS[name], **config)
+                    for _ in range(args.repeats)]
+            result = dict(net=name, **config)
+            result.update(min(runs, key=lambda r: r["build_seconds"]))
+            results.append(result)
+            print("{net}: n_samples={n_samples}, width={width}, "
+                  "depth={depth}: {build_seconds:.3f} s, {n_ops} ops"
+                  .format(**result), file=sys.stderr)
+
+    write_results("graph_build", results, args.output)
+
+
+def build_graph(net_fn, n_samples, width, depth):
+    """Build a net in a new graph, and measure the time and graph size."""
+    graph = tf.Graph()
+    with graph.as_default():
+        ab.set_hyperseed(RSEED)
+
+        start = time.perf_counter()
+        model = net_fn(n_samples, width, depth)
+        net_time = time.perf_counter() - start
+
+        start = time.perf_counter()
+        tf.train.AdamOptimizer().minimize(model.loss)
+        grad_time = time.perf_counter() - start
+
+    graph_def = graph.as_graph_def()
+    stats = {
+        "build_seconds": net_time,
+        "gradient_seconds": grad_time,
+        "n_ops": len(graph.get_operations()),
+        "graph_def_bytes": graph_def.ByteSize(),
+    }
+    return stats
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,134 @@
+"""Representative nets, modelled on the demos, for benchmarking.
+
+Each net factory takes the number of samples, the width (hidden units or
+random features) and the depth (number of hidden blocks) of the net, builds
+the net and its loss in the current graph, and returns a ``Model``.
+"""
+from collections import namedtuple
+
+import numpy as np
+import tensorflow as tf
+
+import aboleth as ab
+from aboleth.likelihoods import Normal, Bernoulli
+
+
+N_TRAIN = 10000  # Nominal size of the training data for the ELBO
+N_CATEGORIES = [9, 16, 7, 15, 6, 5, 2, 42]  # Categories of the census data
+SARCOS_DIM = 21  # Input dimension of the SARCOS data
+
+# loss: the training objective, pred: the net output (n_samples, N, 1),
+# make_batch: a function (random_state, batch_size) -> feed_dict
+Model = namedtuple("Model", ["loss", "pred", "make_batch"])
+
+
+def regression(n_samples, width, depth):
+    """A (deep) GP approximation on 1D data, like demos/regression.py."""
+    X_ = tf.placeholder(tf.float32, [None, 1])
+    Y_ = tf.placeholder(tf.float32, [None, 1])
+    net = ab.stack(ab.InputLayer(name="X", n_samples=n_samples),
+                   *_gp_layers(width, depth, ab.RBFVariational))
+    Phi, kl = net(X=X_)
+    lkhood = Normal(variance=ab.pos(tf.Variable(1.)))
+    loss = ab.elbo(Phi, Y_, N_TRAIN, kl, lkhood)
+
+    def make_batch(random_state, batch_size):
+        X = random_state.rand(batch_size, 1) * 10 - 5
+        Y = np.sin(X) + 0.1 * random_state.randn(batch_size, 1)
+        return {X_: X.astype(np.float32), Y_: Y.astype(np.float32)}
+
+    return Model(loss, Phi, make_batch)
+
+
+def classification(n_samples, width, depth):
+    """A MAP net with dropout, like demos/classification.py."""
+    n_features = 20
+    X_ = tf.placeholder(tf.float32, [None, n_features])
+    Y_ = tf.placeholder(tf.float32, [None, 1])
+    layers = [ab.InputLayer(name="X", n_samples=n_samples), ab.DropOut(0.95)]
+    for _ in range(depth):
+        layers += [ab.DenseMAP(output_dim=width, l2_reg=.1),
+                   ab.Activation(h=tf.nn.relu),
+                   ab.DropOut(0.5)]
+    layers += [ab.DenseMAP(output_dim=1, l2_reg=.1),
+               ab.Activation(h=tf.nn.sigmoid)]
+    net = ab.stack(*layers)
+    Phi, reg = net(X=X_)
+    loss = ab.max_posterior(Phi, Y_, reg, Bernoulli(),
+                            first_axis_is_obs=False)
+
+    def make_batch(random_state, batch_size):
+        X = random_state.randn(batch_size, n_features)
+        Y = X[:, :1] > 0
+        return {X_: X.astype(np.float32), Y_: Y.astype(np.float32)}
+
+    return Model(loss, Phi, make_batch)
+
+
+def multi_input(n_samples, width, depth):
+    """Continuous and categorical inputs, like demos/multi_input.py."""
+    n_con = 5
+    Xc_ = tf.placeholder(tf.float32, [None, n_con])
+    Xk_ = tf.placeholder(tf.int32, [None, len(N_CATEGORIES)])
+    Y_ = tf.placeholder(tf.float32, [None, 1])
+    con_layer = (ab.InputLayer(name="con", n_samples=n_samples) >>
+                 ab.DenseVariational(output_dim=5, full=True))
+    cat_layer = (ab.InputLayer(name="cat", n_samples=n_samples) >>
+                 ab.MultiEmbedVariational(5, N_CATEGORIES))
+    layers = [ab.Concat(con_layer, cat_layer)]
+    for i in range(depth):
+        last = i == depth - 1
+        layers += [ab.RandomArcCosine(width, 1.),
+                   ab.DenseVariational(output_dim=1 if last else width,
+                                       full=last)]
+    net = ab.stack(*layers, ab.Activation(tf.sigmoid))
+    Phi, kl = net(con=Xc_, cat=Xk_)
+    loss = ab.elbo(Phi, Y_, N_TRAIN, kl, Bernoulli())
+
+    def make_batch(random_state, batch_size):
+        Xc = random_state.randn(batch_size, n_con)
+        Xk = np.stack([random_state.randint(k, size=batch_size)
+                       for k in N_CATEGORIES], axis=1)
+        Y = Xc[:, :1] > 0
+        return {Xc_: Xc.astype(np.float32), Xk_: Xk.astype(np.int32),
+                Y_: Y.astype(np.float32)}
+
+    return Model(loss, Phi, make_batch)
+
+
+def sarcos(n_samples, width, depth):
+    """A GP approximation with a learned length scale, like demos/sarcos.py."""
+    X_ = tf.placeholder(tf.float32, [None, SARCOS_DIM])
+    Y_ = tf.placeholder(tf.float32, [None, 1])
+    net = ab.stack(ab.InputLayer(name="X", n_samples=n_samples),
+                   *_gp_layers(width, depth,
+                               lambda: ab.RBF(ab.pos(tf.Variable(10.)))))
+    Phi, kl = net(X=X_)
+    lkhood = Normal(variance=ab.pos(tf.Variable(1.)))
+    loss = ab.elbo(Phi, Y_, N_TRAIN, kl, lkhood)
+
+    def make_batch(random_state, batch_size):
+        X = random_state.randn(batch_size, SARCOS_DIM)
+        Y = np.sin(X).sum(axis=1, keepdims=True)
+        return {X_: X.astype(np.float32), Y_: Y.astype(np.float32)}
+
+    return Model(loss, Phi, make_batch)
+
+
+NETS = {
+    "regression": regression,
+    "classification": classification,
+    "multi_input": multi_input,
+    "sarcos": sarcos,
+}
+
+
+def _gp_layers(width, depth, kernel):
+    """Random feature and dense layers, the last has one output."""
+    layers = []
+    for i in range(depth):
+        last = i == depth - 1
+        layers += [ab.RandomFourier(n_features=width, kernel=kernel()),
+                   ab.DenseVariational(output_dim=1 if last else width,
+                                       full=last)]
+    return layers
@@ -0,0 +1,136 @@
+#! /usr/bin/env python3
+"""Benchmark the scaling of data-parallel training over CPU towers.
+
+Each net is trained with Adam on synthetic data, with each minibatch split
+over a number of towers (see ``aboleth.parallel``), and the cores of the host
+divided between them. This records the steps and examples per second, and the
+speedup and scaling efficiency (speedup per tower) relative to one tower with
+the same batch size.
+"""
+import multiprocessing
+import sys
+import time
+
+import numpy as np
+import tensorflow as tf
+
+import aboleth as ab
+from aboleth.likelihoods import Normal
+from aboleth.parallel import tower_elbo, tower_config
+from common import argument_parser, configurations, write_results
+
+
+RSEED = 666
+N_TRAIN = 100000  # Nominal size of the training data for the ELBO
+N_BATCHES = 10  # Number of distinct synthetic batches to cycle through
+D = 20
+
+BASE_CONFIG = {"n_towers": 1, "batch_size": 2048}
+SWEEPS = {
+    "n_towers": [1, 2, 4, 8],
+    "batch_size": [256, 2048],
+}
+
+
+def rff_dense(n_samples):
+    """Random Fourier features and a variational linear layer."""
+    return (ab.InputLayer(name="X", n_samples=n_samples) >>
+            ab.RandomFourier(n_features=200, kernel=ab.RBF()) >>
+            ab.DenseVariational(output_dim=1))
+
+
+def mlp(n_samples):
+    """A variational multi-layer perceptron."""
+    return (ab.InputLayer(name="X", n_samples=n_samples) >>
+            ab.DenseVariational(output_dim=100) >>
+            ab.Activation(tf.nn.relu) >>
+            ab.DenseVariational(output_dim=100) >>
+            ab.Activation(tf.nn.relu) >>
+            ab.DenseVariational(output_dim=1))
+
+
+NETS = {
+    "rff_dense": rff_dense,
+    "mlp": mlp,
+}
+
+
+def main():
+    """Run the benchmark."""
+    parser = argument_parser(__doc__.splitlines()[0])
+    parser.add_argument("--samples", type=int, default=5,
+                        help="number of samples of the nets.")
+    parser.add_argument("--steps", type=int, default=100,
+                        help="number of timed training steps.")
+    parser.add_argument("--warmup", type=int, default=10,
+                        help="number of untimed training steps first.")
+    args = parser.parse_args()
+
+    nets = sorted(NETS) if args.nets is None else args.nets
+    results = []
+    for name in nets:
+        for config in configurations(BASE_CONFIG, SWEEPS, args.grid):
+            runs = [train(name, args.samples, steps=args.steps,
+                          warmup=args.warmup, **config)
+                    for _ in range(args.repeats)]
+            result = dict(config, net=name, n_samples=args.samples)
+            result.update(max(runs, key=lambda r: r["steps_per_sec"]))
+            results.append(result)
+            print("{net}: n_towers={n_towers}, batch_size={batch_size}: "
+                  "{steps_per_sec:.1f} steps/s".format(**result),
+                  file=sys.stderr)
+
+    add_speedup(results)
+    write_results("towers", results, args.output)
+
+
+def train(net, n_samples, n_towers, batch_size, steps, warmup):
+    """Train a net over towers for a number of steps, and time it."""
+    with tf.Graph().as_default():
+        ab.set_hyperseed(RSEED)
+        tf.set_random_seed(RSEED)
+        random_state = np.random.RandomState(RSEED)
+
+        X_ = tf.placeholder(tf.float32, [None, D])
+        Y_ = tf.placeholder(tf.float32, [None, 1])
+        loss = tower_elbo(NETS[net](n_samples), Y_, N_TRAIN,
+                          Normal(variance=1.), n_towers, X=X_)
+        train_op = tf.train.AdamOptimizer().minimize(
+            loss, colocate_gradients_with_ops=True)
+
+        batches = []
+        for _ in range(N_BATCHES):
+            X = random_state.randn(batch_size, D).astype(np.float32)
+            batches.append({X_: X, Y_: np.sin(X[:, :1])})
+
+        config = tower_config(n_towers, multiprocessing.cpu_count(),
+                              device_count={"GPU": 0})
+        with tf.Session(config=config) as sess:
+            sess.run(tf.global_variables_initializer())
+            for i in range(warmup):
+                sess.run(train_op, feed_dict=batches[i % N_BATCHES])
+
+            start = time.perf_counter()
+            for i in range(steps):
+                sess.run(train_op, feed_dict=batches[i % N_BATCHES])
+            elapsed = time.perf_counter() - start
+
+    result = {
+        "steps_per_sec": steps / elapsed,
+        "examples_per_sec": steps * batch_size / elapsed,
+    }
+    return result
+
+
+def add_speedup(results):
+    """Add the speedup and efficiency relative to one tower to the results."""
+    baseline = {(r["net"], r["batch_size"]): r["steps_per_sec"]
+                for r in results if r["n_towers"] == 1}
+    for r in results:
+        speedup = r["steps_per_sec"] / baseline[(r["net"], r["batch_size"])]
+        r["speedup"] = speedup
+        r["efficiency"] = speedup / r["n_towers"]
+
+
+if __name__ == "__main__":
+    main()
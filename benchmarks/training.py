@@ -0,0 +1,229 @@
+#! /usr/bin/env python3
+"""Benchmark training throughput and memory of layer and likelihood stacks.
+
+Each stack is trained with Adam on synthetic data shaped like our workloads,
+for each n_samples, batch size and (intra, inter) op thread count
+configuration. This records the steps and examples per second, and the peak
+resident set size (RSS) of the process. Every configuration is run in its own
+process, so the peak RSS measurements are independent, and all of the random
+seeds are fixed, so the results are comparable between commits.
+"""
+import argparse
+import json
+import resource
+import subprocess
+import sys
+import time
+
+import numpy as np
+import tensorflow as tf
+
+import aboleth as ab
+from aboleth.likelihoods import Normal, Bernoulli
+from common import argument_parser, configurations, write_results
+from nets import Model
+
+
+RSEED = 666
+N_TRAIN = 100000  # Nominal size of the training data for the ELBO
+N_BATCHES = 10  # Number of distinct synthetic batches to cycle through
+
+BASE_CONFIG = {"n_samples": 5, "batch_size": 256, "threads": [0, 0]}
+SWEEPS = {
+    "n_samples": [1, 5, 20, 50],
+    "batch_size": [32, 256, 2048],
+    "threads": [[1, 1], [0, 0]],  # 0 lets TensorFlow choose
+}
+
+
+def rff_dense(n_samples, full=False):
+    """Random Fourier features and a variational linear layer."""
+    D = 20
+    X_ = tf.placeholder(tf.float32, [None, D])
+    Y_ = tf.placeholder(tf.float32, [None, 1])
+    net = (ab.InputLayer(name="X", n_samples=n_samples) >>
+           ab.RandomFourier(n_features=100, kernel=ab.RBF()) >>
+           ab.DenseVariational(output_dim=1, full=full))
+    Phi, kl = net(X=X_)
+    loss = ab.elbo(Phi, Y_, N_TRAIN, kl, Normal(variance=1.))
+
+    def make_batch(random_state, batch_size):
+        X = random_state.randn(batch_size, D).astype(np.float32)
+        return {X_: X, Y_: np.sin(X[:, :1])}
+
+    return Model(loss, Phi, make_batch)
+
+
+def dense_map(n_samples):
+    """A MAP multi-layer perceptron."""
+    D = 20
+    X_ = tf.placeholder(tf.float32, [None, D])
+    Y_ = tf.placeholder(tf.float32, [None, 1])
+    net = (ab.InputLayer(name="X", n_samples=n_samples) >>
+           ab.DenseMAP(output_dim=100, l2_reg=.1) >>
+           ab.Activation(tf.nn.relu) >>
+           ab.DenseMAP(output_dim=1, l2_reg=.1))
+    Phi, reg = net(X=X_)
+    loss = ab.max_posterior(Phi, Y_, reg, Normal(variance=1.),
+                            first_axis_is_obs=False)
+
+    def make_batch(random_state, batch_size):
+        X = random_state.randn(batch_size, D).astype(np.float32)
+        return {X_: X, Y_: np.sin(X[:, :1])}
+
+    return Model(loss, Phi, make_batch)
+
+
+def embed(n_samples):
+    """A variational embedding of a categorical input, for classification."""
+    K = 10000
+    X_ = tf.placeholder(tf.int32, [None, 1])
+    Y_ = tf.placeholder(tf.float32, [None, 1])
+    net = (ab.InputLayer(name="X", n_samples=n_samples) >>
+           ab.EmbedVariational(output_dim=20, n_categories=K) >>
+           ab.DenseVariational(output_dim=1) >>
+           ab.Activation(tf.sigmoid))
+    Phi, kl = net(X=X_)
+    loss = ab.elbo(Phi, Y_, N_TRAIN, kl, Bernoulli())
+
+    def make_batch(random_state, batch_size):
+        X = random_state.zipf(1.5, size=(batch_size, 1)) % K
+        return {X_: X.astype(np.int32),
+                Y_: (X % 2).astype(np.float32)}
+
+    return Model(loss, Phi, make_batch)
+
+
+def impute(n_samples, impute_op):
+    """Imputation of missing data, followed by a variational linear layer."""
+    D = 20
+    X_ = tf.placeholder(tf.float32, [None, D])
+    M_ = tf.placeholder(tf.bool, [None, D])
+    Y_ = tf.placeholder(tf.float32, [None, 1])
+    net = (impute_op(ab.InputLayer(name="X", n_samples=n_samples),
+                     ab.InputLayer(name="M")) >>
+           ab.DenseVariational(output_dim=1))
+    Phi, kl = net(X=X_, M=M_)
+    loss = ab.elbo(Phi, Y_, N_TRAIN, kl, Normal(variance=1.))
+
+    def make_batch(random_state, batch_size):
+        X = random_state.randn(batch_size, D).astype(np.float32)
+        M = random_state.rand(batch_size, D) < 0.1
+        return {X_: np.where(M, 0., X), M_: M, Y_: X.sum(axis=1)[:, None]}
+
+    return Model(loss, Phi, make_batch)
+
+
+def max_pool(n_samples):
+    """Max pooling of image data, followed by a variational linear layer."""
+    shape = (28, 28, 1)
+    X_ = tf.placeholder(tf.float32, (None,) + shape)
+    Y_ = tf.placeholder(tf.float32, [None, 1])
+    X = tf.tile(tf.expand_dims(X_, 0), [n_samples, 1, 1, 1, 1])
+    net = (ab.MaxPool2D(pool_size=(2, 2), strides=(2, 2)) >>
+           ab.Reshape(target_shape=(14 * 14,)) >>
+           ab.DenseVariational(output_dim=1) >>
+           ab.Activation(tf.sigmoid))
+    Phi, kl = net(X)
+    loss = ab.elbo(Phi, Y_, N_TRAIN, kl, Bernoulli())
+
+    def make_batch(random_state, batch_size):
+        X = random_state.rand(batch_size, *shape).astype(np.float32)
+        return {X_: X, Y_: (X.mean(axis=(1, 2)) > 0.5).astype(np.float32)}
+
+    return Model(loss, Phi, make_batch)
+
+
+STACKS = {
+    "rff_dense_diag": lambda s: rff_dense(s, full=False),
+    "rff_dense_full": lambda s: rff_dense(s, full=True),
+    "dense_map": dense_map,
+    "embed": embed,
+    "mean_impute": lambda s: impute(s, ab.MeanImpute),
+    "learned_normal_impute": lambda s: impute(s, ab.LearnedNormalImpute),
+    "max_pool": max_pool,
+}
+
+
+def main():
+    """Run the benchmark, or a single configuration of it."""
+    parser = argument_parser(__doc__.splitlines()[0])
+    parser.add_argument("--steps", type=int, default=200,
+                        help="number of timed training steps.")
+    parser.add_argument("--warmup", type=int, default=20,
+                        help="number of untimed training steps first.")
+    parser.add_argument("--run", default=None, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.run is not None:
+        result = train(steps=args.steps, warmup=args.warmup,
+                       **json.loads(args.run))
+        print(json.dumps(result))
+        return
+
+    stacks = sorted(STACKS) if args.nets is None else args.nets
+    results = []
+    for name in stacks:
+        for config in configurations(BASE_CONFIG, SWEEPS, args.grid):
+            runs = [run_isolated(dict(config, net=name), args)
+                    for _ in range(args.repeats)]
+            result = dict(config, net=name)
+            result.update(max(runs, key=lambda r: r["steps_per_sec"]))
+            results.append(result)
+            print("{net}: n_samples={n_samples}, batch_size={batch_size}, "
+                  "threads={threads}: {steps_per_sec:.1f} steps/s, "
+                  "{peak_rss_mb:.0f} MB".format(**result), file=sys.stderr)
+
+    write_results("training", results, args.output)
+
+
+def run_isolated(config, args):
+    """Run one configuration in a new process, and get its results."""
+    command = [sys.executable, __file__, "--run", json.dumps(config),
+               "--steps", str(args.steps), "--warmup", str(args.warmup)]
+    output = subprocess.run(command, stdout=subprocess.PIPE, check=True)
+    result = json.loads(output.stdout.decode().strip().splitlines()[-1])
+    return result
+
+
+def train(net, n_samples, batch_size, threads, steps, warmup):
+    """Train a stack for a number of steps, and measure its throughput."""
+    ab.set_hyperseed(RSEED)
+    tf.set_random_seed(RSEED)
+    random_state = np.random.RandomState(RSEED)
+
+    model = STACKS[net](n_samples)
+    train_op = tf.train.AdamOptimizer().minimize(model.loss)
+    batches = [model.make_batch(random_state, batch_size)
+               for _ in range(N_BATCHES)]
+
+    config = tf.ConfigProto(device_count={"GPU": 0},
+                            intra_op_parallelism_threads=threads[0],
+                            inter_op_parallelism_threads=threads[1])
+    with tf.Session(config=config) as sess:
+        sess.run(tf.global_variables_initializer())
+        for i in range(warmup):
+            sess.run(train_op, feed_dict=batches[i % N_BATCHES])
+
+        start = time.perf_counter()
+        for i in range(steps):
+            sess.run(train_op, feed_dict=batches[i % N_BATCHES])
+        elapsed = time.perf_counter() - start
+
+    result = {
+        "steps_per_sec": steps / elapsed,
+        "examples_per_sec": steps * batch_size / elapsed,
+        "peak_rss_mb": peak_rss_mb(),
+    }
+    return result
+
+
+def peak_rss_mb():
+    """Get the peak resident set size of this process in MB."""
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # This is in bytes on macOS, and kilobytes on Linux
+    return rss / 2**20 if sys.platform == "darwin" else rss / 2**10
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,161 @@
+#! /usr/bin/env python3
+"""Distributed training of an Aboleth model over local processes.
+
+This starts a parameter server and a number of worker processes on this host.
+Each worker draws minibatches from its own disjoint shard of the data, and the
+gradients of the workers are averaged (synchronous) or applied as they come
+(asynchronous, with --async) to the variables on the parameter server. On a
+real cluster, each task would instead be started on its own host with the
+same cluster specification.
+"""
+import argparse
+import json
+import logging
+import subprocess
+import sys
+
+import numpy as np
+import tensorflow as tf
+
+import aboleth as ab
+from aboleth.likelihoods import Normal
+from aboleth.distributed import (local_cluster, worker_device,
+                                 replica_optimizer, shard_batch)
+
+# Set up a python logger so we can see the output of MonitoredTrainingSession
+logger = logging.getLogger()
+logger.setLevel(logging.INFO)
+
+RSEED = 666
+ab.set_hyperseed(RSEED)
+
+# Data settings
+N = 10000  # Number of training points, shared between the workers
+Ns = 1000  # Number of testing points
+D = 5  # Input dimension
+true_noise = 0.1
+
+# Model settings
+n_samples = 5
+n_steps = 2000  # Number of global training steps
+batch_size = 50  # Minibatch size of each worker
+config = tf.ConfigProto(device_count={'GPU': 0})  # Use GPU? 0 is no
+
+net = (
+    ab.InputLayer(name="X", n_samples=n_samples) >>
+    ab.RandomFourier(n_features=100, kernel=ab.RBF(lenscale=1.)) >>
+    ab.DenseVariational(output_dim=1, full=True)
+)
+
+
+def main():
+    """Run the demo."""
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--workers", type=int, default=2,
+                        help="number of worker processes.")
+    parser.add_argument("--async", dest="sync", action="store_false",
+                        help="use asynchronous, rather than synchronous, "
+                        "updates.")
+    parser.add_argument("--cluster", default=None, help=argparse.SUPPRESS)
+    parser.add_argument("--job", default=None, help=argparse.SUPPRESS)
+    parser.add_argument("--task", type=int, default=0,
+                        help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.cluster is None:
+        launch(args.workers, args.sync)
+        return
+
+    cluster = tf.train.ClusterSpec(json.loads(args.cluster))
+    server = tf.train.Server(cluster, job_name=args.job,
+                             task_index=args.task, config=config)
+    if args.job == "ps":
+        server.join()  # Serve the variables until this process is killed
+    else:
+        worker(server, cluster, args.task, args.sync)
+
+
+def launch(n_workers, sync):
+    """Start the parameter server and workers on this host."""
+    cluster = local_cluster(n_workers)
+    spec = json.dumps(cluster.as_dict())
+    command = [sys.executable, __file__, "--cluster", spec]
+    if not sync:
+        command.append("--async")
+
+    ps = subprocess.Popen(command + ["--job", "ps", "--task", "0"])
+    workers = [subprocess.Popen(command + ["--job", "worker", "--task",
+                                           str(t)])
+               for t in range(n_workers)]
+    try:
+        for w in workers:
+            w.wait()
+    finally:
+        ps.kill()
+
+
+def worker(server, cluster, task, sync):
+    """Train the model on a worker's shard of the data."""
+    n_workers = cluster.num_tasks("worker")
+    is_chief = task == 0
+
+    # Every worker makes the same data, but only uses its shard of it
+    Xr, Yr, Xs, Ys = make_data()
+
+    with tf.device(worker_device(cluster, task)):
+        X_ = tf.placeholder(tf.float32, [None, D])
+        Y_ = tf.placeholder(tf.float32, [None, 1])
+        N_ = tf.placeholder(tf.float32)  # This is N, not the shard size!
+
+        lkhood = Normal(variance=ab.pos(tf.Variable(1.)))
+        Phi, kl = net(X=X_)
+        loss = ab.elbo(Phi, Y_, N_, kl, lkhood)
+
+        optimizer = replica_optimizer(tf.train.AdamOptimizer(), n_workers,
+                                      sync=sync)
+        global_step = tf.train.create_global_step()
+        train = optimizer.minimize(loss, global_step=global_step)
+
+    hooks = [tf.train.StopAtStepHook(last_step=n_steps)]
+    if sync:
+        hooks.append(optimizer.make_session_run_hook(is_chief))
+    if is_chief:
+        hooks.append(tf.train.LoggingTensorHook(
+            {'step': global_step, 'loss': loss}, every_n_iter=200))
+
+    batches = shard_batch({X_: Xr, Y_: Yr}, batch_size, task, n_workers,
+                          n_iter=np.inf, N_=N_)
+    with tf.train.MonitoredTrainingSession(
+            master=server.target,
+            is_chief=is_chief,
+            config=config,
+            hooks=hooks,
+            save_summaries_steps=None,
+            save_checkpoint_secs=None
+    ) as sess:
+        for fd in batches:
+            if sess.should_stop():
+                break
+            sess.run(train, feed_dict=fd)
+
+    # The variables live on the parameter server, so the chief can still
+    # evaluate the trained model
+    if is_chief:
+        with tf.Session(server.target, config=config) as sess:
+            Ey = ab.predict_samples(Phi, feed_dict={X_: Xs}, n_groups=10,
+                                    session=sess)
+        rmse = np.sqrt(np.mean((Ey.mean(axis=0) - Ys)**2))
+        print("Test RMSE: {:.4f}".format(rmse))
+
+
+def make_data():
+    """Make the same synthetic regression data in every process."""
+    random_state = np.random.RandomState(RSEED)
+    X = random_state.randn(N + Ns, D).astype(np.float32)
+    Y = (np.sin(X).sum(axis=1, keepdims=True) +
+         true_noise * random_state.randn(N + Ns, 1)).astype(np.float32)
+    return X[:N], Y[:N], X[N:], Y[N:]
+
+
+if __name__ == "__main__":
+    main()
@@ -1,6 +1,7 @@
 #! /usr/bin/env python3
 """This script demonstrates Aboleth's imputation layers."""
 import logging
+import time
 
 import tensorflow as tf
 import numpy as np
@@ -17,6 +18,7 @@ logger.setLevel(logging.INFO)
 
 # Make missing data?
 USE_ABOLETH = True  # Use Aboleth to learn an imputation?
+PACK_MASK = True  # Bit-pack the missing data mask to save feed bandwidth?
 
 RSEED = 666
 ab.set_hyperseed(RSEED)
@@ -71,6 +73,11 @@ def main():
         imp = Imputer(missing_values=MISSING_VAL, strategy='mean')
         X = imp.fit_transform(X)
 
+    # Compare the cost of feeding the mask, and optionally pack it
+    time_mask_feed(mask)
+    if PACK_MASK:
+        mask = ab.pack_mask(mask)
+
     # Split the training and testing data
     X_tr, X_ts, Y_tr, Y_ts, M_tr, M_ts = train_test_split(
         X.astype(np.float32),
@@ -87,7 +94,7 @@ def main():
                                     batch_size=BSIZE)
         X_ = tf.placeholder_with_default(Xb, shape=(None, D))
         Y_ = tf.placeholder_with_default(Yb, shape=(None, NCLASSES))
-        M_ = tf.placeholder_with_default(Mb, shape=(None, D))
+        M_ = tf.placeholder_with_default(Mb, shape=(None, M_tr.shape[1]))
 
     with tf.name_scope("Likelihood"):
         lkhood = ab.likelihoods.Categorical()  # Multiclass
@@ -143,6 +150,28 @@ def main():
           format(acc, ll, conf))
 
 
+def time_mask_feed(mask, batch_size=1000, n_iter=100):
+    """Time feeding a boolean and a bit-packed mask to an impute layer."""
+    N, D = mask.shape
+    X = np.zeros((batch_size, D), dtype=np.float32)
+    for packed in (False, True):
+        M = ab.pack_mask(mask) if packed else mask
+        with tf.Graph().as_default(), tf.Session(config=CONFIG) as sess:
+            X_ = tf.placeholder(tf.float32, shape=(None, D))
+            M_ = tf.placeholder(M.dtype, shape=(None, M.shape[1]))
+            Net, _ = ab.MeanImpute(ab.InputLayer(name='X', n_samples=1),
+                                   ab.InputLayer(name='M'))(X=X_, M=M_)
+            start = time.perf_counter()
+            for i in range(n_iter):
+                ind = np.arange(i * batch_size, (i + 1) * batch_size) % N
+                sess.run(Net, feed_dict={X_: X, M_: M[ind]})
+            elapsed = (time.perf_counter() - start) / n_iter
+
+        print("{} mask: {} bytes per batch, {:.3f} ms per step".format(
+            "Packed" if packed else "Boolean", M[:batch_size].nbytes,
+            1000 * elapsed))
+
+
 def batch_training(X, Y, M, batch_size, n_epochs):
     """Batch training queue convenience function."""
     X = tf.train.limit_epochs(X, n_epochs, name="X_lim")
@@ -0,0 +1,101 @@
+#! /usr/bin/env python3
+"""Compare moment propagation and Monte Carlo sampling for prediction."""
+import time
+
+import numpy as np
+import tensorflow as tf
+from sklearn.gaussian_process.kernels import RBF as kern
+
+import aboleth as ab
+from aboleth.likelihoods import Normal
+from aboleth.datasets import gp_draws
+
+
+RSEED = 666
+ab.set_hyperseed(RSEED)
+
+# Data settings
+N = 1000  # Number of training points to generate
+Ns = 400  # Number of testing points to generate
+kernel = kern(length_scale=0.5)  # Kernel to use for making a random GP draw
+true_noise = 0.1  # Add noise to the GP draws, to make things a little harder
+
+# Model settings
+n_samples = 5  # Number of random samples to get from an Aboleth net
+n_pred_samples = 20  # This will give n_samples by n_pred_samples predictions
+n_iterations = 20000  # How many mini batch views of the data for training
+batch_size = 10  # mini batch size for stochastric gradients
+n_timings = 20  # Number of times to time prediction
+config = tf.ConfigProto(device_count={'GPU': 0})  # Use GPU? 0 is no
+
+net = (
+    ab.InputLayer(name="X", n_samples=n_samples) >>
+    ab.RandomFourier(n_features=100, kernel=ab.RBFVariational()) >>
+    ab.DenseVariational(output_dim=1, full=True)
+)
+
+
+def main():
+    """Run the demo."""
+    Xr, Yr, Xs, Ys = gp_draws(N, Ns, kern=kernel, noise=true_noise)
+    _, D = Xr.shape
+
+    X_ = tf.placeholder(tf.float32, [None, D])
+    Y_ = tf.placeholder(tf.float32, [None, 1])
+
+    variance = tf.Variable(1.)
+    lkhood = Normal(variance=ab.pos(variance))
+
+    # Sampling graph for training and Monte Carlo prediction
+    Phi, kl = net(X=X_)
+    loss = ab.elbo(Phi, Y_, N, kl, lkhood)
+    train = tf.train.AdamOptimizer().minimize(loss)
+
+    # Deterministic moment propagation graph, this shares the net parameters
+    Ey, Vy = net.moments(X=X_)
+
+    with tf.Session(config=config) as sess:
+        sess.run(tf.global_variables_initializer())
+
+        batches = ab.batch({X_: Xr, Y_: Yr}, batch_size=batch_size,
+                           n_iter=n_iterations)
+        for i, data in enumerate(batches):
+            sess.run(train, feed_dict=data)
+            if i % 1000 == 0:
+                print("Iteration {}, loss = {}".format(
+                    i, sess.run(loss, feed_dict=data)))
+
+        # Monte Carlo prediction
+        samples, mc_time = timed(lambda: ab.predict_samples(
+            Phi, feed_dict={X_: Xs}, n_groups=n_pred_samples, session=sess))
+        Ey_mc, Vy_mc = samples.mean(axis=0), samples.var(axis=0)
+
+        # Moment propagation prediction
+        (Ey_mp, Vy_mp), mp_time = timed(lambda: sess.run(
+            [Ey, Vy], feed_dict={X_: Xs}))
+
+    print("Monte Carlo ({} samples): {:.2f} ms, R-square = {:.4f}".format(
+        n_samples * n_pred_samples, 1000 * mc_time, rsquare(Ys, Ey_mc)))
+    print("Moment propagation: {:.2f} ms, R-square = {:.4f}".format(
+        1000 * mp_time, rsquare(Ys, Ey_mp)))
+    print("Mean absolute difference, mean = {:.4f}, variance = {:.4f}".format(
+        np.mean(np.abs(Ey_mc - Ey_mp)), np.mean(np.abs(Vy_mc - Vy_mp))))
+
+
+def timed(func):
+    """Get the result and the median run time (in seconds) of func()."""
+    times = []
+    for _ in range(n_timings):
+        start = time.perf_counter()
+        result = func()
+        times.append(time.perf_counter() - start)
+    return result, np.median(times)
+
+
+def rsquare(Y, Ey):
+    """Coefficient of determination."""
+    return 1. - np.sum((Y - Ey)**2) / np.sum((Y - Y.mean())**2)
+
+
+if __name__ == "__main__":
+    main()
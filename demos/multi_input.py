@@ -53,12 +53,12 @@ def main():
         ab.DenseVariational(output_dim=5, full=True)
     )
 
-    # Now define the cateogrical layers, which we embed
-    # Note every embed_var call can be different, this is just "lazy"
-    cat_layer_list = [ab.EmbedVariational(EMBED_DIMS, i) for i in n_cats]
+    # Now define the cateogrical layers, which we embed. All of the columns
+    # are embedded at once with packed tables, but they could each have a
+    # different embedding layer with ab.PerFeature
     cat_layer = (
         ab.InputLayer(name='cat', n_samples=T_SAMPLES) >>
-        ab.PerFeature(*cat_layer_list)  # Assign columns to an embedding layers
+        ab.MultiEmbedVariational(EMBED_DIMS, n_cats)
     )
 
     # Now we can feed the initial continuous and cateogrical layers to further
@@ -0,0 +1,130 @@
+#! /usr/bin/env python3
+"""Serve an Aboleth model over HTTP, coalescing concurrent requests."""
+import asyncio
+import json
+import threading
+import time
+import urllib.request as req
+
+import numpy as np
+import tensorflow as tf
+
+import aboleth as ab
+from aboleth.serving import BatchPredictor, session_predictor
+
+
+RSEED = 666
+ab.set_hyperseed(RSEED)
+
+HOST, PORT = "127.0.0.1", 8080
+D = 10  # Input dimension of the model
+N_SAMPLES = 10  # Number of samples from the model per prediction
+ROWS_PER_REQUEST = 4  # Each request is only a few rows
+N_CLIENTS = 32  # Number of concurrent clients
+N_REQUESTS = 100  # Number of requests per client
+MAX_BATCH_SIZE = 512  # Maximum rows to coalesce into one session.run
+MAX_LATENCY = 0.005  # Maximum time to wait for more requests to coalesce
+
+CONFIG = tf.ConfigProto(device_count={'GPU': 0})  # Use GPU ?
+
+net = (
+    ab.InputLayer(name="X", n_samples=N_SAMPLES) >>
+    ab.RandomFourier(n_features=500, kernel=ab.RBF()) >>
+    ab.DenseVariational(output_dim=1, full=True)
+)
+
+
+def main():
+    """Run the demo."""
+    X_ = tf.placeholder(tf.float32, [None, D])
+    Phi, _ = net(X=X_)
+
+    with tf.Session(config=CONFIG) as sess:
+        sess.run(tf.global_variables_initializer())
+        predict_fn = session_predictor(Phi, X_, sess)
+
+        # One request at a time
+        with BatchPredictor(predict_fn, max_batch_size=ROWS_PER_REQUEST,
+                            max_latency=0.) as predictor:
+            run_http_load(predictor)
+            print("No coalescing:\n{}".format(format_stats(predictor)))
+
+        # Coalesced requests
+        with BatchPredictor(predict_fn, max_batch_size=MAX_BATCH_SIZE,
+                            max_latency=MAX_LATENCY) as predictor:
+            run_http_load(predictor)
+            print("Coalescing:\n{}".format(format_stats(predictor)))
+
+
+def run_http_load(predictor):
+    """Run an HTTP stand-in server and hit it with concurrent clients."""
+    loop = asyncio.new_event_loop()
+    server = loop.run_until_complete(asyncio.start_server(
+        lambda r, w: handle(predictor, r, w), HOST, PORT, loop=loop))
+    server_thread = threading.Thread(target=loop.run_forever, daemon=True)
+    server_thread.start()
+
+    predictor.reset_stats()
+    clients = [threading.Thread(target=client) for _ in range(N_CLIENTS)]
+    for c in clients:
+        c.start()
+    for c in clients:
+        c.join()
+
+    server.close()
+    loop.call_soon_threadsafe(loop.stop)
+    server_thread.join()
+    loop.close()
+
+
+async def handle(predictor, reader, writer):
+    """Handle a (minimal) HTTP POST request with a JSON body."""
+    headers = {}
+    await reader.readline()  # request line
+    while True:
+        line = (await reader.readline()).decode().strip()
+        if not line:
+            break
+        key, value = line.split(":", 1)
+        headers[key.lower()] = value.strip()
+    body = await reader.readexactly(int(headers["content-length"]))
+
+    X = np.array(json.loads(body.decode())["X"], dtype=np.float32)
+    Ey = await predictor.predict(X)
+
+    response = json.dumps({"Ey": Ey.tolist()}).encode()
+    writer.write("HTTP/1.1 200 OK\r\nContent-Type: application/json\r\n"
+                 "Content-Length: {}\r\nConnection: close\r\n\r\n"
+                 .format(len(response)).encode() + response)
+    await writer.drain()
+    writer.close()
+
+
+def client():
+    """Make a series of prediction requests."""
+    rand = np.random.RandomState()
+    url = "http://{}:{}/predict".format(HOST, PORT)
+    for _ in range(N_REQUESTS):
+        X = rand.randn(ROWS_PER_REQUEST, D)
+        data = json.dumps({"X": X.tolist()}).encode()
+        request = req.Request(url, data=data,
+                              headers={"Content-Type": "application/json"})
+        with req.urlopen(request) as response:
+            json.loads(response.read().decode())
+
+
+def format_stats(predictor):
+    """Format the statistics of a predictor."""
+    stats = predictor.stats()
+    return ("\trequests/sec = {requests_per_sec:.1f}\n"
+            "\tmean batch size = {mean_batch_size:.1f} rows\n"
+            "\tlatency (ms): p50 = {p50:.2f}, p90 = {p90:.2f}, p99 = {p99:.2f}"
+            .format(p50=1000 * stats["latency_p50"],
+                    p90=1000 * stats["latency_p90"],
+                    p99=1000 * stats["latency_p99"], **stats))
+
+
+if __name__ == "__main__":
+    start = time.time()
+    main()
+    print("Total time = {:.1f} s".format(time.time() - start))
@@ -0,0 +1,72 @@
+"""Test the static net analysis module."""
+import pytest
+import numpy as np
+import tensorflow as tf
+
+import aboleth as ab
+from aboleth.analysis import estimate, format_estimate
+from aboleth.baselayers import Layer
+
+
+D, N, S = 4, 20, 3
+
+
+@pytest.mark.parametrize('make_net', [
+    lambda: (ab.InputLayer(name='X', n_samples=S) >>
+             ab.RandomFourier(10, ab.RBFVariational()) >>
+             ab.DenseVariational(output_dim=2, full=True)),
+    lambda: (ab.InputLayer(name='X', n_samples=S) >>
+             ab.DenseMAP(output_dim=5) >>
+             ab.Activation(tf.nn.relu) >>
+             ab.DropOut(0.5) >>
+             ab.GroupedDenseVariational(output_dim=2, n_groups=5)),
+    lambda: ab.Concat(
+        ab.InputLayer(name='X', n_samples=S) >>
+        ab.RandomArcCosine(10) >>
+        ab.DenseVariational(output_dim=3),
+        ab.InputLayer(name='K', n_samples=S) >>
+        ab.MultiEmbedVariational(output_dim=2, n_categories=[3, 4])),
+    lambda: (ab.LearnedNormalImpute(ab.InputLayer(name='X', n_samples=S),
+                                    ab.InputLayer(name='M')) >>
+             ab.DenseVariational(output_dim=1)),
+    lambda: (ab.RunningNormalImpute(ab.InputLayer(name='X', n_samples=S),
+                                    ab.InputLayer(name='M')) >>
+             ab.DenseVariational(output_dim=1)),
+])
+def test_estimate_matches_graph(make_net):
+    """Test the parameter counts and output shapes against a built net."""
+    x = np.ones((N, D), dtype=np.float32)
+    k = np.zeros((N, 2), dtype=np.int32)
+    m = np.zeros((N, D), dtype=bool)
+    inputs = {'X': x, 'K': k, 'M': m}
+
+    net = make_net()
+    report = estimate(net, {n: v.shape[1:] for n, v in inputs.items()},
+                      batch_size=N)
+    with tf.Graph().as_default():
+        F, _ = net(**inputs)
+        n_params = sum(int(np.prod(v.shape))
+                       for v in tf.trainable_variables())
+
+    assert report["params"] == n_params
+    assert report["layers"][-1]["output_shape"] == tuple(F.shape.as_list())
+    assert report["peak_bytes"] > report["activation_bytes"] > 0
+    assert report["backward_flops"] >= report["forward_flops"] > 0
+    assert isinstance(format_estimate(report), str)
+
+
+def test_estimate_scaling():
+    """Test activation memory grows with the samples, params do not."""
+    layers = (ab.RandomFourier(10, ab.RBF()) >>
+              ab.DenseVariational(output_dim=2))
+    small = estimate(layers, (D,), batch_size=N, n_samples=1)
+    large = estimate(layers, (D,), batch_size=N, n_samples=10)
+    assert small["params"] == large["params"]
+    assert large["activation_bytes"] > 5 * small["activation_bytes"]
+    assert large["forward_flops"] > 5 * small["forward_flops"]
+    assert [l["scope"] for l in large["layers"]] == \
+        ["RandomFourier", "DenseVariational"]
+
+    with pytest.raises(ValueError):
+        estimate(ab.InputLayer(name='X', n_samples=S) >> Layer(),
+                 {'X': (D,)}, batch_size=N)
@@ -64,3 +64,16 @@ def test_stack_multilayer():
         phi, loss = r(x="x", y="y")
         assert phi == "h(g(f(x,y)))"
         assert loss.eval() == 60.0
+
+
+def test_posterior_mean_mode():
+    """Test the posterior mean build mode context manager."""
+    assert not ab.baselayers.buildmode.posterior_mean
+    with ab.posterior_mean():
+        assert ab.baselayers.buildmode.posterior_mean
+    assert not ab.baselayers.buildmode.posterior_mean
+
+    ab.set_posterior_mean(True)
+    assert ab.baselayers.buildmode.posterior_mean
+    ab.set_posterior_mean(False)
+    assert not ab.baselayers.buildmode.posterior_mean
@@ -0,0 +1,98 @@
+"""Test the distributed training module."""
+import pytest
+import numpy as np
+import tensorflow as tf
+
+import aboleth as ab
+from aboleth.distributed import (local_cluster, worker_device,
+                                 replica_optimizer, shard_data, shard_batch)
+
+
+def test_shard_data():
+    """Test the worker shards are disjoint and cover the data."""
+    X = np.arange(100)
+    fd = {'X': X, 'Y': X * 2}
+    shards = [shard_data(fd, t, n_workers=3) for t in range(3)]
+    accum = np.concatenate([s['X'] for s in shards])
+    assert len(accum) == len(X)
+    assert set(accum) == set(X)
+    assert all(np.all(s['Y'] == s['X'] * 2) for s in shards)
+
+
+def test_shard_batch():
+    """Test batches come from the shard, with the size of the whole data."""
+    X = np.arange(100)
+    N_ = tf.placeholder(tf.int32)
+    data = shard_batch({'X': X}, batch_size=10, task_index=1, n_workers=4,
+                       n_iter=5, N_=N_)
+    for d in data:
+        assert len(d['X']) == 10
+        assert np.all(d['X'] % 4 == 1)
+        assert d[N_] == len(X)
+
+
+def test_worker_graph():
+    """Test a worker's variables are on the parameter servers."""
+    cluster = local_cluster(n_workers=2, n_ps=2)
+    addresses = cluster.job_tasks("ps") + cluster.job_tasks("worker")
+    assert len(set(addresses)) == 4
+
+    x = np.ones((10, 3), dtype=np.float32)
+    y = np.ones((10, 1), dtype=np.float32)
+    with tf.Graph().as_default():
+        with tf.device(worker_device(cluster, task_index=1)):
+            net = (ab.InputLayer(name='X', n_samples=3) >>
+                   ab.DenseVariational(output_dim=1))
+            Net, KL = net(X=x)
+            loss = ab.elbo(Net, y, 100, KL, ab.likelihoods.Normal(1.))
+            optimizer = replica_optimizer(tf.train.AdamOptimizer(), 2)
+            global_step = tf.train.create_global_step()
+            optimizer.minimize(loss, global_step=global_step)
+
+        assert isinstance(optimizer, tf.train.SyncReplicasOptimizer)
+        assert all(v.device.startswith("/job:ps")
+                   for v in tf.global_variables())
+        assert Net.device.startswith("/job:worker/task:1")
+
+
+@pytest.mark.parametrize('sync', [True, False])
+def test_local_training(sync):
+    """Test training steps on a local parameter server and worker."""
+    cluster = local_cluster(n_workers=1)
+    # Both tasks run in this process, the servers must be kept alive
+    servers = [tf.train.Server(cluster, job_name=job, task_index=0)
+               for job in ("ps", "worker")]
+    server = servers[1]
+
+    X = np.random.RandomState(1).randn(100, 3).astype(np.float32)
+    Y = X.sum(axis=1, keepdims=True)
+    with tf.Graph().as_default():
+        with tf.device(worker_device(cluster, task_index=0)):
+            X_ = tf.placeholder(tf.float32, [None, 3])
+            Y_ = tf.placeholder(tf.float32, [None, 1])
+            N_ = tf.placeholder(tf.float32)
+            net = (ab.InputLayer(name='X', n_samples=3) >>
+                   ab.DenseVariational(output_dim=1))
+            Net, KL = net(X=X_)
+            loss = ab.elbo(Net, Y_, N_, KL, ab.likelihoods.Normal(1.))
+            optimizer = replica_optimizer(tf.train.AdamOptimizer(), 1,
+                                          sync=sync)
+            global_step = tf.train.create_global_step()
+            train = optimizer.minimize(loss, global_step=global_step)
+
+        hooks = [tf.train.StopAtStepHook(last_step=5)]
+        if sync:
+            hooks.append(optimizer.make_session_run_hook(is_chief=True))
+        batches = shard_batch({X_: X, Y_: Y}, batch_size=10, task_index=0,
+                              n_workers=1, N_=N_)
+        with tf.train.MonitoredTrainingSession(master=server.target,
+                                               is_chief=True,
+                                               hooks=hooks) as sess:
+            for fd in batches:
+                if sess.should_stop():
+                    break
+                sess.run(train, feed_dict=fd)
+
+        # The variables are still on the parameter server after training
+        with tf.Session(server.target) as sess:
+            assert sess.run(global_step) == 5
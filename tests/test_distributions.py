@@ -5,7 +5,8 @@ import tensorflow as tf
 from scipy.linalg import cho_solve
 from scipy.stats import wishart
 
-from aboleth.distributions import (Normal, Gaussian, kl_qp, _chollogdet)
+from aboleth.distributions import (Normal, Gaussian, norm_posterior, kl_qp,
+                                   _chollogdet)
 from .conftest import SEED
 
 
@@ -114,6 +115,28 @@ def test_kl_qp():
         kl_qp(p, qg)
 
 
+def test_normal_gather(random):
+    """Test gathering rows of Normal distributions."""
+    dim = (10, 5)
+    ind = np.array([7, 2, 2], dtype=np.int32)
+    mu = random.randn(*dim).astype(np.float32)
+    var = random.rand(*dim).astype(np.float32) + 0.1
+
+    qs = [Normal(mu, var), Normal(mu, 1.), norm_posterior(dim, 1.)]
+    rows = [q.gather(ind) for q in qs]
+
+    tc = tf.test.TestCase()
+    with tc.test_session():
+        tf.global_variables_initializer().run()
+        for q, r in zip(qs, rows):
+            qmu, qvar = tf.get_default_session().run(
+                [tf.convert_to_tensor(q.mu), tf.ones(dim) * q.var])
+            rmu, rvar = tf.get_default_session().run(
+                [r.mu, tf.ones(ind.shape + dim[1:]) * r.var])
+            assert np.allclose(rmu, qmu[ind])
+            assert np.allclose(rvar, qvar[ind])
+
+
 def test_chollogdet():
     """Test log det with cholesky matrices."""
     Dim = (5, 10, 10)
@@ -0,0 +1,83 @@
+"""Test exporting nets to the NumPy runtime."""
+import pytest
+import numpy as np
+import tensorflow as tf
+
+import aboleth as ab
+
+
+@pytest.mark.parametrize('layers', [
+    lambda: (ab.RandomFourier(10, ab.RBF()) >>
+             ab.DenseVariational(output_dim=3, full=True) >>
+             ab.Activation(tf.nn.softmax)),
+    lambda: (ab.RandomArcCosine(10, variational=True) >>
+             ab.DenseVariational(output_dim=3) >>
+             ab.DropOut(0.9) >>
+             ab.DenseMAP(output_dim=2) >>
+             ab.Activation(tf.nn.relu)),
+    lambda: (ab.GroupedDenseVariational(output_dim=3, n_groups=2) >>
+             ab.Activation(tf.nn.relu) >>
+             ab.GroupedDenseVariational(output_dim=1, n_groups=2)),
+])
+def test_export_predictions(layers, make_data, tmpdir):
+    """Test the runtime reproduces the posterior mean and sample shapes."""
+    x, _, _ = make_data
+    x = x.astype(np.float32)
+    S = 5
+    net = ab.InputLayer(name='X', n_samples=S) >> layers()
+    F, _ = net(X=x)
+    with ab.posterior_mean():
+        Fm, _ = net(X=x)
+
+    path = str(tmpdir.join("net.npz"))
+    tc = tf.test.TestCase()
+    with tc.test_session():
+        tf.global_variables_initializer().run()
+        f, fm = F.eval(), Fm.eval()
+        ab.export_net(net, path)
+
+    model = ab.runtime.load(path)
+    assert np.allclose(model.predict_mean(x), fm[0], atol=1e-5)
+    samples = model.predict_samples(x, random_state=1)
+    assert samples.shape == f.shape
+    assert model.predict_expected(x, n_samples=10).shape == f.shape[1:]
+
+
+@pytest.mark.parametrize('multi', [False, True])
+def test_export_embeddings(multi, make_categories, tmpdir):
+    """Test exporting an embedding layer."""
+    x, K = make_categories
+    if multi:
+        x = np.hstack((x, (x + 1) % K))
+        embed = ab.MultiEmbedVariational(output_dim=2, n_categories=[K, K])
+    else:
+        embed = ab.EmbedVariational(output_dim=2, n_categories=K)
+    net = ab.InputLayer(name='X', n_samples=3) >> embed
+    net(X=x)
+    with ab.posterior_mean():
+        Fm, _ = net(X=x)
+
+    path = str(tmpdir.join("net.npz"))
+    tc = tf.test.TestCase()
+    with tc.test_session():
+        tf.global_variables_initializer().run()
+        fm = Fm.eval()
+        ab.export_net(net, path)
+
+    model = ab.runtime.load(path)
+    assert np.allclose(model.predict_mean(x), fm[0])
+    assert model.predict_samples(x).shape == (3, len(x), 2 * x.shape[1])
+
+
+def test_export_unbuilt(tmpdir):
+    """Test exporting an unbuilt or unsupported net raises an error."""
+    path = str(tmpdir.join("net.npz"))
+    net = ab.InputLayer(name='X') >> ab.DenseVariational(output_dim=2)
+    with pytest.raises(ValueError):
+        ab.export_net(net, path, session=tf.Session())
+    net = ab.InputLayer(name='X') >> ab.MaxPool2D((2, 2), (2, 2))
+    with pytest.raises(ValueError):
+        ab.export_net(net, path, session=tf.Session())
+    net = ab.InputLayer(name='X') >> ab.HashedEmbedVariational(2, 10)
+    with pytest.raises(ValueError):
+        ab.export_net(net, path, session=tf.Session())
@@ -25,6 +25,24 @@ def test_concat(make_data):
         assert KL.eval() == 0.0
 
 
+def test_concat_sum_moments(make_data):
+    """Test moment propagation through the concatenation and sum layers."""
+    x, _, _ = make_data
+
+    f = ab.InputLayer('X', n_samples=3)
+    g = ab.InputLayer('Y', n_samples=3)
+
+    Mc, Vc = ab.Concat(f, g).moments(X=x, Y=x)
+    Ms, Vs = ab.Sum(f, g).moments(X=x, Y=x)
+
+    tc = tf.test.TestCase()
+    with tc.test_session():
+        assert np.all(Mc.eval() == np.hstack((x, x)))
+        assert np.all(Vc.eval() == 0.)
+        assert np.all(Ms.eval() == 2 * x)
+        assert np.all(Vs.eval() == 0.)
+
+
 def test_perfeature(make_data):
     """Test per-feature application of layers."""
     x, _, X = make_data
@@ -69,3 +87,27 @@ def test_sum(make_data):
         assert forked.shape == orig.shape
         assert np.all(forked == 2 * orig)
         assert KL.eval() == 0.0
+
+
+def test_concat_shared_builds(make_data):
+    """Test shared inputs and layers are only built once in each branch."""
+    x, _, _ = make_data
+    x = x.astype(np.float32)
+
+    inputs = ab.InputLayer('X', n_samples=3)
+    dense = ab.DenseVariational(output_dim=2)
+    branch1 = inputs >> dense
+    branch2 = ab.InputLayer('X', n_samples=3) >> dense >> ab.Activation()
+
+    with tf.Graph().as_default():
+        F, KL = ab.Concat(branch1, branch2)(X=x)
+        _, KL_dense = dense(inputs(X=x)[0])
+        n_tiles = len([op for op in tf.get_default_graph().get_operations()
+                       if op.type == "Tile"])
+        assert n_tiles == 2  # one for the concat, one for the dense layer
+
+        with tf.Session():
+            tf.global_variables_initializer().run()
+            f, kl, kl_dense = tf.get_default_session().run([F, KL, KL_dense])
+            assert np.allclose(f[..., :2], f[..., 2:])
+            assert np.allclose(kl, kl_dense)
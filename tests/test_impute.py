@@ -58,6 +58,39 @@ def test_fixed_gaussian_impute(make_missing_data):
         assert KL.eval() == 0.0
 
 
+def test_fixed_gaussian_impute_columns(make_missing_data):
+    """Test each column is imputed with draws from its own Normal."""
+    x, m, _, _ = make_missing_data
+    S, D = 500, x.shape[1]
+    mu = np.arange(D, dtype=np.float32)
+    std = np.linspace(0.5, 2., D).astype(np.float32)
+
+    def data_layer(**kwargs):
+        X = tf.constant(kwargs['X'], dtype=tf.float32)
+        return tf.tile(tf.expand_dims(X, 0), [S, 1, 1]), 0.0
+
+    def mask_layer(**kwargs):
+        return kwargs['M'], 0.0
+
+    impute = ab.FixedNormalImpute(data_layer, mask_layer, mu, std**2)
+    F, _ = impute(X=x, M=m)
+    with ab.posterior_mean():
+        Fm, _ = impute(X=x, M=m)
+
+    tc = tf.test.TestCase()
+    with tc.test_session():
+        f, fm = tf.get_default_session().run([F, Fm])
+        rows = m.any(axis=1)
+        assert np.allclose(fm[:, rows], mu)
+        assert np.allclose(f[:, ~m], x[~m])
+
+        # One standard Normal draw per sample and column, shared by the rows
+        z = (f[:, rows] - mu) / std
+        assert np.allclose(z, z[:, :1], atol=1e-5)
+        assert np.all(np.abs(z[:, 0].mean(axis=0)) < 0.2)
+        assert np.allclose(z[:, 0].std(axis=0), 1., atol=0.15)
+
+
 def test_leanred_scalar_impute(make_missing_data):
     """Test the impute that learns a scalar value to impute for each col."""
     ab.set_hyperseed(100)
@@ -106,3 +139,141 @@ def test_learned_normal_impute(make_missing_data):
         X_imputed = F.eval()
         assert KL.eval() == 0.0  # Might want to change this in the future
         assert(X_imputed.shape == X.shape)
+
+
+def test_impute_broadcast(make_missing_data):
+    """Test imputed values are shared in a column, but not across samples."""
+    ab.set_hyperseed(100)
+    x, m, X, _ = make_missing_data
+
+    def data_layer(**kwargs):
+        return kwargs['X'], 0.0
+
+    def mask_layer(**kwargs):
+        return kwargs['M'], 0.0
+
+    impute = ab.LearnedNormalImpute(data_layer, mask_layer)
+    F, _ = impute(X=X, M=m)
+
+    tc = tf.test.TestCase()
+    with tc.test_session():
+        tf.global_variables_initializer().run()
+        X_imputed = F.eval()
+        assert np.allclose(X_imputed[:, ~m], x[~m])
+        missing = X_imputed[:, m].reshape(3, -1, x.shape[1])
+        assert np.allclose(missing, missing[:, :1, :])
+        assert not np.allclose(missing[0], missing[1])
+
+
+def test_running_impute(random):
+    """Test the running statistics match the real values of all batches."""
+    N, D = 20, 3
+    x = random.randn(2 * N, D).astype(np.float32)
+    m = random.rand(2 * N, D) < 0.3
+    x_ = tf.placeholder(tf.float32, (N, D))
+    m_ = tf.placeholder(tf.bool, (N, D))
+
+    def data_layer(**kwargs):
+        return tf.tile(tf.expand_dims(kwargs['X'], 0), [3, 1, 1]), 0.0
+
+    def mask_layer(**kwargs):
+        return kwargs['M'], 0.0
+
+    mean_impute = ab.MeanImpute(data_layer, mask_layer, running=True)
+    normal_impute = ab.RunningNormalImpute(data_layer, mask_layer)
+    F, _ = mean_impute(X=x_, M=m_)
+    G, _ = normal_impute(X=x_, M=m_)
+    assert len(tf.get_collection(tf.GraphKeys.UPDATE_OPS)) >= 2
+
+    tc = tf.test.TestCase()
+    with tc.test_session():
+        tf.global_variables_initializer().run()
+        for i in range(2):
+            fd = {x_: x[i * N:(i + 1) * N], m_: m[i * N:(i + 1) * N]}
+            tf.get_default_session().run(
+                [mean_impute.update_op, normal_impute.update_op],
+                feed_dict=fd)
+
+        mean = np.array([x[~m[:, d], d].mean() for d in range(D)])
+        var = np.array([x[~m[:, d], d].var(ddof=1) for d in range(D)])
+        assert np.allclose(mean_impute.stats.mean.eval(), mean, atol=1e-5)
+        assert np.allclose(normal_impute.stats.variance().eval(), var,
+                           atol=1e-5)
+
+        f = F.eval(feed_dict=fd)
+        cols = np.nonzero(m[N:])[1]
+        assert np.allclose(f[:, m[N:]], mean[cols], atol=1e-5)
+
+
+def test_running_impute_rebuild(random):
+    """Test building a running impute layer again does not update twice."""
+    N, D = 20, 3
+    x = random.randn(N, D).astype(np.float32)
+    m = random.rand(N, D) < 0.3
+
+    def data_layer(**kwargs):
+        return tf.tile(tf.expand_dims(kwargs['X'], 0), [3, 1, 1]), 0.0
+
+    def mask_layer(**kwargs):
+        return kwargs['M'], 0.0
+
+    with tf.Graph().as_default():
+        impute = ab.RunningNormalImpute(data_layer, mask_layer)
+        impute(X=x, M=m)
+        with ab.posterior_mean():
+            impute(X=x, M=m)
+        update_ops = tf.get_collection(tf.GraphKeys.UPDATE_OPS)
+        assert len(update_ops) == 1
+
+        with tf.Session() as sess:
+            sess.run(tf.global_variables_initializer())
+            sess.run(update_ops)
+            count, mean = sess.run([impute.stats.count, impute.stats.mean])
+
+    assert np.allclose(count, (~m).sum(axis=0))
+    assert np.allclose(mean, [x[~m[:, d], d].mean() for d in range(D)],
+                       atol=1e-5)
+
+
+def test_packed_mask_impute(make_missing_data):
+    """Test imputation with a bit-packed mask."""
+    _, m, X, _ = make_missing_data
+
+    def data_layer(**kwargs):
+        return kwargs['X'], 0.0
+
+    def mask_layer(**kwargs):
+        return kwargs['M'], 0.0
+
+    impute = ab.MeanImpute(data_layer, mask_layer)
+    F, _ = impute(X=X, M=m)
+    F_packed, _ = impute(X=X, M=ab.pack_mask(m))
+
+    tc = tf.test.TestCase()
+    with tc.test_session():
+        assert np.allclose(F.eval(), F_packed.eval())
+
+
+def test_unknown_columns_impute(make_missing_data):
+    """Test imputation of data with an unknown number of columns."""
+    x, m, _, _ = make_missing_data
+    x_ = tf.placeholder(tf.float32, (None, None))
+    m_ = tf.placeholder(tf.bool, (None, None))
+    mp_ = tf.placeholder(tf.uint8, (None, None))
+
+    def data_layer(**kwargs):
+        return tf.tile(tf.expand_dims(kwargs['X'], 0), [3, 1, 1]), 0.0
+
+    def mask_layer(**kwargs):
+        return kwargs['M'], 0.0
+
+    impute = ab.MeanImpute(data_layer, mask_layer)
+    F, _ = impute(X=x_, M=m_)
+    F_packed, _ = impute(X=x_, M=mp_)
+
+    tc = tf.test.TestCase()
+    with tc.test_session():
+        f, f_packed = tf.get_default_session().run(
+            [F, F_packed], feed_dict={x_: x, m_: m, mp_: ab.pack_mask(m)})
+        assert list(f[1, m][-5:]) == [1., 2., 3., 4., 5.]
+        assert np.allclose(f, f_packed)
@@ -5,7 +5,7 @@ import tensorflow as tf
 import aboleth as ab
 
 from aboleth.distributions import norm_prior, gaus_posterior
-from aboleth.layers import SampleLayer
+from aboleth.layers import SampleLayer, _sparse_matmul
 
 
 D = 10
@@ -287,6 +287,420 @@ def test_embeddings_distribution(dists, make_categories):
         assert KL.eval() >= 0.
 
 
+def test_grouped_dense(make_data):
+    """Test the grouped layer is the same as independent dense layers."""
+    x, _, X = make_data
+    X = tf.to_float(X)
+    layer = ab.GroupedDenseVariational(output_dim=D, n_groups=2)
+    F, KL = layer(X)
+    with ab.posterior_mean():
+        Fm, _ = layer(X)
+
+    tc = tf.test.TestCase()
+    with tc.test_session():
+        tf.global_variables_initializer().run()
+        f, fm, mu, b = tf.get_default_session().run(
+            [F, Fm, layer.qW.mu, layer.qb.mu])
+        assert f.shape == (3, len(x), 2 * D)
+        assert KL.eval() >= 0.
+        for g in range(2):
+            fg = np.dot(x[:, g:g + 1], mu[g]) + b[g]
+            assert np.allclose(fm[0, :, g * D:(g + 1) * D], fg, atol=1e-4)
+
+
+def test_sparse_embeddings():
+    """Test embeddings only use the rows in the batch, with sparse grads."""
+    K, S = 5, 3
+    x = np.tile(np.arange(K, dtype=np.int32), 4)[:, np.newaxis]
+    x_, X_ = _make_placeholders(x, S, tf.int32)
+    embed = ab.EmbedVariational(output_dim=D, n_categories=K)
+    embed(X_)
+    sparse_embed = ab.EmbedVariational(output_dim=D, n_categories=K,
+                                       post_W=embed.qW, sparse_kl=True)
+    F, KL_sparse = sparse_embed(X_)
+
+    gmu, gvar = tf.gradients(tf.reduce_sum(F) + KL_sparse,
+                             [embed.qW.mu, embed.qW._var_variable])
+    assert isinstance(gmu, tf.IndexedSlices)
+    assert isinstance(gvar, tf.IndexedSlices)
+
+    tc = tf.test.TestCase()
+    with tc.test_session():
+        tf.global_variables_initializer().run()
+        f = F.eval(feed_dict={x_: x})
+        assert f.shape == (S, len(x), D)
+        assert np.allclose(f[:, :K], f[:, K:2 * K])
+
+
+def test_sparse_embedding_kl(random):
+    """Test the sparse KL estimate is the full KL in expectation."""
+    K, N, S = 6, 8, 2
+    freq = np.array([10., 5., 2., 1., 1., 1.])
+    post_W = ab.distributions.Normal(
+        mu=tf.constant(random.randn(K, D).astype(np.float32)),
+        var=tf.constant(random.rand(K, D).astype(np.float32) + 0.1))
+    x_ = tf.placeholder(tf.int32, (N, 1))
+    X_ = tf.tile(tf.expand_dims(x_, 0), [S, 1, 1])
+    embed = ab.EmbedVariational(output_dim=D, n_categories=K, post_W=post_W,
+                                sparse_kl=True, frequencies=freq)
+    _, KL_sparse = embed(X_)
+    KL = ab.distributions.kl_qp(post_W, embed.pW)
+
+    # The probability each category is in a batch of N independent draws
+    batches = random.choice(K, size=(20000, N), p=freq / freq.sum())
+    inclusion = np.array([np.any(batches == k, axis=1).mean()
+                          for k in range(K)])
+
+    tc = tf.test.TestCase()
+    with tc.test_session():
+        tf.global_variables_initializer().run()
+        # The estimate is a sum over the categories in a batch, so weight
+        # the estimate from each category on its own by its inclusion
+        kl_k = [KL_sparse.eval(feed_dict={x_: np.full((N, 1), k)})
+                for k in range(K)]
+        expected = np.dot(inclusion, kl_k)
+        assert np.isclose(expected, KL.eval(), rtol=0.02)
+
+
+def test_multi_embeddings(make_categories):
+    """Test the packed multi-column embedding layer."""
+    x, K = make_categories
+    x = np.hstack((x, (x + 1) % K))
+    S = 3
+    x_, X_ = _make_placeholders(x, S, tf.int32)
+    embed = ab.MultiEmbedVariational(output_dim=D, n_categories=[K, K + 1])
+    F, KL = embed(X_)
+    with ab.posterior_mean():
+        Fm, _ = embed(X_)
+    M, V = embed.moments(x_, tf.zeros_like(x_))
+
+    tc = tf.test.TestCase()
+    with tc.test_session():
+        tf.global_variables_initializer().run()
+        fd = {x_: x}
+        f, fm, m, v = tf.get_default_session().run([F, Fm, M, V], fd)
+        mu = embed.qW.mu.eval()
+        assert mu.shape == (2 * K + 1, D)
+        assert f.shape == (S, len(x), 2 * D)
+        expected = np.hstack((mu[x[:, 0]], mu[K + x[:, 1]]))
+        assert fm.shape == (S, len(x), 2 * D)
+        assert np.allclose(fm, expected)
+        assert np.allclose(m, expected)
+        assert np.all(v > 0.)
+        assert np.isscalar(KL.eval())
+
+
+@pytest.mark.parametrize('ids', [
+    (np.array([[2 ** 40], [7], [2 ** 40], [-3]], dtype=np.int64), tf.int64),
+    (np.array([[b"cat"], [b"dog"], [b"cat"], [b"mouse"]]), tf.string),
+])
+def test_hashed_embeddings(ids):
+    """Test the hashed embedding layer on raw int64 and string IDs."""
+    x, xtype = ids
+    S, B, H = 3, 11, 2
+    x_, X_ = _make_placeholders(x, S, xtype)
+    embed = ab.HashedEmbedVariational(output_dim=D, n_buckets=B, n_hashes=H)
+    F, KL = embed(X_)
+    with ab.posterior_mean():
+        Fm, _ = embed(X_)
+    M, V = embed.moments(x_, tf.zeros(x.shape))
+
+    tc = tf.test.TestCase()
+    with tc.test_session():
+        tf.global_variables_initializer().run()
+        fd = {x_: x}
+        f, fm, m, v, kl = tf.get_default_session().run([F, Fm, M, V, KL], fd)
+        assert embed.qW.mu.eval().shape == (B, D)
+        assert f.shape == (S, len(x), D)
+        assert np.allclose(fm[0], m)
+        # The same IDs hash to the same buckets
+        assert np.allclose(f[:, 0], f[:, 2])
+        assert not np.allclose(f[:, 0], f[:, 1])
+        assert np.all(v > 0.)
+        assert np.isscalar(kl)
+
+
+def test_sparse_input(make_data):
+    """Test sparse inputs give the same results as dense inputs."""
+    x, _, _ = make_data
+    x = x.astype(np.float32)
+    x[np.abs(x) < 1.] = 0.
+    S = 3
+    rows, cols = np.nonzero(x)
+    x_sparse = tf.SparseTensor(np.vstack((rows, cols)).T, x[rows, cols],
+                               x.shape)
+
+    net = (ab.InputLayer(name='X', n_samples=S) >>
+           ab.RandomFourier(D, ab.RBF()) >>
+           ab.DenseVariational(output_dim=D))
+    F, KL = net(X=x_sparse)
+    with ab.posterior_mean():
+        Fm, _ = net(X=x)
+        Fms, _ = net(X=x_sparse)
+
+    tc = tf.test.TestCase()
+    with tc.test_session():
+        tf.global_variables_initializer().run()
+        f, fm, fms = tf.get_default_session().run([F, Fm, Fms])
+        assert f.shape == (S, len(x), D)
+        assert np.allclose(fm, fms, atol=1e-5)
+        assert np.isscalar(KL.eval())
+
+
+@pytest.mark.parametrize('full', [False, True])
+def test_sparse_dense_variational(make_data, full):
+    """Test DenseVariational on sparse inputs gives the dense results."""
+    x, _, _ = make_data
+    x = x.astype(np.float32)
+    x[np.abs(x) < 1.] = 0.
+    S = 3
+    rows, cols = np.nonzero(x)
+    x_sparse = tf.SparseTensor(np.vstack((rows, cols)).T, x[rows, cols],
+                               x.shape)
+
+    net = (ab.InputLayer(name='X', n_samples=S) >>
+           ab.DenseVariational(output_dim=D, full=full))
+    F, KL = net(X=x_sparse)
+    with ab.posterior_mean():
+        Fm, _ = net(X=x)
+        Fms, _ = net(X=x_sparse)
+
+    # Each weight sample is applied to the shared sparse input
+    W = np.random.RandomState(1).randn(S, x.shape[1], D).astype(np.float32)
+    XW = _sparse_matmul(x_sparse, tf.constant(W))
+
+    tc = tf.test.TestCase()
+    with tc.test_session():
+        tf.global_variables_initializer().run()
+        f, fm, fms, xw = tf.get_default_session().run([F, Fm, Fms, XW])
+        assert f.shape == (S, len(x), D)
+        assert np.allclose(fm, fms, atol=1e-5)
+        assert np.allclose(xw, np.matmul(x, W), atol=1e-4)
+        assert np.isscalar(KL.eval())
+
+    with pytest.raises(ValueError):
+        net.moments(X=x_sparse)
+
+
+def test_input_posterior_mean(make_data):
+    """Test the input layer only makes one sample in posterior mean mode."""
+    x, _, X = make_data
+    s = ab.InputLayer(name='myname', n_samples=3)
+
+    with ab.posterior_mean():
+        F, KL = s(myname=x)
+
+    tc = tf.test.TestCase()
+    with tc.test_session():
+        f = F.eval()
+        assert KL == 0.0
+        assert f.shape == (1,) + x.shape
+        assert np.array_equal(f[0], x)
+
+
+@pytest.mark.parametrize('layer', [
+    lambda: ab.DenseVariational(output_dim=D),
+    lambda: ab.DenseVariational(output_dim=D, full=True),
+    lambda: ab.GroupedDenseVariational(output_dim=D, n_groups=2),
+    lambda: ab.RandomFourier(D, ab.RBFVariational()),
+    lambda: ab.DropOut(0.5),
+])
+def test_posterior_mean(layer, make_data):
+    """Test posterior mean layers are deterministic and share parameters."""
+    x, _, _ = make_data
+    S = 3
+
+    x_, X_ = _make_placeholders(x, S)
+    lay = layer()
+    F, _ = lay(X_)
+    with ab.posterior_mean():
+        Fm, KLm = lay(X_)
+
+    tc = tf.test.TestCase()
+    with tc.test_session():
+        tf.global_variables_initializer().run()
+        fm1 = Fm.eval(feed_dict={x_: x})
+        fm2 = Fm.eval(feed_dict={x_: x})
+        assert fm1.shape == F.eval(feed_dict={x_: x}).shape
+        assert np.allclose(fm1, fm2)
+        for i in range(1, S):
+            assert np.allclose(fm1[0], fm1[i])
+        assert KLm == 0.
+
+
+def test_posterior_mean_single_copy():
+    """Test posterior mean weights are not copied for each sample."""
+    q = ab.norm_posterior(dim=(4, D), var0=1.)
+    with ab.posterior_mean():
+        W = ab.DenseVariational._sample_W(q, 10)
+    assert W.shape.as_list() == [1, 4, D]
+
+
+def test_embeddings_posterior_mean(make_categories):
+    """Test the embedding layer in posterior mean mode."""
+    x, K = make_categories
+    S = 3
+    x_, X_ = _make_placeholders(x, S, tf.int32)
+    embed = ab.EmbedVariational(output_dim=D, n_categories=K)
+    embed(X_)
+    with ab.posterior_mean():
+        output, KL = embed(X_)
+
+    tc = tf.test.TestCase()
+    with tc.test_session():
+        tf.global_variables_initializer().run()
+        Phi = output.eval(feed_dict={x_: x})
+        assert Phi.shape == (S, len(x), D)
+        assert np.allclose(Phi[0], embed.qW.mu.eval()[x[:, 0]])
+        assert KL == 0.
+
+
+def _mc_dense(layer, H, rs):
+    """Monte Carlo samples of the output of a (diagonal) dense layer."""
+    mu, var, bmu, bvar = tf.get_default_session().run(
+        [layer.qW.mu, layer.qW.var, layer.qb.mu, layer.qb.var])
+    W = mu + np.sqrt(var) * rs.randn(len(H), *mu.shape)
+    b = bmu + np.sqrt(bvar) * rs.randn(len(H), 1, *bmu.shape)
+    return np.matmul(H, W) + b
+
+
+def _mc_dense_full(layer, H, rs):
+    """Monte Carlo samples of the output of a full covariance dense layer."""
+    mu, L, bmu, bvar = tf.get_default_session().run(
+        [layer.qW.mu, layer.qW.L, layer.qb.mu, layer.qb.var])
+    e = rs.randn(len(H), *L.shape[:2])
+    W = mu + np.einsum('oij,soj->sio', L, e)
+    b = bmu + np.sqrt(bvar) * rs.randn(len(H), 1, *bmu.shape)
+    return np.matmul(H, W) + b
+
+
+def _mc_grouped(layer, H, rs):
+    """Monte Carlo samples of the output of a grouped dense layer."""
+    mu, var, bmu, bvar = tf.get_default_session().run(
+        [layer.qW.mu, layer.qW.var, layer.qb.mu, layer.qb.var])
+    G, I, O = mu.shape
+    W = mu + np.sqrt(var) * rs.randn(len(H), G, I, O)
+    b = bmu + np.sqrt(bvar) * rs.randn(len(H), G, O)
+    F = [np.matmul(H[..., g * I:(g + 1) * I], W[:, g]) + b[:, g:g + 1]
+         for g in range(G)]
+    return np.concatenate(F, axis=-1)
+
+
+def _mc_fourier(layer, H, rs):
+    """Monte Carlo samples of the output of a random Fourier layer."""
+    XP = np.matmul(H, tf.convert_to_tensor(layer.weights[0]).eval())
+    return np.concatenate([np.cos(XP), np.sin(XP)], axis=-1) \
+        / np.sqrt(layer.n_features)
+
+
+def _mc_arccos(layer, H, rs):
+    """Monte Carlo samples of the output of a random arc-cosine layer."""
+    XP = np.matmul(H, tf.convert_to_tensor(layer.weights[0]).eval())
+    XP = np.sign(XP) if layer.p == 0 else XP
+    return np.sqrt(2. / layer.n_features) * np.maximum(XP, 0.)
+
+
+@pytest.mark.parametrize('layer, mc', [
+    (lambda: ab.DenseVariational(output_dim=D), _mc_dense),
+    (lambda: ab.DenseVariational(output_dim=D, full=True), _mc_dense_full),
+    (lambda: ab.GroupedDenseVariational(output_dim=D, n_groups=2),
+     _mc_grouped),
+    (lambda: ab.DropOut(0.7),
+     lambda l, H, rs: H * (rs.rand(*H.shape) < 0.7) / 0.7),
+    (lambda: ab.RandomFourier(D, ab.RBF()), _mc_fourier),
+    (lambda: ab.RandomArcCosine(D, p=0), _mc_arccos),
+    (lambda: ab.RandomArcCosine(D, p=1), _mc_arccos),
+    (lambda: ab.Activation(tf.nn.relu), lambda l, H, rs: np.maximum(H, 0.)),
+    (lambda: ab.Activation(tf.sigmoid), lambda l, H, rs: 1 / (1 + np.exp(-H))),
+])
+def test_moments(layer, mc, make_data):
+    """Test the propagated moments against NumPy Monte Carlo estimates."""
+    x, _, _ = make_data
+    x = (x[::5] / np.abs(x).max(axis=0)).astype(np.float32)
+    S, n_mc = 5, 20000
+
+    # A dense layer makes the (Gaussian) inputs of the tested layer
+    dense, last = ab.DenseVariational(output_dim=D), layer()
+    net = ab.InputLayer(name='X', n_samples=S) >> dense >> last
+    F, _ = net(X=x)
+    M, V = net.moments(X=x)
+
+    tc = tf.test.TestCase()
+    with tc.test_session():
+        tf.global_variables_initializer().run()
+        f, m, v = tf.get_default_session().run([F, M, V])
+        assert m.shape == f.shape[1:]
+        assert v.shape == f.shape[1:]
+
+        rs = np.random.RandomState(42)
+        H = _mc_dense(dense, np.tile(x, (n_mc, 1, 1)), rs)
+        h = mc(last, H, rs)
+        mc_m, mc_v = h.mean(axis=0), h.var(axis=0)
+        mc_v_se = np.sqrt((((h - mc_m)**4).mean(axis=0) - mc_v**2) / n_mc)
+        assert np.all(np.abs(mc_m - m) <= 5 * np.sqrt(mc_v / n_mc) + 1e-5)
+        assert np.all(np.abs(mc_v - v) <= 5 * mc_v_se + 1e-5)
+
+
+@pytest.mark.parametrize('full', [False, True])
+def test_sample_columns(full, make_data):
+    """Test sampling a subset of the weight columns of a dense layer."""
+    x, _, X = make_data
+    X = tf.to_float(X)
+    ind = np.array([4, 0, 2])
+    layer = ab.DenseVariational(output_dim=D, full=full)
+
+    with pytest.raises(ValueError):
+        layer.sample_columns(ind, 3)
+
+    layer(X)
+    W, b = layer.sample_columns(ind, 3)
+    with ab.posterior_mean():
+        Wm, bm = layer.sample_columns(ind, 3)
+
+    tc = tf.test.TestCase()
+    with tc.test_session():
+        tf.global_variables_initializer().run()
+        w, wm, bm = tf.get_default_session().run([W, Wm, bm])
+        assert w.shape == (3, x.shape[1], len(ind))
+        assert b.shape.as_list() == [3, len(ind)]
+        assert np.allclose(wm[0], layer.qW.mu.eval()[:, ind])
+        assert np.allclose(bm[1], layer.qb.mu.eval()[ind])
+
+
+def test_grouped_sample_columns(make_data):
+    """Test sampling a subset of the weight columns of a grouped layer."""
+    x, _, X = make_data
+    X = tf.to_float(X)
+    ind = np.array([13, 0, 7])
+    layer = ab.GroupedDenseVariational(output_dim=D, n_groups=2)
+    layer(X)
+    W, b = layer.sample_columns(ind, 3)
+    with ab.posterior_mean():
+        Fm, _ = layer(X)
+        Wm, bm = layer.sample_columns(ind, 3)
+
+    tc = tf.test.TestCase()
+    with tc.test_session():
+        tf.global_variables_initializer().run()
+        w, fm, wm, bm = tf.get_default_session().run([W, Fm, Wm, bm])
+        assert w.shape == (3, x.shape[1], len(ind))
+        assert b.shape.as_list() == [3, len(ind)]
+        # Only the inputs of the group of each column have weights
+        assert np.all(w[:, 1, 1:] == 0.) and np.all(w[:, 0, 0] == 0.)
+        assert np.allclose(fm[0][:, ind], np.dot(x, wm[0]) + bm[0],
+                           atol=1e-4)
+
+
+def test_moments_not_implemented(make_image_data):
+    """Test layers without moment propagation raise an exception."""
+    x, _, _ = make_image_data
+    V = np.zeros_like(x)
+    with pytest.raises(NotImplementedError):
+        ab.MaxPool2D(pool_size=(2, 2), strides=(2, 2)).moments(x, V)
+    with pytest.raises(NotImplementedError):
+        ab.Activation(tf.tanh).moments(x, V)
+
+
 def _make_placeholders(x, S, xtype=tf.float32):
     x_ = tf.placeholder(xtype, x.shape)
     X_ = tf.tile(tf.expand_dims(x_, 0), [S, 1, 1])
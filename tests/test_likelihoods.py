@@ -3,9 +3,12 @@ import pytest
 import numpy as np
 import tensorflow as tf
 import scipy.stats as ss
-from scipy.special import expit
+from scipy.special import expit, logsumexp
 
-from aboleth.likelihoods import Normal, Bernoulli, Binomial, Categorical
+import aboleth as ab
+from aboleth.likelihoods import (Normal, Bernoulli, Binomial, Categorical,
+                                 BernoulliLogit, CategoricalLogit,
+                                 SampledCategorical)
 
 
 @pytest.mark.parametrize('likelihood', [
@@ -54,3 +57,89 @@ def test_log_likelihoods_multitask(likelihood, random):
     tc = tf.test.TestCase()
     with tc.test_session():
         assert np.allclose(logprob(x, f), alike(x, f).eval())
+
+
+def test_logit_likelihoods(random):
+
+    f = random.randn(100, 5).astype(np.float32) * 10.
+    p = np.exp(f - f.max(axis=-1, keepdims=True)).astype(float)
+    p /= p.sum(axis=-1, keepdims=True)
+    y = np.eye(5, dtype=np.float32)[[random.choice(5, p=pi) for pi in p]]
+    yb = y[:, :1]
+
+    # Stable float64 references, large logits saturate the probabilities
+    f64 = f.astype(np.float64)
+    logp = f64 - logsumexp(f64, axis=-1, keepdims=True)
+    fb = f64[:, :1]
+    logpb = yb * -np.logaddexp(0., -fb) + (1. - yb) * -np.logaddexp(0., fb)
+
+    tc = tf.test.TestCase()
+    with tc.test_session():
+        ll = CategoricalLogit()(y, f).eval()
+        assert np.allclose(np.sum(y * logp, axis=-1), ll, atol=1e-4)
+
+        llb = BernoulliLogit()(yb, f[:, :1]).eval()
+        assert np.allclose(logpb, llb, atol=1e-4)
+
+        # Large logits saturate the probabilities, but not the logit version
+        fl = np.array([[-100., 0., 100.]], dtype=np.float32)
+        yl = np.array([[1., 0., 0.]], dtype=np.float32)
+        assert np.isclose(CategoricalLogit()(yl, fl).eval(), -200.)
+
+
+def test_bernoulli_logit_elbo(random):
+
+    f = random.randn(3, 100, 1).astype(np.float32)
+    y = (random.rand(100, 1) > 0.5).astype(np.float32)
+
+    loss_logit = ab.elbo(f, y, 100, 0., BernoulliLogit())
+    loss = ab.elbo(tf.sigmoid(f), y, 100, 0., Bernoulli())
+
+    tc = tf.test.TestCase()
+    with tc.test_session():
+        assert np.allclose(loss_logit.eval(), loss.eval(), rtol=1e-3)
+
+
+@pytest.mark.parametrize('likelihood', [Categorical, CategoricalLogit])
+@pytest.mark.parametrize('shape', [(100,), (3, 100)])
+def test_sparse_categorical(likelihood, shape, random):
+
+    f = random.rand(*(shape + (5,))).astype(np.float32)
+    labels = random.randint(0, 5, size=100)
+    y = np.eye(5, dtype=np.float32)[labels]
+
+    tc = tf.test.TestCase()
+    with tc.test_session():
+        ll = likelihood()(y, f).eval()
+        ll_sparse = likelihood(sparse=True)(labels[:, np.newaxis], f).eval()
+        assert ll_sparse.shape == shape
+        assert np.allclose(ll, ll_sparse)
+
+
+def test_sampled_categorical(random):
+
+    S, N, D, K = 3, 20, 4, 10
+    h = tf.constant(random.randn(S, N, D).astype(np.float32))
+    y = random.randint(0, K, size=(N, 1))
+
+    layer = ab.DenseVariational(output_dim=K)
+    layer(h)
+    ll = SampledCategorical(layer, n_sampled=5)(y, h)
+
+    # Sampling all of the classes with no correction is the full softmax
+    with ab.posterior_mean():
+        logits, _ = layer(h)
+        ll_full = CategoricalLogit(sparse=True)(y, logits)
+        lkhood = SampledCategorical(layer, n_sampled=K,
+                                    sampler=tf.nn.uniform_candidate_sampler,
+                                    subtract_log_q=False)
+        ll_all = lkhood(y, h)
+
+    tc = tf.test.TestCase()
+    with tc.test_session():
+        tf.global_variables_initializer().run()
+        ll, ll_full, ll_all = tf.get_default_session().run(
+            [ll, ll_full, ll_all])
+        assert ll.shape == (S, N)
+        assert np.all(ll <= 0.)
+        assert np.allclose(ll_full, ll_all)
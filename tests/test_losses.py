@@ -63,3 +63,27 @@ def test_sum_likelihood():
 
         sumll = call.eval()
         assert np.allclose(sumll, np.sum(np.log(0.5) * np.arange(N)))
+
+
+def test_likelihood_offset(random):
+    """Test the likelihood offsets are summed over samples, or dropped."""
+    S, N = 3, 10
+    f = random.rand(S, N, 1).astype(np.float32)
+    y = random.randint(0, 11, size=(N, 1)).astype(np.float32)
+
+    for like in (ab.likelihoods.Binomial(n=10.),
+                 ab.likelihoods.Normal(variance=2.)):
+        full = tf.reduce_sum(like(y, f))
+        offset = _sum_likelihood(y, f, like, None, n_samples=S)
+        dropped = _sum_likelihood(y, f, like, None, drop_offset=True)
+        elbo = ab.elbo(f, y, N, 0., like)
+        elbo_dropped = ab.elbo(f, y, N, 0., like, drop_offset=True)
+
+        tc = tf.test.TestCase()
+        with tc.test_session():
+            assert np.allclose(full.eval(), offset.eval())
+            assert np.allclose(dropped.eval(),
+                               tf.reduce_sum(like._loglike(y, f)).eval())
+            assert np.allclose(elbo.eval(), -full.eval() / S)
+            offset_sum = tf.reduce_sum(like._offset(y)).eval()
+            assert np.allclose(elbo_dropped.eval() - elbo.eval(), offset_sum)
@@ -0,0 +1,63 @@
+"""Test the data-parallel tower module."""
+import numpy as np
+import tensorflow as tf
+
+import aboleth as ab
+from aboleth.likelihoods import Normal
+from aboleth.parallel import tower_elbo, tower_config
+
+
+def _make_net():
+    return (ab.InputLayer(name='X', n_samples=3) >>
+            ab.DenseVariational(output_dim=5) >>
+            ab.DenseVariational(output_dim=1))
+
+
+def test_tower_elbo(make_data):
+    """Test the tower loss and its gradients are the ELBO's."""
+    x, y, _ = make_data
+    x, y = x.astype(np.float32), y.astype(np.float32)
+    like = Normal(variance=1.)
+    weights = np.arange(len(y), dtype=np.float32)[:, np.newaxis]
+    with tf.Graph().as_default():
+        net = _make_net()
+        with ab.posterior_mean():
+            loss = tower_elbo(net, y, len(y), like, n_towers=3,
+                              like_weights=weights, X=x)
+            params = tf.trainable_variables()
+            Net, KL = net(X=x)
+            elbo = ab.elbo(Net, y, len(y), KL, like, like_weights=weights)
+        assert len(tf.trainable_variables()) == len(params)
+
+        # Only the posterior means have gradients in posterior mean mode
+        pairs = [(g, e) for g, e in zip(tf.gradients(loss, params),
+                                        tf.gradients(elbo, params))
+                 if g is not None or e is not None]
+        assert pairs and all(g is not None and e is not None
+                             for g, e in pairs)
+        grads, elbo_grads = zip(*pairs)
+
+        with tf.Session(config=tower_config(3, n_cores=2)) as sess:
+            sess.run(tf.global_variables_initializer())
+            L, E = sess.run([loss, elbo])
+            assert np.allclose(L, E)
+            for g, e in zip(*sess.run([grads, elbo_grads])):
+                assert np.allclose(g, e, rtol=1e-4, atol=1e-4)
+
+
+def test_tower_elbo_samples(make_data):
+    """Test the sampled tower loss, with independent tower samples."""
+    x, y, _ = make_data
+    x, y = x.astype(np.float32), y.astype(np.float32)
+    with tf.Graph().as_default():
+        net = _make_net()
+        loss = tower_elbo(net, y, len(y), Normal(variance=1.), n_towers=4,
+                          X=x)
+        grads = tf.gradients(loss, tf.trainable_variables())
+        assert all(g is not None for g in grads)
+
+        with tf.Session(config=tower_config(4, n_cores=2)) as sess:
+            sess.run(tf.global_variables_initializer())
+            L1, L2 = sess.run(loss), sess.run(loss)
+            assert np.isfinite(L1) and np.isfinite(L2)
+            assert L1 != L2  # the towers draw new weight samples
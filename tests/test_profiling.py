@@ -0,0 +1,64 @@
+"""Test the per-layer profiling module."""
+import json
+
+import numpy as np
+import tensorflow as tf
+
+import aboleth as ab
+from aboleth.likelihoods import Normal
+from aboleth.profiling import profile, format_report, OTHER
+
+
+def test_layer_scopes(make_data):
+    """Test layers build their ops in nested scopes of their types."""
+    x, _, _ = make_data
+    with tf.Graph().as_default() as graph:
+        net = ab.Concat(ab.InputLayer(name='X', n_samples=3) >>
+                        ab.DenseVariational(output_dim=2),
+                        ab.InputLayer(name='X', n_samples=3) >>
+                        ab.DenseVariational(output_dim=2))
+        net(X=x.astype(np.float32))
+
+        scopes = graph.get_collection(ab.baselayers.LAYER_SCOPES)
+        assert "Concat/" in scopes
+        assert "Concat/DenseVariational/" in scopes
+        assert "Concat/DenseVariational_1/" in scopes
+        names = [op.name for op in graph.get_operations()]
+        assert any(n.startswith("Concat/DenseVariational_1/") for n in names)
+
+        # Variables are not in the layer scopes, so checkpoints still load
+        variables = [v.op.name for v in tf.global_variables()]
+        assert "W_mu_q" in variables and "W_mu_q_1" in variables
+        assert not any("Concat" in n for n in variables)
+
+
+def test_profile(make_data, tmpdir):
+    """Test profiling attributes the compute of a net to its layers."""
+    x, y, _ = make_data
+    x, y = x.astype(np.float32), y.astype(np.float32)
+    path = str(tmpdir.join("trace.json"))
+    with tf.Graph().as_default():
+        # A placeholder, so the tiled input is not folded into a constant
+        x_ = tf.placeholder(tf.float32, x.shape)
+        net = (ab.InputLayer(name='X', n_samples=3) >>
+               ab.RandomFourier(10, ab.RBF()) >>
+               ab.DenseVariational(output_dim=1))
+        Phi, KL = net(X=x_)
+        loss = ab.elbo(Phi, y, len(x), KL, Normal(variance=1.))
+        train = tf.train.AdamOptimizer().minimize(loss)
+
+        with tf.Session() as sess:
+            sess.run(tf.global_variables_initializer())
+            report = profile(train, feed_dict={x_: x}, session=sess,
+                             n_steps=3, trace_path=path)
+
+    scopes = {l["scope"]: l for l in report}
+    assert {"InputLayer", "RandomFourier", "DenseVariational",
+            OTHER} <= set(scopes)
+    assert scopes["DenseVariational"]["forward_ms"] > 0
+    assert scopes["DenseVariational"]["backward_ms"] > 0
+    assert np.isclose(sum(l["time_share"] for l in report), 1.)
+    assert isinstance(format_report(report), str)
+
+    with open(path) as f:
+        assert "traceEvents" in json.load(f)
@@ -0,0 +1,111 @@
+"""Test the prediction serving module."""
+import asyncio
+import threading
+import time
+
+import pytest
+import numpy as np
+import tensorflow as tf
+
+from aboleth.serving import BatchPredictor, session_predictor
+
+
+def test_batch_predictor_coalesces():
+    """Test requests are coalesced into batches and split back out."""
+    batch_sizes = []
+
+    def predict_fn(X):
+        batch_sizes.append(len(X))
+        time.sleep(0.01)
+        return 2 * X
+
+    with BatchPredictor(predict_fn, max_batch_size=8, max_latency=0.1) as bp:
+        futures = [bp.submit(np.full((2, 3), i)) for i in range(10)]
+        results = [f.result() for f in futures]
+        stats = bp.stats()
+
+    for i, r in enumerate(results):
+        assert r.shape == (2, 3)
+        assert np.all(r == 2 * i)
+
+    assert sum(batch_sizes) == 20
+    assert max(batch_sizes) <= 8
+    assert len(batch_sizes) < 10
+    assert stats['requests'] == 10
+    assert stats['rows'] == 20
+    assert stats['batches'] == len(batch_sizes)
+    assert stats['latency_p50'] <= stats['latency_p99']
+
+
+def test_batch_predictor_asyncio():
+    """Test the asyncio front end of the batch predictor."""
+    async def requests(bp):
+        return await asyncio.gather(*[bp.predict(np.ones((1, 1)) * i)
+                                      for i in range(5)])
+
+    loop = asyncio.new_event_loop()
+    with BatchPredictor(lambda X: X + 1, max_latency=0.05) as bp:
+        results = loop.run_until_complete(requests(bp))
+    loop.close()
+
+    for i, r in enumerate(results):
+        assert np.all(r == i + 1)
+
+
+def test_batch_predictor_exception():
+    """Test exceptions are passed on to the requests."""
+    def predict_fn(X):
+        raise ValueError("Bad prediction!")
+
+    with BatchPredictor(predict_fn) as bp:
+        future = bp.submit(np.ones((1, 1)))
+        with pytest.raises(ValueError):
+            future.result()
+
+
+def test_batch_predictor_cancel():
+    """Test cancelled requests are skipped, and do not stop the worker."""
+    started, release = threading.Event(), threading.Event()
+    batches = []
+
+    def predict_fn(X):
+        started.set()
+        release.wait()
+        batches.append(X)
+        return X
+
+    with BatchPredictor(predict_fn, max_latency=0.) as bp:
+        first = bp.submit(np.zeros((1, 1)))
+        started.wait()
+        cancelled = bp.submit(np.ones((1, 1)))
+        assert cancelled.cancel()
+        release.set()
+
+        later = bp.submit(np.full((1, 1), 2.))
+        assert np.all(later.result(timeout=5) == 2.)
+        assert np.all(first.result(timeout=5) == 0.)
+
+    assert cancelled.cancelled()
+    assert not any(np.any(X == 1.) for X in batches)
+
+
+@pytest.mark.parametrize('expected', [True, False])
+def test_session_predictor(expected):
+    """Test making a batch prediction function from a graph."""
+    S, D = 10, 3
+    X_ = tf.placeholder(tf.float32, (None, D))
+    Net = tf.tile(tf.expand_dims(X_, 0), [S, 1, 1])
+    X = np.random.randn(20, D).astype(np.float32)
+
+    tc = tf.test.TestCase()
+    with tc.test_session() as sess:
+        predict_fn = session_predictor(Net, X_, sess, expected=expected)
+        with BatchPredictor(predict_fn) as bp:
+            futures = [bp.submit(X[i:i + 5]) for i in range(0, 20, 5)]
+            pred = np.concatenate([f.result() for f in futures])
+
+    if expected:
+        assert np.allclose(pred, X)
+    else:
+        assert pred.shape == (20, S, D)
+        assert np.allclose(pred[:, 0], X)
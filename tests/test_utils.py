@@ -2,10 +2,12 @@
 
 from types import GeneratorType
 
+import pytest
 import numpy as np
 import tensorflow as tf
 
 import aboleth as ab
+from aboleth.util import _merge_moments
 
 
 def test_batch():
@@ -76,3 +78,53 @@ def test_predict_expected():
         samps = ab.predict_expected(Xt, {X_: X}, n_groups=10)  # 10 replicates
         assert samps.shape == (100, 1)
         assert np.allclose(samps, np.ones((100, 1)))  # test average on axis 0
+
+
+def test_predict_moments():
+    """Test the parallel predict_moments computation."""
+    X = np.ones((10, 100, 1), dtype=np.float32)
+    X_ = tf.placeholder(tf.float32, (10, None, 1))
+    Xt = tf.identity(X_)
+    R = tf.random_normal((10, 100, 1), seed=1)
+
+    tc = tf.test.TestCase()
+    with tc.test_session():
+        Ex, Vx = ab.predict_moments(Xt, {X_: X}, n_groups=10, n_threads=3)
+        assert Ex.shape == (100, 1)
+        assert Ex.dtype == Vx.dtype == np.float32
+        assert np.allclose(Ex, 1.)
+        assert np.allclose(Vx, 0.)
+
+        with pytest.raises(AssertionError):
+            ab.predict_moments(Xt, {X_: X}, n_groups=0)
+
+        Er, Vr = ab.predict_moments(R, n_groups=50, n_threads=4)
+        assert np.abs(Er.mean()) < 0.05
+        assert np.abs(Vr.mean() - 1.) < 0.05
+
+
+def test_merge_moments():
+    """Test the streaming merge of sample moments."""
+    X = np.random.RandomState(0).randn(37, 4, 2)
+    moments = (0, 0., 0.)
+    for g in np.array_split(X, [5, 6, 20]):
+        mean = g.mean(axis=0)
+        moments = _merge_moments(moments, (len(g), mean,
+                                           ((g - mean)**2).sum(axis=0)))
+    count, mean, sumsq = moments
+    assert count == len(X)
+    assert np.allclose(mean, X.mean(axis=0))
+    assert np.allclose(sumsq / count, X.var(axis=0))
+
+
+def test_pack_mask():
+    """Test packing masks, and unpacking them in the graph."""
+    mask = np.random.rand(10, 13) < 0.3
+    packed = ab.pack_mask(mask)
+    assert packed.dtype == np.uint8
+    assert packed.shape == (10, 2)
+
+    tc = tf.test.TestCase()
+    with tc.test_session():
+        unpacked = ab.util.unpack_mask(packed, 13).eval()
+        assert np.array_equal(unpacked, mask)